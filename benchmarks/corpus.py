@@ -0,0 +1,63 @@
+## Synthetic corpora for the benchmarks, of controlled size and reproducible
+## (seeded), drawn from the sentences of tests/data.
+
+import pathlib
+import random
+import re
+from typing import List
+
+DATA_DIR = pathlib.Path(__file__).resolve().parent.parent / "tests" / "data"
+
+
+def load_sentences(data_dir: pathlib.Path = DATA_DIR) -> List[str]:
+    sentences = []
+
+    for path in sorted(data_dir.glob("*.txt")):
+        for line in path.read_text(encoding="utf-8").splitlines():
+            sentences.extend(sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+", line) if sentence.strip())
+
+    return sentences
+
+
+def synthetic_texts(count: int, sentences_per_text: int = 3, seed: int = 0) -> List[str]:
+    ## `count` texts of `sentences_per_text` random sentences each
+    sentences = load_sentences()
+    rng = random.Random(seed)
+
+    return [" ".join(rng.choices(sentences, k=sentences_per_text)) for _ in range(count)]
+
+
+def _cell_texts(sentences: List[str]) -> List[str]:
+    ## Short fragments, as found in table cells: "Bern", "the Swiss Plateau", ...
+    fragments = set()
+
+    for sentence in sentences:
+        for part in re.split(r"[,;:()]| and | of | in ", sentence):
+            words = part.split()
+            if 0 < len(words) <= 4:
+                fragments.add(" ".join(words))
+
+    return sorted(fragments)
+
+
+def synthetic_tables(count: int, rows: int = 10, cols: int = 5, seed: int = 0) -> List[List[List[dict]]]:
+    ## `count` tables in the CCS format, with a header row
+    cell_texts = _cell_texts(load_sentences())
+    rng = random.Random(seed)
+
+    tables = []
+    for _ in range(count):
+        table = []
+        for row in range(rows):
+            table.append([
+                {
+                    "bbox": [],
+                    "spans": [[row, col]],
+                    "text": rng.choice(cell_texts),
+                    "type": "col_header" if row == 0 else "body",
+                }
+                for col in range(cols)
+            ])
+        tables.append(table)
+
+    return tables
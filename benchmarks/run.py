@@ -0,0 +1,330 @@
+## Offline benchmarks of the annotators and of the HTTP path (in-process, no server needed):
+##
+##   python -m benchmarks.run --size small --output results.json
+##   python -m benchmarks.run --size small --baseline results.json   # flags regressions
+##
+## Results are JSON: the timings (seconds per run) and throughputs of every benchmark,
+## with the environment they were measured in. With --baseline, every benchmark is
+## compared with the stored result, and the exit status is 1 if one got slower
+## than the --threshold.
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from benchmarks.corpus import synthetic_tables, synthetic_texts
+
+## Size of the corpora
+SIZES = {
+    "small": {"texts": 200, "tables": 20, "requests": 40, "request_texts": 16},
+    "medium": {"texts": 2000, "tables": 200, "requests": 200, "request_texts": 32},
+    "large": {"texts": 20000, "tables": 2000, "requests": 1000, "request_texts": 64},
+}
+
+## name -> setup(size, seed), a context manager yielding (run, units)
+BENCHMARKS: Dict[str, Callable[[dict, int], Any]] = {}
+
+
+class Skip(Exception):
+    ## Raised by a setup when the benchmark can't run here (e.g. a missing model)
+    pass
+
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = contextlib.contextmanager(setup)
+        return setup
+
+    return register
+
+
+def _text_units(texts: List[str]) -> Dict[str, int]:
+    return {"items": len(texts), "chars": sum(len(text) for text in texts)}
+
+
+@benchmark("dictionary.annotate_entities_text")
+def _dictionary_text(size: dict, seed: int) -> Iterator[Tuple[Callable[[], Any], Dict[str, int]]]:
+    from nlp_annotator_api.annotators.entities.CitiesAnnotator import CitiesAnnotator
+
+    annot = CitiesAnnotator()
+    annot.initialize()
+    texts = synthetic_texts(size["texts"], seed=seed)
+
+    yield (lambda: [annot.annotate_entities_text(text) for text in texts]), _text_units(texts)
+
+
+@benchmark("dictionary_index.annotate_entities_text")
+def _dictionary_index_text(size: dict, seed: int):
+    ## All the geography dictionaries at once, as used by SimpleTextGeographyAnnotator
+    from nlp_annotator_api.annotators.SimpleTextGeographyAnnotator import SimpleTextGeographyAnnotator
+
+    annot = SimpleTextGeographyAnnotator()
+    annot.warm_up()
+    texts = synthetic_texts(size["texts"], seed=seed)
+
+    yield (lambda: annot.annotate_batched_entities("text", texts, None)), _text_units(texts)
+
+
+@benchmark("table.annotate_entities_table")
+def _table(size: dict, seed: int):
+    from nlp_annotator_api.annotators.TextTableGeographyAnnotator import TextTableGeographyAnnotator
+
+    annot = TextTableGeographyAnnotator()
+    annot.warm_up()
+    tables = synthetic_tables(size["tables"], seed=seed)
+    entity_names = annot.entity_names
+    units = {
+        "items": len(tables),
+        "chars": sum(len(cell["text"]) for table in tables for row in table for cell in row),
+    }
+
+    yield (lambda: [annot.annotate_entities_table(table, entity_names) for table in tables]), units
+
+
+@benchmark("relationships.multi_entities")
+def _relationships(size: dict, seed: int):
+    from nlp_annotator_api.annotators.SimpleTextGeographyAnnotator import SimpleTextGeographyAnnotator
+    from nlp_annotator_api.annotators.relationships.CitiesToCountriesAnnotator import CitiesToCountriesAnnotator
+
+    texts = synthetic_texts(size["texts"], seed=seed)
+
+    entities = SimpleTextGeographyAnnotator()
+    entities.warm_up()
+    entity_maps = entities.annotate_batched_entities("text", texts, None)
+
+    annot = CitiesToCountriesAnnotator()
+
+    yield (lambda: [
+        annot.annotate_relationships_text(text, entity_map) for text, entity_map in zip(texts, entity_maps)
+    ]), _text_units(texts)
+
+
+@benchmark("scispacy.annotate_batched_entities")
+def _scispacy(size: dict, seed: int):
+    try:
+        from nlp_annotator_api.annotators.ScispacyBiomedAnnotator import ScispacyBiomedAnnotator
+
+        annot = ScispacyBiomedAnnotator()
+        annot.warm_up()
+    except Exception as exc:
+        raise Skip(f"scispacy is not available: {exc!r}")
+
+    ## The models are much slower than the dictionaries
+    texts = synthetic_texts(max(1, size["texts"] // 10), seed=seed)
+
+    yield (lambda: annot.annotate_batched_entities("text", texts, None)), _text_units(texts)
+
+
+@benchmark("http.run_nlp_annotator")
+def _http(size: dict, seed: int):
+    ## Concurrent find_entities requests through the whole application (aiohttp,
+    ## connexion, scheduler, executors), with an in-process test client.
+    from nlp_annotator_api.config.config import conf
+
+    ## Every run must annotate, not hit the caches.
+    conf.memory_cache = None
+    conf.redis_cache = None
+
+    from aiohttp.test_utils import TestClient, TestServer
+
+    from nlp_annotator_api.server.app import aiohttp_app
+
+    ## Set up by the app: logging every request to the console would be measured too.
+    for logger_name in ("nlp_annotator_api", "aiohttp", "connexion", "cps-nlp"):
+        logging.getLogger(logger_name).setLevel(logging.WARNING)
+
+    request_texts = size["request_texts"]
+    texts = synthetic_texts(size["requests"] * request_texts, seed=seed)
+    bodies = [
+        json.dumps({"find_entities": {
+            ## null for all the entities: an empty list would match none
+            "object_type": "text", "entity_names": None, "texts": texts[start:start + request_texts],
+        }})
+        for start in range(0, len(texts), request_texts)
+    ]
+    headers = {"Authorization": conf.auth.api_key or "", "Content-Type": "application/json"}
+    concurrency = 8
+
+    loop = asyncio.new_event_loop()
+    client = TestClient(TestServer(aiohttp_app), loop=loop)
+    loop.run_until_complete(client.start_server())
+
+    async def send(body: str, semaphore: asyncio.Semaphore, latencies: List[float]):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/api/v1/annotators/SimpleTextGeographyAnnotator", data=body, headers=headers)
+            await response.read()
+            latencies.append(time.perf_counter() - start)
+
+            if response.status != 200:
+                raise RuntimeError(f"Request failed with status {response.status}")
+
+    async def load():
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: List[float] = []
+        await asyncio.gather(*(send(body, semaphore, latencies) for body in bodies))
+
+        latencies.sort()
+        return {
+            "requests": len(bodies),
+            "concurrency": concurrency,
+            "latency_p50": latencies[len(latencies) // 2],
+            "latency_p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        }
+
+    try:
+        yield (lambda: loop.run_until_complete(load())), _text_units(texts)
+    finally:
+        loop.run_until_complete(client.close())
+        loop.close()
+
+
+def measure(name: str, size: dict, seed: int, repeat: int) -> Dict[str, Any]:
+    try:
+        with BENCHMARKS[name](size, seed) as (run, units):
+            run()  # warm-up
+
+            timings, extra = [], None
+            for _ in range(repeat):
+                gc.collect()
+                start = time.perf_counter()
+                extra = run()
+                timings.append(time.perf_counter() - start)
+    except Skip as exc:
+        return {"skipped": str(exc)}
+
+    median = statistics.median(timings)
+    result = {
+        "repeat": repeat,
+        "units": units,
+        "seconds": {"min": min(timings), "median": median, "mean": statistics.mean(timings), "max": max(timings)},
+        "throughput": {f"{unit}_per_s": count / median for unit, count in units.items()},
+    }
+    if isinstance(extra, dict):
+        result["extra"] = extra
+
+    return result
+
+
+def _environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "timestamp": datetime.now(tz=timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    ## Output: one row per benchmark measured in both, with `regression` set if it got
+    ## slower than `threshold` (relative to the baseline median).
+    rows = []
+
+    for name, result in results["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None or "seconds" not in base or "seconds" not in result:
+            continue
+
+        before, after = base["seconds"]["median"], result["seconds"]["median"]
+        change = (after - before) / before if before else 0.0
+
+        rows.append({
+            "name": name,
+            "baseline": before,
+            "current": after,
+            "change": change,
+            "regression": change > threshold,
+        })
+
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run",
+        description="Offline benchmarks of the annotators and of the HTTP path, compared with a baseline.",
+    )
+
+    parser.add_argument("--size", choices=sorted(SIZES), default="small", help="size of the corpora")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs of every benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic corpora")
+    parser.add_argument("--filter", default=None, help="only the benchmarks whose name matches this regex")
+    parser.add_argument("--output", default=None, help="JSON file of the results (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="relative slowdown of the median flagged as a regression")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    size = SIZES[args.size]
+
+    names = [name for name in BENCHMARKS if args.filter is None or re.search(args.filter, name)]
+
+    results = {
+        "environment": _environment(),
+        "parameters": {"size": args.size, "repeat": args.repeat, "seed": args.seed},
+        "benchmarks": {},
+    }
+
+    for name in names:
+        result = results["benchmarks"][name] = measure(name, size, args.seed, args.repeat)
+
+        if "skipped" in result:
+            print(f"{name:45} skipped: {result['skipped']}", file=sys.stderr)
+        else:
+            print(
+                f"{name:45} {result['seconds']['median'] * 1000:10.1f} ms"
+                f" {result['throughput']['items_per_s']:12.1f} items/s",
+                file=sys.stderr,
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+
+    rows = compare(results, baseline, args.threshold)
+    for row in rows:
+        print(
+            f"{row['name']:45} {row['baseline'] * 1000:10.1f} ms -> {row['current'] * 1000:10.1f} ms"
+            f" {row['change']:+8.1%}{'  REGRESSION' if row['regression'] else ''}",
+            file=sys.stderr,
+        )
+
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
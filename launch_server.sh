@@ -1 +1 @@
-python3 -m nlp_annotator_api.server.app
+python3 -m nlp_annotator_api.server.launcher
@@ -13,6 +13,10 @@ class AnnotatorMetadata(DataClassJsonMixin):
 
 
 class AbstractAnnotator(ABC):
+    ## Set in the workers of the process pool, which must not start processes of their own
+    ## (e.g. spaCy's `n_process`): they would multiply with the workers, and daemonic workers can't.
+    in_process_pool = False
+
     @staticmethod
     def annotator_metadata(parameters=None) -> AnnotatorMetadata:
         return AnnotatorMetadata(
@@ -22,3 +26,14 @@ class AbstractAnnotator(ABC):
             author="IBM Research Europe – DeepSearch team",
             description="This annotator is an example usage of dictionaries and open pre-trained models integrating with the DeepSearch CPS platform."
         )
+
+    @classmethod
+    def content_version(cls) -> str:
+        ## Identifies what the annotator loads (dictionaries, models), whose changes change its output.
+        ## Part of the cache keys of its results, must not depend on the process.
+        return ""
+
+    def warm_up(self):
+        ## Load (or compile) whatever the annotator loads lazily, so that no request pays for it.
+        ## Called at startup and in every worker before its first request.
+        pass
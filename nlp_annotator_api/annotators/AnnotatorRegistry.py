@@ -0,0 +1,172 @@
+import logging
+logger = logging.getLogger('cps-nlp')
+import gc
+import importlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Mapping
+
+from nlp_annotator_api.config.config import AnnotatorsConfig
+
+from .AbstractAnnotator import AbstractAnnotator
+
+
+def rss_bytes() -> int:
+    ## Resident memory of the current process, 0 where /proc is not available
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+class AnnotatorRegistry(Mapping):
+    """
+    Annotators by name, instantiated (and warmed up) the first time they are requested.
+
+    The memory taken by every annotator is measured when it is loaded. When the
+    loaded annotators exceed the memory budget, the least recently used ones are
+    unloaded, except the pinned ones. Listing or testing the names does not load
+    anything.
+
+    The classes are imported once, by `resolve` at startup: an annotator
+    which cannot be imported (e.g. a missing model package) is reported then,
+    and removed. Their classes and versions are then available without
+    importing or reading anything, e.g. on the event loop.
+    """
+
+    def __init__(self, class_paths: Dict[str, str], config: AnnotatorsConfig):
+        ## `class_paths`: name -> "module:ClassName"
+        self._class_paths = dict(class_paths)
+        self.config = config
+
+        self._classes: Dict[str, type] = {}
+        self._versions: Dict[str, str] = {}
+        self._loaded: "OrderedDict[str, AbstractAnnotator]" = OrderedDict()
+        # Resident memory taken by the loading of every annotator
+        self.sizes: Dict[str, int] = {}
+        self.load_seconds: Dict[str, float] = {}
+
+        self._lock = threading.Lock()
+        ## One load at a time: the size of a load is measured as the growth of
+        ## the whole process, which would include the concurrent loads.
+        self._load_lock = threading.Lock()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._class_paths)
+
+    def __len__(self) -> int:
+        return len(self._class_paths)
+
+    def __contains__(self, name) -> bool:
+        return name in self._class_paths
+
+    def loaded(self) -> List[str]:
+        return list(self._loaded)
+
+    def resolve(self):
+        ## Import the classes of all the annotators, drop the ones which cannot be imported
+        for name in list(self._class_paths):
+            try:
+                self.annotator_class(name)
+            except ImportError:
+                logger.exception("cannot import annotator %r, it is not available", name)
+                del self._class_paths[name]
+                continue
+
+            self.version(name)
+
+    def annotator_class(self, name: str) -> type:
+        ## The class, without instantiating it (e.g. for `annotator_metadata`).
+        ## Imported on first use if `resolve` did not run.
+        cls = self._classes.get(name)
+        if cls is None:
+            module_name, _, class_name = self._class_paths[name].partition(":")
+            cls = self._classes[name] = getattr(importlib.import_module(module_name), class_name)
+
+        return cls
+
+    def version(self, name: str) -> str:
+        ## Version of the annotator and of its content, e.g. for cache keys
+        version = self._versions.get(name)
+        if version is None:
+            cls = self.annotator_class(name)
+            version = self._versions[name] = f"{cls.annotator_metadata().version}+{cls.content_version()}"
+
+        return version
+
+    def __getitem__(self, name: str) -> AbstractAnnotator:
+        if name not in self._class_paths:
+            raise KeyError(name)
+
+        with self._lock:
+            annot = self._loaded.get(name)
+            if annot is not None:
+                self._loaded.move_to_end(name)
+                return annot
+
+        ## Loading can take long (e.g. spaCy models), the loaded annotators stay available meanwhile.
+        with self._load_lock:
+            with self._lock:
+                annot = self._loaded.get(name)
+                if annot is not None:
+                    self._loaded.move_to_end(name)
+                    return annot
+
+            annot = self._load(name)
+
+            with self._lock:
+                self._loaded[name] = annot
+                self._evict(keep=name)
+
+        return annot
+
+    def _load(self, name: str) -> AbstractAnnotator:
+        rss_before = rss_bytes()
+        start = time.monotonic()
+
+        annot = self.annotator_class(name)()
+        annot.warm_up()
+
+        self.load_seconds[name] = time.monotonic() - start
+        self.sizes[name] = max(0, rss_bytes() - rss_before)
+
+        logger.info(
+            "loaded annotator %r in %.2fs (%.1f MB)", name, self.load_seconds[name], self.sizes[name] / 1024**2
+        )
+
+        return annot
+
+    def _evict(self, keep: str):
+        budget = self.config.memory_budget_mb
+        if budget is None:
+            return
+
+        evicted = False
+        while sum(self.sizes.get(name, 0) for name in self._loaded) > budget * 1024**2:
+            candidates = [name for name in self._loaded if name != keep and name not in self.config.pinned]
+
+            if not candidates:
+                logger.warning("annotators %r exceed the memory budget, but none can be unloaded", self.loaded())
+                break
+
+            # The least recently used come first
+            name = candidates[0]
+            del self._loaded[name]
+            evicted = True
+
+            logger.info("unloaded annotator %r (%.1f MB)", name, self.sizes.get(name, 0) / 1024**2)
+
+        if evicted:
+            gc.collect()
+
+    def preload(self):
+        ## Load the annotators configured to be loaded upfront
+        for name in dict.fromkeys(self.config.preload + self.config.pinned):
+            if name not in self._class_paths:
+                logger.warning("cannot preload unknown annotator %r", name)
+                continue
+
+            self[name]
@@ -9,6 +9,8 @@ from typing import Optional, List, Dict
 import spacy
 
 from nlp_annotator_api.annotators.AbstractAnnotator import AbstractAnnotator
+from nlp_annotator_api.annotators.table_utils import to_table_entities, unique_cell_texts
+from nlp_annotator_api.config.config import conf, ScispacyBiomedAnnotatorConfig
 
 logger = logging.getLogger('cps-nlp')
 
@@ -38,15 +40,28 @@ class ScispacyBiomedAnnotator(AbstractAnnotator):
     supports = ('text', 'table', )
 
 
-    def __init__(self, config=None):
+    def __init__(self, config: Optional[ScispacyBiomedAnnotatorConfig] = None):
         if config is None:
-            config = {}
+            config = conf.scispacy_biomed_annotator
 
+        self.config = config
+        self._warned_n_process = False
         self.initialize()
 
+    @classmethod
+    def content_version(cls):
+        ## The models, and the versions installed
+        return ",".join(f"{model}=={spacy.util.get_package_version(model)}" for model in _models)
+
     def initialize(self):
         self.nlps = [ spacy.load(model) for model in _models ]
 
+        ## Components not needed for the NER output (tagger, parser, ...) are skipped by `nlp.pipe`.
+        self.disabled_components = [
+            [name for name in nlp.pipe_names if name not in self.config.keep_components]
+            for nlp in self.nlps
+        ]
+
         self.ent_to_models = {}
         self.labels = {
             'entities': [],
@@ -80,21 +95,55 @@ class ScispacyBiomedAnnotator(AbstractAnnotator):
     def get_labels(self):
         return self.labels
 
+    def _doc_entities(self, doc, text):
+        matches = []
+        for ent in doc.ents:
+            tmp = {
+                "match" : ent.text,
+                "original": text[ent.start_char:ent.end_char],
+                "range" : [ent.start_char,ent.end_char],
+                "type"  : ent.label_.lower()
+            }
+            matches.append(tmp)
+        return matches
+
     def annotate_with_spacy(self, text, nlps):
         matches = []
         for nlp_i, nlp in enumerate(nlps):
             logger.debug("Running model %s of %s", nlp_i, len(nlps))
             doc = nlp(text)
-            for ent in doc.ents:
-                tmp = {
-                    "match" : ent.text,
-                    "original": text[ent.start_char:ent.end_char],
-                    "range" : [ent.start_char,ent.end_char],
-                    "type"  : ent.label_.lower()
-                }
-                matches.append(tmp)
+            matches.extend(self._doc_entities(doc, text))
         return matches
 
+    def annotate_texts_with_spacy(self, texts: List[str], models_ix) -> List[list]:
+        ## Stream all the texts through the batched pipeline of every model.
+        ## Output: one list of entities per text.
+        matches = [[] for _ in texts]
+        for model_ix in models_ix:
+            logger.debug("Running model %s on %s texts", _models[model_ix], len(texts))
+            docs = self.nlps[model_ix].pipe(
+                texts,
+                batch_size=self.config.batch_size,
+                n_process=self._n_process(),
+                disable=self.disabled_components[model_ix],
+            )
+            for text_matches, text, doc in zip(matches, texts, docs):
+                text_matches.extend(self._doc_entities(doc, text))
+        return matches
+
+    def _n_process(self) -> int:
+        if self.in_process_pool and self.config.n_process > 1:
+            if not self._warned_n_process:
+                logger.warning("n_process=%r is not applied in the process pool workers, using 1", self.config.n_process)
+                self._warned_n_process = True
+            return 1
+
+        return self.config.n_process
+
+    def _selected_models(self, desired_entities: List[str]) -> List[int]:
+        ## Identify which models should be executed to produce the entities
+        return sorted(set([self.ent_to_models[ent_name] for ent_name in desired_entities]))
+
     def annotate_batched_entities(self, object_type, items: List, entity_names: Optional[List[str]]) -> List[dict]:
  
         ## An item is a string if object_type == "text", and List[List[dict]] if object_type == "table"
@@ -107,17 +156,33 @@ class ScispacyBiomedAnnotator(AbstractAnnotator):
 
         results = []
 
+        items_entities = None
+        if object_type in ("text", "table"):
+            ## Annotate all items in one batched call.
+            ## If it fails, fall back to the item by item loop below, which isolates the failing items.
+            try:
+                if object_type == "text":
+                    items_entities = self.annotate_batched_texts(items, desired_entities)
+                else:
+                    items_entities = self.annotate_batched_tables(items, desired_entities)
+            except Exception as exc:
+                logger.exception("Error in batched annotator for object_type " + object_type
+                                  + ", annotating the items one by one")
+
         ## Iterate over all items, provide all desired entities,
         ## and sort them by category.
         ## (Because many NER models provide multiple entities.)
-        for item in items:
+        for item_ix, item in enumerate(items):
             entity_map = {}
-            try:
-                cps_entities = self.annotate_entities(object_type, item, desired_entities)
-            except Exception as exc:
-                cps_entities = []
-                logger.exception("Error in annotator for object_type " + object_type
-                                  + " with this content: " + str(item))
+            if items_entities is not None:
+                cps_entities = items_entities[item_ix]
+            else:
+                try:
+                    cps_entities = self.annotate_entities(object_type, item, desired_entities)
+                except Exception as exc:
+                    cps_entities = []
+                    logger.exception("Error in annotator for object_type " + object_type
+                                      + " with this content: " + str(item))
             for entity_name in desired_entities:
                 entity_map[entity_name] = [entity for entity in cps_entities if entity["type"] == entity_name]
             results.append(entity_map)
@@ -127,10 +192,21 @@ class ScispacyBiomedAnnotator(AbstractAnnotator):
 
         return results
 
+    def annotate_batched_texts(self, texts: List[str], desired_entities: List[str]) -> List[list]:
+        ## Annotate many texts with the desired entities.
+        ## Output: one list of entities in CPS format per text.
+        if not texts or not desired_entities:
+            return [[] for _ in texts]
+
+        all_matched_entities = self.annotate_texts_with_spacy(texts, self._selected_models(desired_entities))
+        return [
+            [ent for ent in text_entities if ent['type'] in desired_entities]
+            for text_entities in all_matched_entities
+        ]
+
     def annotate_entities(self, object_type, item, desired_entities: List[str]) -> list:
         ## Identify which models should be executed to produce the entities
-        selected_models_ix = set([self.ent_to_models[ent_name] for ent_name in desired_entities])
-        selected_nlps = [self.nlps[ix] for ix in selected_models_ix]
+        selected_nlps = [self.nlps[ix] for ix in self._selected_models(desired_entities)]
 
         ## Annotate one item with the desired entities.
         ## Output: List of entities in CPS format, different for text, table, or images
@@ -145,37 +221,17 @@ class ScispacyBiomedAnnotator(AbstractAnnotator):
     def annotate_entities_table(self, table: List[List[dict]], desired_entities: List[str]) -> list:
         ## Annotate one table with the desired entities.
         ## Output: List of entities in CPS format for table entities.
+        return self.annotate_batched_tables([table], desired_entities)[0]
+
+    def annotate_batched_tables(self, tables: List[List[List[dict]]], desired_entities: List[str]) -> List[list]:
+        ## Annotate many tables with the desired entities.
+        ## Output: one list of entities in CPS format for table entities per table.
 
         ## This annotator annotates cell texts individually, using the text annotator.
+        ## The distinct cell texts of all tables are annotated in a single batched call,
+        ## and their entities are then mapped back to the cells.
         ## Only if you want something more complex, you need to change something here.
+        texts = unique_cell_texts(tables)
+        entities_by_text = dict(zip(texts, self.annotate_batched_texts(texts, desired_entities)))
 
-        # print("------ Starting 'annotate_entities_table' -------")
-        # print("-------with this table: ")
-        # print(table)
-        table_entities = []
-        for i, row in enumerate(table):
-            for j, cell in enumerate(row): 
-                text_entities = self.annotate_entities("text", cell["text"], desired_entities)
-                ## Extend from text-entity CPS format with fields type, match, original, range 
-                #  to table-entity CPS format, which looks like this:
-                # {
-                #     "cell_type": "body",
-                #     "coords": [[ 1, 0]], ## Coordinates of the cell within the table, here row 1, cell 0
-                #     "match": "Amsterdam",
-                #     "original": "Amsterdam",
-                #     "prov": "data",
-                #     "range": [0, 10 ], ## Start character and end+1 of match within cell
-                #     "source_field": "data",
-                #     "source_field_type": "table",
-                #     "type": "cities"
-                # },
-                for entity in text_entities:
-                    entity["cell_type"] = cell["type"]
-                    entity["coords"] = cell["spans"]
-                    entity["prov"] = "data"
-                    entity["source_field"] = "data"
-                    entity["source_field_type"] = "table"
-                    table_entities.append(entity)
-        #print("Table entities returned from 'annotate_entities_table': ")
-        #pprint.pprint(table_entities)  
-        return table_entities
+        return [to_table_entities(table, entities_by_text) for table in tables]
@@ -17,6 +17,7 @@ from typing import List, Optional
 from .entities.CitiesAnnotator import CitiesAnnotator
 from .entities.CountriesAnnotator import CountriesAnnotator
 from .entities.ProvinciesAnnotator import ProvinciesAnnotator
+from .entities.common.DictionaryEntityIndex import DictionaryEntityIndex
 
 from .relationships.CitiesToCountriesAnnotator import CitiesToCountriesAnnotator
 from .relationships.CitiesToProvinciesAnnotator import CitiesToProvinciesAnnotator
@@ -51,6 +52,13 @@ class SimpleTextGeographyAnnotator(AbstractAnnotator):
         self.property_names = [] # This example annotator does not have any property annotator
         self.labels = self._generate_annotator_labels()
 
+    @classmethod
+    def content_version(cls):
+        return DictionaryEntityIndex(annot_cls() for annot_cls in cls._ent_annotator_classes).version()
+
+    def warm_up(self):
+        self._ent_index.initialize()
+
     def get_entity_names(self):
         return self.entity_names
 
@@ -98,6 +106,9 @@ class SimpleTextGeographyAnnotator(AbstractAnnotator):
             annot = cls()
             self._ent_annots[annot.key()] = annot
 
+        # Merged index, so that a text is scanned once for all entity types
+        self._ent_index = DictionaryEntityIndex(self._ent_annots.values())
+
         # Initialize dict of annotator instances `self._rel_annots`
         for cls in self._rel_annotator_classes:
             annot = cls()
@@ -138,10 +149,7 @@ class SimpleTextGeographyAnnotator(AbstractAnnotator):
         ## Annotate one item with the desired entities.
         ## Output: List of entities in CPS format, different for text, table, or images
         if object_type == "text":
-            matched_entities = []
-            for entity_name in desired_entities:
-                matched_entities.extend(self._ent_annots[entity_name].annotate_entities_text(item))
-            return matched_entities
+            return self._ent_index.annotate_entities_text(item, desired_entities)
         # elif object_type == "table":
         #     return self.annotate_entities_table(item, desired_entities)
         ## By the validation code in 'annotate_controller.py' no other object_type can get here. 
@@ -9,6 +9,7 @@
 import logging
 
 from .AbstractAnnotator import AbstractAnnotator
+from .table_utils import to_table_entities, unique_cell_texts
 
 logger = logging.getLogger('cps-nlp')
 from typing import List, Optional
@@ -17,6 +18,7 @@ from typing import List, Optional
 from .entities.CitiesAnnotator import CitiesAnnotator
 from .entities.CountriesAnnotator import CountriesAnnotator
 from .entities.ProvinciesAnnotator import ProvinciesAnnotator
+from .entities.common.DictionaryEntityIndex import DictionaryEntityIndex
 
 from .relationships.CitiesToCountriesAnnotator import CitiesToCountriesAnnotator
 from .relationships.CitiesToProvinciesAnnotator import CitiesToProvinciesAnnotator
@@ -51,6 +53,13 @@ class TextTableGeographyAnnotator(AbstractAnnotator):
         self.property_names = [] # This example annotator does not have any property annotator
         self.labels = self._generate_annotator_labels()
 
+    @classmethod
+    def content_version(cls):
+        return DictionaryEntityIndex(annot_cls() for annot_cls in cls._ent_annotator_classes).version()
+
+    def warm_up(self):
+        self._ent_index.initialize()
+
     def get_entity_names(self):
         return self.entity_names
 
@@ -98,6 +107,9 @@ class TextTableGeographyAnnotator(AbstractAnnotator):
             annot = cls()
             self._ent_annots[annot.key()] = annot
 
+        # Merged index, so that a text is scanned once for all entity types
+        self._ent_index = DictionaryEntityIndex(self._ent_annots.values())
+
         # Initialize dict of annotator instances `self._rel_annots`
         for cls in self._rel_annotator_classes:
             annot = cls()
@@ -114,17 +126,33 @@ class TextTableGeographyAnnotator(AbstractAnnotator):
 
         results = []
 
+        items_entities = None
+        if object_type in ("text", "table"):
+            ## Annotate all items in one batched call.
+            ## If it fails, fall back to the item by item loop below, which isolates the failing items.
+            try:
+                if object_type == "text":
+                    items_entities = self.annotate_batched_texts(items, desired_entities)
+                else:
+                    items_entities = self.annotate_batched_tables(items, desired_entities)
+            except Exception as exc:
+                logger.exception("Error in batched annotator for object_type " + object_type
+                                  + ", annotating the items one by one")
+
         ## Iterate over all items, provide all desired entities,
         ## and sort them by category.
         ## (Because many NER models provide multiple entities.)
-        for item in items:
+        for item_ix, item in enumerate(items):
             entity_map = {}
-            try:
-                cps_entities = self.annotate_entities(object_type, item, desired_entities)
-            except Exception as exc:
-                cps_entities = []
-                logger.exception("Error in annotator for object_type " + object_type
-                                  + " with this content: " + str(item))
+            if items_entities is not None:
+                cps_entities = items_entities[item_ix]
+            else:
+                try:
+                    cps_entities = self.annotate_entities(object_type, item, desired_entities)
+                except Exception as exc:
+                    cps_entities = []
+                    logger.exception("Error in annotator for object_type " + object_type
+                                      + " with this content: " + str(item))
             for entity_name in desired_entities:
                 entity_map[entity_name] = [entity for entity in cps_entities if entity["type"] == entity_name]
             results.append(entity_map)
@@ -134,14 +162,16 @@ class TextTableGeographyAnnotator(AbstractAnnotator):
 
         return results
 
+    def annotate_batched_texts(self, texts: List[str], desired_entities: List[str]) -> List[list]:
+        ## Annotate many texts with the desired entities.
+        ## Output: one list of entities in CPS format per text.
+        return [self._ent_index.annotate_entities_text(text, desired_entities) for text in texts]
+
     def annotate_entities(self, object_type, item, desired_entities: List[str]) -> list:
         ## Annotate one item with the desired entities.
         ## Output: List of entities in CPS format, different for text, table, or images
         if object_type == "text":
-            matched_entities = []
-            for entity_name in desired_entities:
-                matched_entities.extend(self._ent_annots[entity_name].annotate_entities_text(item))
-            return matched_entities
+            return self._ent_index.annotate_entities_text(item, desired_entities)
         elif object_type == "table":
             return self.annotate_entities_table(item, desired_entities)
         ## By the validation code in 'annotate_controller.py' no other object_type can get here. 
@@ -149,40 +179,20 @@ class TextTableGeographyAnnotator(AbstractAnnotator):
     def annotate_entities_table(self, table: List[List[dict]], desired_entities: List[str]) -> list:
         ## Annotate one table with the desired entities.
         ## Output: List of entities in CPS format for table entities.
+        return self.annotate_batched_tables([table], desired_entities)[0]
+
+    def annotate_batched_tables(self, tables: List[List[List[dict]]], desired_entities: List[str]) -> List[list]:
+        ## Annotate many tables with the desired entities.
+        ## Output: one list of entities in CPS format for table entities per table.
 
         ## This annotator annotates cell texts individually, using the text annotator.
+        ## The distinct cell texts of all tables are annotated in a single batched call,
+        ## and their entities are then mapped back to the cells.
         ## Only if you want something more complex, you need to change something here.
+        texts = unique_cell_texts(tables)
+        entities_by_text = dict(zip(texts, self.annotate_batched_texts(texts, desired_entities)))
 
-        # print("------ Starting 'annotate_entities_table' -------")
-        # print("-------with this table: ")
-        # print(table)
-        table_entities = []
-        for i, row in enumerate(table):
-            for j, cell in enumerate(row): 
-                text_entities = self.annotate_entities("text", cell["text"], desired_entities)
-                ## Extend from text-entity CPS format with fields type, match, original, range 
-                #  to table-entity CPS format, which looks like this:
-                # {
-                #     "cell_type": "body",
-                #     "coords": [[ 1, 0]], ## Coordinates of the cell within the table, here row 1, cell 0
-                #     "match": "Amsterdam",
-                #     "original": "Amsterdam",
-                #     "prov": "data",
-                #     "range": [0, 10 ], ## Start character and end+1 of match within cell
-                #     "source_field": "data",
-                #     "source_field_type": "table",
-                #     "type": "cities"
-                # },
-                for entity in text_entities:
-                    entity["cell_type"] = cell["type"]
-                    entity["coords"] = cell["spans"]
-                    entity["prov"] = "data"
-                    entity["source_field"] = "data"
-                    entity["source_field_type"] = "table"
-                    table_entities.append(entity)
-        #print("Table entities returned from 'annotate_entities_table': ")
-        #pprint.pprint(table_entities)  
-        return table_entities
+        return [to_table_entities(table, entities_by_text) for table in tables]
 
     def annotate_batched_relationships(self, texts: List[str], entities: List[dict], relationship_names: Optional[List[str]]) -> List[dict]:
         if relationship_names is None:
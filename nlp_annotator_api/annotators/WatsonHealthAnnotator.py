@@ -1,10 +1,12 @@
+import asyncio
+import json
 import logging
+import os
 import re
-import time
-import requests
+import threading
+import aiohttp
 from typing import Optional, Any, List, Dict
 from json import JSONDecodeError
-from requests.auth import HTTPBasicAuth
 
 from nlp_annotator_api.annotators.AbstractAnnotator import AbstractAnnotator
 from nlp_annotator_api.config.config import conf
@@ -20,13 +22,60 @@ def _kebab_case(text):
     return _camel_case_pattern.sub('-', text).lower()
 
 
+class _ApiClient:
+    """
+    Runs the calls to the API on a background event loop, so that the
+    synchronous annotator interface can send many requests concurrently
+    over one persistent pool of connections.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # The loop thread does not survive a fork, start a new one in the child.
+            if self._loop is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._session = None
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="watson-health-client", daemon=True
+                ).start()
+
+            return self._loop
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result()
+
+    def session(self) -> aiohttp.ClientSession:
+        # Only called from the background loop.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=conf.watson_health_annotator.connection_pool_size),
+            )
+
+        return self._session
+
+
 class WatsonHealthAnnotator(AbstractAnnotator):
     supports = ('text',)
 
+    def __init__(self):
+        self._client = _ApiClient()
+
     @staticmethod
     def key():
         return "watson-health-annotator"
 
+    @classmethod
+    def content_version(cls):
+        ## The service's model is not known, only the flow used
+        return conf.watson_health_annotator.flow_name
+
     @staticmethod
     def get_labels(parameters=None):
         default_output = {
@@ -99,14 +148,26 @@ class WatsonHealthAnnotator(AbstractAnnotator):
             if unstructured_texts:
                 yield unstructured_texts
 
+        return self._client.run(self._annotate_chunks(list(chunks_by_size()), entity_names))
+
+    async def _annotate_chunks(self, chunks, entity_names) -> list:
+        # The chunks are sent concurrently, up to `max_concurrency` at a time.
+        semaphore = asyncio.Semaphore(max(1, conf.watson_health_annotator.max_concurrency))
+
+        async def annotate_chunk(chunk):
+            async with semaphore:
+                return await self._call_api_on_non_empty_texts(chunk, entity_names)
+
+        chunk_results = await asyncio.gather(*(annotate_chunk(chunk) for chunk in chunks))
+
         all_merged = []
 
-        for chunk in chunks_by_size():
-            all_merged.extend(self._call_api_on_non_empty_texts(chunk, entity_names))
+        for chunk_result in chunk_results:
+            all_merged.extend(chunk_result)
 
         return all_merged
 
-    def _call_api_on_non_empty_texts(self, texts_chunk, entity_names) -> list:
+    async def _call_api_on_non_empty_texts(self, texts_chunk, entity_names) -> list:
         results = []
         indexes_to_annotate = []
         texts_to_annotate = []
@@ -126,7 +187,7 @@ class WatsonHealthAnnotator(AbstractAnnotator):
                 texts_to_annotate.append(item)
                 results.append(None)
 
-        annotations = self._call_api(texts_to_annotate, entity_names)
+        annotations = await self._call_api(texts_to_annotate, entity_names)
 
         if len(annotations) != len(texts_to_annotate):
             logger.warning(
@@ -148,7 +209,7 @@ class WatsonHealthAnnotator(AbstractAnnotator):
 
         return results
 
-    def _call_api(self, texts_chunk, entity_names) -> list:
+    async def _call_api(self, texts_chunk, entity_names) -> list:
         if not texts_chunk:
             logger.debug("No input provided, returning nothing.")
             return []
@@ -157,27 +218,30 @@ class WatsonHealthAnnotator(AbstractAnnotator):
         api_key = conf.watson_health_annotator.api_key
         flow_name = conf.watson_health_annotator.flow_name
         max_attempts = conf.watson_health_annotator.max_attempts
-        timeout = conf.watson_health_annotator.timeout_seconds
+        timeout = aiohttp.ClientTimeout(total=conf.watson_health_annotator.timeout_seconds)
+        wait_time_seconds = conf.watson_health_annotator.retry_wait_seconds
 
         attempt = 0
-        wait_time_seconds = 5
         data = None
 
         api_input = {
             'unstructured': texts_chunk,
         }
 
+        session = self._client.session()
+
         while data is None and attempt < max_attempts:
+            if attempt > 0:
+                await asyncio.sleep(wait_time_seconds)
+
             attempt += 1
 
             url = f'{base_url}/v1/analyze/{flow_name}'
 
             logger.debug("Calling %r (attempt %r)", url, attempt)
 
-            response = None
-
             try:
-                response = requests.post(
+                async with session.post(
                     url,
                     params={
                         'version': '2019-04-02',
@@ -187,33 +251,31 @@ class WatsonHealthAnnotator(AbstractAnnotator):
                     headers={
                         'Accept': 'application/json',
                     },
-                    auth=HTTPBasicAuth('apikey', api_key),
+                    auth=aiohttp.BasicAuth('apikey', api_key),
                     timeout=timeout,
-                )
-            except requests.exceptions.RequestException as req_err:
+                ) as response:
+                    text = await response.text()
+
+                    if response.status >= 400:
+                        logger.error(
+                            "Attempt %r: Annotate endpoint failed with status %r and text %r.",
+                            attempt,
+                            response.status,
+                            text,
+                        )
+                        continue
+
+                    try:
+                        data = json.loads(text)
+                    except JSONDecodeError:
+                        logger.error(
+                            f"Attempt %r: Annotate endpoint did not produce valid JSON on a 200 response. Text=%r",
+                            attempt,
+                            text,
+                        )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as req_err:
                 logger.error("Attempt %r: Request failed entirely!", attempt, exc_info=req_err)
 
-            if response is not None:
-                try:
-                    response.raise_for_status()
-                    data = response.json()
-                except JSONDecodeError:
-                    logger.error(
-                        f"Attempt %r: Annotate endpoint did not produce valid JSON on a 200 response. Text=%r",
-                        attempt,
-                        response.text,
-                    )
-                except Exception as http_err:
-                    logger.error(
-                        "Attempt %r: Annotate endpoint failed with status %r and text %r.",
-                        attempt,
-                        response.status_code,
-                        response.text,
-                        exc_info=http_err,
-                    )
-
-            time.sleep(wait_time_seconds)
-
         if data is None:
             logger.error("Annotate endpoint did not produce any valid data after % attempts.", max_attempts)
             return [{} for _ in texts_chunk]
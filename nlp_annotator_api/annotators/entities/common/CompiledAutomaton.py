@@ -0,0 +1,179 @@
+import logging
+logger = logging.getLogger('cps-nlp')
+import array
+import functools
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .DictionaryMatcher import AhoCorasickAutomaton
+
+## Binary layout of a compiled automaton (little-endian):
+##   header: magic, digest of the sources, stamp of the sources, number of nodes, number of edges,
+##           size of the payload table
+##   uint32 edge_start[nodes + 1]  edges of node i are edge_start[i] .. edge_start[i + 1] - 1
+##   uint32 edge_chars[edges]      code points, sorted for every node
+##   uint32 edge_targets[edges]
+##   uint32 fail[nodes]
+##   uint32 depth[nodes]
+##   int32  payload[nodes]         index in the payload table, -1 if no term ends at the node
+##   int32  output_link[nodes]
+##   JSON payload table, one entry per distinct payload
+MAGIC = b"NLPAC\x00\x02\x00"
+_HEADER = struct.Struct("<8s32s32sIII4x")
+
+## Nodes whose transitions are kept decoded by `CompiledAutomaton`
+_CACHED_NODES = 4096
+
+
+def _array(typecode: str, values) -> array.array:
+    values = array.array(typecode, values)
+    assert values.itemsize == 4
+    return values
+
+
+def write_automaton(automaton: AhoCorasickAutomaton, path: str, digest: bytes, stamp: bytes = bytes(32)):
+    ## Compile an in-memory automaton into the file `path`.
+    ## `digest` identifies the sources, to detect outdated files. `stamp` is a cheaper
+    ## stand-in for it (see `read_header`).
+    automaton.build()
+
+    edge_start, edge_chars, edge_targets = [0], [], []
+    for edges in automaton._goto:
+        for char, target in sorted(edges.items(), key=lambda edge: ord(edge[0])):
+            edge_chars.append(ord(char))
+            edge_targets.append(target)
+        edge_start.append(len(edge_chars))
+
+    ## Many terms share their payload (e.g. the entity types of the index), which is stored once.
+    payloads: Dict[str, int] = {}
+    payload_ix = []
+    for payload in automaton._payload:
+        if payload is None:
+            payload_ix.append(-1)
+        else:
+            payload_ix.append(payloads.setdefault(json.dumps(payload), len(payloads)))
+
+    payload_table = f"[{','.join(payloads)}]".encode("utf-8")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, digest, stamp, len(automaton._goto), len(edge_chars), len(payload_table)))
+        for typecode, values in [
+            ("I", edge_start), ("I", edge_chars), ("I", edge_targets),
+            ("I", automaton._fail), ("I", automaton._depth),
+            ("i", payload_ix), ("i", automaton._output_link),
+        ]:
+            _array(typecode, values).tofile(f)
+        f.write(payload_table)
+
+    ## Atomic, since running workers may have the previous file mapped.
+    os.replace(tmp_path, path)
+
+
+def read_header(path: str) -> Optional[Tuple[bytes, bytes]]:
+    ## Output: the digest and the stamp the file was written with, None if there is no compiled automaton at `path`
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+    except FileNotFoundError:
+        return None
+
+    if len(header) < _HEADER.size:
+        return None
+
+    magic, digest, stamp, *_ = _HEADER.unpack(header)
+    if magic != MAGIC:
+        return None
+
+    return digest, stamp
+
+
+class CompiledAutomaton:
+    """
+    Aho-Corasick automaton read from a file written by `write_automaton`.
+
+    The file is memory-mapped and read in place, transitions included:
+    loading it does not depend on the size of the dictionaries, and its
+    pages are shared by all the processes using it. Only the (distinct)
+    payloads are decoded.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.digest, self.stamp, n_nodes, n_edges, payload_bytes = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path!r} is not a compiled automaton")
+
+        view = memoryview(self._mmap)
+        offset = _HEADER.size
+
+        def take(typecode: str, count: int):
+            nonlocal offset
+            values = view[offset:offset + 4 * count].cast(typecode)
+            offset += 4 * count
+            return values
+
+        self._edge_start = take("I", n_nodes + 1)
+        self._edge_chars = take("I", n_edges)
+        self._edge_targets = take("I", n_edges)
+        self._fail = take("I", n_nodes)
+        self._depth = take("I", n_nodes)
+        self._payload = take("i", n_nodes)
+        self._output_link = take("i", n_nodes)
+
+        self._payloads = [
+            tuple(payload) if isinstance(payload, list) else payload
+            for payload in json.loads(bytes(view[offset:offset + payload_bytes]))
+        ]
+
+        self._root = self._read_transitions(0)
+        ## Transitions of the recently visited nodes, decoded from the file. Bounded, since
+        ## over time the texts would visit (and copy into every process) the whole automaton.
+        self._transitions = functools.lru_cache(maxsize=_CACHED_NODES)(self._read_transitions)
+
+    def _read_transitions(self, node: int) -> Dict[int, int]:
+        start, end = self._edge_start[node], self._edge_start[node + 1]
+        return dict(zip(self._edge_chars[start:end], self._edge_targets[start:end]))
+
+    @classmethod
+    def load(cls, path: str, digest: bytes) -> Optional["CompiledAutomaton"]:
+        ## Output: the automaton, or None if the file is missing or was compiled from other sources
+        ## (or by another version of `write_automaton`)
+        if not os.path.exists(path):
+            return None
+
+        header = read_header(path)
+        if header is None or header[0] != digest:
+            logger.warning("%s is outdated, ignoring it", path)
+            return None
+
+        return cls(path)
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        ## Output: (start, end, payload) of every occurrence, overlapping ones included
+        root, transitions = self._root, self._transitions
+        fail, depth, payload, output_link, payloads = \
+            self._fail, self._depth, self._payload, self._output_link, self._payloads
+
+        node = 0
+        for end, char in enumerate(text, 1):
+            code = ord(char)
+
+            while node:
+                nxt = transitions(node).get(code)
+                if nxt is not None:
+                    node = nxt
+                    break
+                node = fail[node]
+            else:
+                node = root.get(code, 0)
+
+            out = node if payload[node] != -1 else output_link[node]
+            while out != -1:
+                yield end - depth[out], end, payloads[payload[out]]
+                out = output_link[out]
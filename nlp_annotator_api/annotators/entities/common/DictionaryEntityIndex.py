@@ -0,0 +1,173 @@
+import logging
+logger = logging.getLogger('cps-nlp')
+import hashlib
+import os
+from typing import Iterable, List, Optional, Tuple
+
+from nlp_annotator_api.config.config import conf
+
+from .CompiledAutomaton import MAGIC, CompiledAutomaton, read_header, write_automaton
+from .DictionaryMatcher import AhoCorasickAutomaton, is_end_boundary, is_start_boundary, leftmost_longest
+from .DictionaryTextEntityAnnotator import DictionaryTextEntityAnnotator
+from .utils import resources_dir
+
+
+def _file_digest(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+class _TaggedAutomaton(AhoCorasickAutomaton):
+    ## The payload of a term is the tuple of entity keys whose dictionary contains it.
+    @staticmethod
+    def merge(current: Tuple[str, ...], payload: Tuple[str, ...]) -> Tuple[str, ...]:
+        return current + tuple(key for key in payload if key not in current)
+
+
+class DictionaryEntityIndex:
+    """
+    Merged index over the dictionaries of several entity annotators.
+
+    A text is scanned once, every hit is tagged with the entity types
+    of the dictionaries containing it, and the hits are filtered to the
+    requested types afterwards. The output is the same as calling
+    `annotate_entities_text` of every requested annotator, in the order
+    requested, each with its matches in the order of the text.
+
+    Only the annotators configured with the "aho_corasick" matcher are
+    merged, the others annotate on their own.
+
+    The index is loaded from its compiled file if it is up to date
+    (see `compile` and `python -m nlp_annotator_api.build_dictionaries`),
+    and compiled in memory otherwise.
+    """
+
+    def __init__(self, annotators: Iterable[DictionaryTextEntityAnnotator]):
+        annotators = list(annotators)
+        self._annotators = [annot for annot in annotators if annot.config.matcher == "aho_corasick"]
+        self._unmerged = {annot.key(): annot for annot in annotators if annot.config.matcher != "aho_corasick"}
+        self._initialized = False
+
+    @property
+    def compiled_path(self) -> str:
+        compiled_dir = conf.dictionaries.compiled_dir or os.path.join(resources_dir, "compiled")
+        return os.path.join(compiled_dir, "-".join(annot.key() for annot in self._annotators) + ".ac")
+
+    def digest(self) -> bytes:
+        ## Identifies the dictionaries the index is built from. Taken from the compiled
+        ## index if they did not change since it was compiled (see `stamp`), hashed otherwise.
+        header = read_header(self.compiled_path)
+        if header is not None and header[1] == self.stamp():
+            return header[0]
+
+        return self._hash()
+
+    def stamp(self) -> bytes:
+        ## Sizes and modification times of the dictionaries, cheaper to check than their content
+        stamp = hashlib.sha256(MAGIC)
+        for annot in self._annotators:
+            stat = os.stat(annot.config.dictionary_filename)
+            stamp.update(f"{annot.key()}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+
+        return stamp.digest()
+
+    def _hash(self) -> bytes:
+        digest = hashlib.sha256(MAGIC)
+        for annot in self._annotators:
+            digest.update(annot.key().encode("utf-8"))
+            digest.update(_file_digest(annot.config.dictionary_filename))
+
+        return digest.digest()
+
+    def version(self) -> str:
+        ## Identifies the dictionaries and matchers of all the annotators, merged or not
+        digest = hashlib.sha256(self.digest())
+        for key, annot in self._unmerged.items():
+            digest.update(f"{key}:{annot.config.matcher}".encode("utf-8"))
+            digest.update(_file_digest(annot.config.dictionary_filename))
+
+        return digest.hexdigest()
+
+    def _build(self) -> _TaggedAutomaton:
+        automaton = _TaggedAutomaton()
+        for annot in self._annotators:
+            key = (annot.key(), )
+            for term in annot.load_dictionary():
+                automaton.add(term, key)
+
+        automaton.build()
+        logger.info("compiled index over %r", [annot.key() for annot in self._annotators])
+
+        return automaton
+
+    def compile(self, path: Optional[str] = None) -> str:
+        ## Write the compiled index, to be loaded by `initialize`
+        path = path or self.compiled_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_automaton(self._build(), path, self._hash(), self.stamp())
+
+        return path
+
+    def initialize(self):
+        if self._initialized:
+            return
+
+        for annot in self._unmerged.values():
+            annot.initialize()
+
+        if not self._annotators:
+            self._automaton = None
+            self._initialized = True
+            return
+
+        automaton = CompiledAutomaton.load(self.compiled_path, self.digest())
+
+        if automaton is not None:
+            logger.info("loaded compiled index from %s", self.compiled_path)
+        else:
+            logger.warning("no compiled index at %s, compiling it in memory", self.compiled_path)
+            automaton = self._build()
+
+        self._automaton = automaton
+        self._initialized = True
+
+    def annotate_entities_text(self, text: str, entity_names: List[str]) -> list:
+        self.initialize()
+
+        ## Annotate one text string with the desired entities.
+        ## Output: List of entities in CPS format, i.e., dicts with keys type, match, original, range.
+        desired = set(entity_names)
+        if not desired:
+            return []
+
+        spans = {key: [] for key in desired}
+        iter_matches = self._automaton.iter_matches(text) if self._automaton is not None else ()
+
+        for start, end, keys in iter_matches:
+            if not desired.intersection(keys):
+                continue
+
+            if not (is_start_boundary(text, start) and is_end_boundary(text, end)):
+                continue
+
+            for key in keys:
+                if key in desired:
+                    spans[key].append((start, end))
+
+        matches = []
+        for key in dict.fromkeys(entity_names):
+            if key in self._unmerged:
+                matches.extend(self._unmerged[key].annotate_entities_text(text))
+                continue
+
+            ## Matches of the same type don't overlap, as with `DictionaryTextEntityAnnotator`
+            for start, end in leftmost_longest(spans[key]):
+                orig = text[start:end]
+                matches.append({
+                    "type": key,
+                    "match": orig,
+                    "original": orig,
+                    "range": [start, end]
+                })
+
+        return matches
@@ -0,0 +1,241 @@
+import logging
+logger = logging.getLogger('cps-nlp')
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+## Characters accepted right before (resp. after) a dictionary match,
+## in addition to whitespace and the beginning (resp. end) of the text.
+## They are used to avoid partial matches, e.g. "Bern" in "Berne".
+START_DELIMITERS = frozenset("'\"({[,.!?:;")
+END_DELIMITERS = frozenset("'\")}],.!?:;")
+
+
+def is_start_boundary(text: str, start: int) -> bool:
+    if start == 0:
+        return True
+
+    prev = text[start - 1]
+    return prev in START_DELIMITERS or prev.isspace()
+
+
+def is_end_boundary(text: str, end: int) -> bool:
+    if end == len(text):
+        return True
+
+    nxt = text[end]
+    return nxt in END_DELIMITERS or nxt.isspace()
+
+
+def leftmost_longest(spans: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    ## Non-overlapping (start, end) spans, in the order of the text: the leftmost
+    ## span is kept, the longest one if several start there, and so on after it.
+    selected = []
+    last_end = 0
+
+    for start, end in sorted(spans, key=lambda span: (span[0], -span[1])):
+        if start >= last_end:
+            selected.append((start, end))
+            last_end = end
+
+    return selected
+
+
+class AbstractDictionaryMatcher(ABC):
+    """
+    Finds the occurrences of dictionary terms in a text.
+    Matches must be delimited by the boundaries defined above.
+    """
+
+    @abstractmethod
+    def find(self, text: str) -> Iterator[Tuple[int, int]]:
+        ## Output: (start, end) character offsets of every match in the text
+        pass
+
+
+class RegexDictionaryMatcher(AbstractDictionaryMatcher):
+    """
+    Original matcher, based on alternations of the escaped terms.
+    The cost grows with the size of the dictionary.
+    """
+
+    MAX_LEN = 48
+
+    def __init__(self, dictionary: Iterable[str]):
+        self._exprs = self._compile_dictionary(dictionary)
+
+    def _compile_dictionary(self, dictionary):
+        logger.info("compiling dictionary")
+
+        # delimiters used to avoid partial matches
+        starts_with = r"(^|\s|\'|\"|\(|\{|\[|\,|\.|\!|\?|\:|\;)"
+        ends_with   = r"($|\s|\'|\"|\)|\}|\]|\,|\.|\!|\?|\:|\;)"
+        try:
+            tmp = []
+            for item in dictionary:
+                tmp.append(re.escape(item))
+
+            # The regex is split into multiple expressions if we exceed 4096 characters.
+            # This is needed to avoid length limits of regex.
+            exprs = []
+            local = []
+            for texpr in tmp:
+
+                if len("|".join(local)) > 4096:
+
+                    expr_str = starts_with + "(" + "|".join(local) + ")" + ends_with
+                    expr = re.compile(expr_str)
+                    exprs.append(expr)
+
+                    local = []
+
+                if len(texpr) < self.MAX_LEN:
+                    local.append(texpr)
+                else:
+                    logger.warning("name of entity '%s' is longer than %s chars", texpr, self.MAX_LEN)
+
+            if len(local) > 0:
+                expr_str = starts_with + "(" + "|".join(local) + ")" + ends_with
+                expr = re.compile(expr_str)
+                exprs.append(expr)
+        except BaseException as e:
+            logger.exception("Could not compile the dictionary")
+            raise RuntimeError("Could not compile the dictionary")
+        return exprs
+
+    def find(self, text: str) -> Iterator[Tuple[int, int]]:
+        for expr in self._exprs:
+            for match in re.finditer(expr, text):
+                yield match.start(2), match.end(2)
+
+
+class AhoCorasickAutomaton:
+    """
+    Aho-Corasick automaton over the characters of the terms.
+
+    Scanning a text visits every character once, independently of the number
+    of terms. Every term carries a payload, terms added twice get their
+    payloads merged with `merge`.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Depth of the node, i.e. length of the term ending there
+        self._depth: List[int] = [0]
+        # Payload of the term ending at the node, None if no term ends there
+        self._payload: List[Any] = [None]
+        # Next node on the failure chain at which a term ends, -1 if none
+        self._output_link: List[int] = [-1]
+        self._built = False
+
+    def __len__(self):
+        return sum(1 for payload in self._payload if payload is not None)
+
+    @staticmethod
+    def merge(current: Any, payload: Any) -> Any:
+        return payload
+
+    def add(self, term: str, payload: Any = True):
+        if not term:
+            return
+
+        node = 0
+        for char in term:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._depth.append(self._depth[node] + 1)
+                self._payload.append(None)
+                self._output_link.append(-1)
+            node = nxt
+
+        current = self._payload[node]
+        self._payload[node] = payload if current is None else self.merge(current, payload)
+        self._built = False
+
+    def build(self):
+        goto, fail, payload, output_link = self._goto, self._fail, self._payload, self._output_link
+
+        # Breadth-first, so the failure of a node is known before its children.
+        queue = list(goto[0].values())
+        for node in queue:
+            fail[node] = 0
+            output_link[node] = -1
+
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+
+            for char, child in goto[node].items():
+                queue.append(child)
+
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[child] = target = goto[state].get(char, 0)
+
+                output_link[child] = target if payload[target] is not None else output_link[target]
+
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        ## Output: (start, end, payload) of every occurrence, overlapping ones included
+        if not self._built:
+            self.build()
+
+        goto, fail, depth, payload, output_link = \
+            self._goto, self._fail, self._depth, self._payload, self._output_link
+
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            out = node if payload[node] is not None else output_link[node]
+            while out != -1:
+                yield end - depth[out], end, payload[out]
+                out = output_link[out]
+
+
+class AhoCorasickDictionaryMatcher(AbstractDictionaryMatcher):
+    """
+    Matcher running in linear time in the length of the text,
+    whatever the size of the dictionary.
+
+    Like the expressions of the regex matcher, it does not return
+    overlapping matches: "New Delhi" is found, not "Delhi" in it.
+    """
+
+    def __init__(self, dictionary: Iterable[str]):
+        self._automaton = AhoCorasickAutomaton()
+        for term in dictionary:
+            self._automaton.add(term)
+        self._automaton.build()
+
+    def find(self, text: str) -> Iterator[Tuple[int, int]]:
+        yield from leftmost_longest(
+            (start, end)
+            for start, end, _ in self._automaton.iter_matches(text)
+            if is_start_boundary(text, start) and is_end_boundary(text, end)
+        )
+
+
+_matchers = {
+    'regex': RegexDictionaryMatcher,
+    'aho_corasick': AhoCorasickDictionaryMatcher,
+}
+
+
+def create_matcher(name: str, dictionary: Iterable[str]) -> AbstractDictionaryMatcher:
+    matcher_cls: Optional[type] = _matchers.get(name)
+
+    if matcher_cls is None:
+        raise ValueError(f"Unknown dictionary matcher {name!r}. Expected one of: {tuple(_matchers)}")
+
+    return matcher_cls(dictionary)
@@ -0,0 +1,46 @@
+from typing import Dict, List
+
+
+def unique_cell_texts(tables: List[List[List[dict]]]) -> List[str]:
+    ## Collect the texts of all cells of all tables, without duplicates.
+    ## (Headers and units are repeated a lot in large tables.)
+    texts = {}
+    for table in tables:
+        for row in table:
+            for cell in row:
+                texts.setdefault(cell["text"], None)
+
+    return list(texts)
+
+
+def to_table_entities(table: List[List[dict]], entities_by_text: Dict[str, list]) -> list:
+    ## Map the entities of the cell texts back to one table.
+    ## Output: List of entities in CPS format for table entities.
+
+    ## Extend from text-entity CPS format with fields type, match, original, range
+    #  to table-entity CPS format, which looks like this:
+    # {
+    #     "cell_type": "body",
+    #     "coords": [[ 1, 0]], ## Coordinates of the cell within the table, here row 1, cell 0
+    #     "match": "Amsterdam",
+    #     "original": "Amsterdam",
+    #     "prov": "data",
+    #     "range": [0, 10 ], ## Start character and end+1 of match within cell
+    #     "source_field": "data",
+    #     "source_field_type": "table",
+    #     "type": "cities"
+    # },
+    table_entities = []
+    for row in table:
+        for cell in row:
+            for entity in entities_by_text[cell["text"]]:
+                table_entities.append({
+                    **entity,
+                    "cell_type": cell["type"],
+                    "coords": cell["spans"],
+                    "prov": "data",
+                    "source_field": "data",
+                    "source_field_type": "table",
+                })
+
+    return table_entities
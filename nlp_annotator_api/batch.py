@@ -0,0 +1,294 @@
+## Offline bulk annotation of JSONL files and CCS documents, without going over HTTP.
+##
+##   python -m nlp_annotator_api.batch --annotator SimpleTextGeographyAnnotator \
+##       --entity-names cities countries --output annotated.jsonl documents.jsonl ccs_documents/
+##
+## Every input line (JSONL) or file (directory of CCS .json documents) is a document.
+## Documents are annotated in chunks by a pool of worker processes, and one output
+## line is written per document, in the order of the input. The progress is
+## checkpointed next to the output, so that an interrupted run resumes where it stopped.
+
+import argparse
+import collections
+import itertools
+import json
+import logging
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import Executor, Future
+from typing import Deque, Iterator, List, Optional, Tuple
+
+from connexion.exceptions import ProblemException
+
+from nlp_annotator_api.config.config import conf
+from nlp_annotator_api.config.logging import setup_logging
+from nlp_annotator_api.server.controllers.annotate_controller import (
+    _run_annotator,
+    annotators,
+    initialize_worker,
+)
+from nlp_annotator_api.server.signals.process_pool import create_process_pool
+
+## Named explicitly, since this module usually runs as __main__
+_log = logging.getLogger("nlp_annotator_api.batch")
+
+
+def iter_units(paths: List[str]) -> Iterator[Tuple[str, str]]:
+    ## Yields the documents as (kind, unit): JSONL lines, or paths of JSON files.
+    for path in paths:
+        if os.path.isdir(path):
+            for filename in sorted(pathlib.Path(path).rglob("*.json")):
+                yield "file", str(filename)
+        elif path.endswith(".json"):
+            yield "file", path
+        else:
+            with open(path, encoding="utf-8") as lines:
+                for line in lines:
+                    if line.strip():
+                        yield "line", line
+
+
+def _load_document(kind: str, unit: str):
+    if kind == "file":
+        with open(unit, encoding="utf-8") as document:
+            return os.path.basename(unit), json.load(document)
+
+    return None, json.loads(unit)
+
+
+def _get_document_items(document) -> Tuple[Optional[str], List[str], list]:
+    ## Output: id, texts and tables of a CCS document, a {"text": ...} record or a bare text
+    if isinstance(document, str):
+        return None, [document], []
+
+    doc_id = (
+        document.get("_id")
+        or document.get("_file", {}).get("filename")
+        or document.get("description", {}).get("title")
+        or document.get("file-info", {}).get("document-hash")
+    )
+
+    if "main-text" in document:
+        texts = [item["text"] for item in document["main-text"] if isinstance(item.get("text"), str)]
+        tables = [table["data"] for table in document.get("tables", []) if table.get("data")]
+        return doc_id, texts, tables
+
+    return doc_id, [document.get("text", "")], []
+
+
+def _annotate_document(
+    annot, kind: str, unit: str, entity_names: Optional[List[str]], relationship_names: Optional[List[str]]
+):
+    filename, document = _load_document(kind, unit)
+    doc_id, texts, tables = _get_document_items(document)
+    result = {"id": doc_id or filename}
+
+    if texts:
+        result["entities"] = _run_annotator(annot, {
+            "find_entities": {"object_type": "text", "entity_names": entity_names, "texts": texts}
+        })["entities"]
+
+        if relationship_names is not None:
+            result["relationships"] = _run_annotator(annot, {
+                "find_relationships": {
+                    "object_type": "text",
+                    "relationship_names": relationship_names,
+                    "texts": texts,
+                    "entities": result["entities"],
+                }
+            })["relationships"]
+
+    if tables and "table" in annot.supports:
+        result["table_entities"] = _run_annotator(annot, {
+            "find_entities": {"object_type": "table", "entity_names": entity_names, "tables": tables}
+        })["entities"]
+
+    return result, len(texts) + len(tables)
+
+
+def annotate_chunk(
+    annotator: str,
+    start: int,
+    units: List[Tuple[str, str]],
+    entity_names: Optional[List[str]],
+    relationship_names: Optional[List[str]],
+) -> Tuple[str, int]:
+    ## Runs in the workers. Output: the output lines of the documents, and the number of items annotated.
+    annot = annotators[annotator]
+    lines = []
+    items = 0
+
+    for index, (kind, unit) in enumerate(units, start):
+        try:
+            result, count = _annotate_document(annot, kind, unit, entity_names, relationship_names)
+            items += count
+        except (ProblemException, ValueError, KeyError, TypeError, OSError) as exc:
+            ## One broken document does not stop the run, it is reported in the output.
+            result = {"error": getattr(exc, "detail", None) or repr(exc)}
+
+        lines.append(json.dumps({"index": index, **result}) + "\n")
+
+    return "".join(lines), items
+
+
+class Checkpoint:
+    """
+    Progress of a run, stored next to its output: the number of documents done,
+    and the size of the output when they were (anything after is discarded on resume).
+    """
+
+    def __init__(self, path: str, inputs: List[str]) -> None:
+        self.path = path
+        self.inputs = inputs
+        self.documents = 0
+        self.output_bytes = 0
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+
+        with open(self.path, encoding="utf-8") as checkpoint:
+            state = json.load(checkpoint)
+
+        if state["inputs"] != self.inputs:
+            raise ValueError(f"Checkpoint {self.path!r} is for the inputs {state['inputs']!r}")
+
+        self.documents = state["documents"]
+        self.output_bytes = state["output_bytes"]
+
+        return True
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as checkpoint:
+            json.dump({"inputs": self.inputs, "documents": self.documents, "output_bytes": self.output_bytes}, checkpoint)
+
+        os.replace(tmp_path, self.path)
+
+
+def run(args) -> int:
+    checkpoint = Checkpoint(args.output + ".checkpoint", [os.path.abspath(path) for path in args.inputs])
+
+    if args.restart or not checkpoint.load():
+        checkpoint.documents = checkpoint.output_bytes = 0
+
+    if checkpoint.documents:
+        _log.info("Resuming after %r documents", checkpoint.documents)
+
+    output = open(args.output, "ab" if checkpoint.documents else "wb")
+    output.truncate(checkpoint.output_bytes)
+    output.seek(checkpoint.output_bytes)
+
+    executor: Optional[Executor] = None
+    if args.workers > 0:
+        ## Loaded before forking, so that the workers share it.
+        annotators[args.annotator]
+        executor = create_process_pool(args.workers, initializer=initialize_worker, start_method=conf.nlp.worker_start_method)
+
+    units = itertools.islice(iter_units(args.inputs), checkpoint.documents, None)
+    pending: Deque[Tuple[int, Future]] = collections.deque()
+    started = last_report = time.monotonic()
+    items = documents = 0
+
+    def write(count: int, lines: str, chunk_items: int):
+        nonlocal items, documents, last_report
+
+        output.write(lines.encode("utf-8"))
+        output.flush()
+
+        checkpoint.documents += count
+        checkpoint.output_bytes = output.tell()
+        checkpoint.save()
+
+        items += chunk_items
+        documents += count
+
+        now = time.monotonic()
+        if now - last_report >= args.report_seconds:
+            last_report = now
+            _log.info(
+                "%r documents, %r items, %.1f items/s", documents, items, items / (now - started)
+            )
+
+    try:
+        start = checkpoint.documents
+
+        while True:
+            chunk = list(itertools.islice(units, args.chunk_size))
+            if not chunk:
+                break
+
+            task = (args.annotator, start, chunk, args.entity_names, args.relationship_names)
+
+            if executor is None:
+                write(len(chunk), *annotate_chunk(*task))
+            else:
+                ## Bounded, so that the input is read only as fast as it is annotated.
+                pending.append((len(chunk), executor.submit(annotate_chunk, *task)))
+
+                while len(pending) > 2 * args.workers or (pending and pending[0][1].done()):
+                    count, future = pending.popleft()
+                    write(count, *future.result())
+
+            start += len(chunk)
+
+        while pending:
+            count, future = pending.popleft()
+            write(count, *future.result())
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+        if executor is not None:
+            executor.shutdown()
+
+        output.close()
+
+    elapsed = time.monotonic() - started
+    _log.info(
+        "Done: %r documents, %r items in %.1fs (%.1f items/s)",
+        documents, items, elapsed, items / elapsed if elapsed else 0.0,
+    )
+
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m nlp_annotator_api.batch",
+        description="Annotates JSONL files and CCS documents offline, without going over HTTP.",
+    )
+
+    parser.add_argument("inputs", nargs="+", help="JSONL files, CCS .json documents or directories of them")
+    parser.add_argument("--annotator", required=True, help="name of the annotator, as in the API")
+    ## None (not []) when omitted: the annotators read an empty list as "no entities"
+    parser.add_argument("--entity-names", nargs="*", default=None, help="entities to find (default: all)")
+    parser.add_argument("--relationship-names", nargs="*", default=None,
+                        help="relationships to find between the entities (default: none)")
+    parser.add_argument("--output", required=True, help="JSONL file with one line per document")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="worker processes, 0 to annotate in this process")
+    parser.add_argument("--chunk-size", type=int, default=16, help="documents sent to a worker at once")
+    parser.add_argument("--report-seconds", type=float, default=10, help="interval of the progress reports")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of a previous run")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    setup_logging()
+
+    args = parse_args(argv)
+
+    if args.annotator not in annotators:
+        _log.error("Annotator %r not found", args.annotator)
+        return 1
+
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
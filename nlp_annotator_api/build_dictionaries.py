@@ -0,0 +1,56 @@
+## Offline build of the compiled dictionary indexes, loaded (memory-mapped) by the annotators at startup:
+##
+##   python -m nlp_annotator_api.build_dictionaries [--output-dir DIR]
+##
+## Run it whenever the dictionaries in `resources` change, e.g. in the Docker build.
+## Outdated indexes are detected and compiled in memory instead, at startup.
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from nlp_annotator_api.config.logging import setup_logging
+
+from nlp_annotator_api.annotators.SimpleTextGeographyAnnotator import SimpleTextGeographyAnnotator
+from nlp_annotator_api.annotators.TextTableGeographyAnnotator import TextTableGeographyAnnotator
+
+## Named explicitly, since this module usually runs as __main__
+_log = logging.getLogger("nlp_annotator_api.build_dictionaries")
+
+# Annotators with dictionary indexes
+_dictionary_annotators = [
+    SimpleTextGeographyAnnotator,
+    TextTableGeographyAnnotator,
+]
+
+
+def main(argv=None):
+    setup_logging()
+
+    parser = argparse.ArgumentParser(prog="python -m nlp_annotator_api.build_dictionaries")
+    parser.add_argument("--output-dir", default=None, help="default: dictionaries.compiled_dir of the configuration")
+    args = parser.parse_args(argv)
+
+    built = set()
+    for cls in _dictionary_annotators:
+        index = cls()._ent_index
+        path = index.compiled_path
+        if args.output_dir:
+            path = os.path.join(args.output_dir, os.path.basename(path))
+
+        if path in built:
+            continue
+
+        start = time.monotonic()
+        index.compile(path)
+        built.add(path)
+
+        _log.info("Built %s (%r bytes) in %.2fs", path, os.path.getsize(path), time.monotonic() - start)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,13 +2,99 @@ import pathlib
 import json
 import os
 from pydantic import BaseModel, Field, BaseSettings
-from typing import Any, Optional, Dict, Tuple
+from typing import Any, Optional, Dict, List, Tuple
 from pydantic.env_settings import SettingsSourceCallable
 
 
 
+class MicroBatchConfig(BaseModel):
+    # Time the items of a first request wait for those of other requests
+    max_wait_ms: float = 5
+    # Batch size which is annotated right away
+    max_items: int = 64
+
+
 class NlpConfig(BaseModel):
     num_workers: int = 2
+    # How the process pool starts its workers. With "fork", they share the annotators
+    # preloaded at startup (see `annotators.preload`) copy-on-write.
+    worker_start_method: Optional[str] = "fork"
+    num_threads: int = 4
+    # Where annotators are executed: "process", "thread" or "inline" (on the event loop).
+    executor: str = "process"
+    # Per-annotator override of `executor`, e.g. {"WatsonHealthAnnotator": "thread"}
+    annotator_executors: Dict[str, str] = {"WatsonHealthAnnotator": "thread"}
+    # Coalesce concurrent identical requests, not only those with the same X-CPS-Transaction-Id
+    coalesce_by_content: bool = True
+    # Items annotated between two checks of the X-CPS-Deadline of a request
+    deadline_slice_items: int = 64
+    # Runs of an annotator measured before requests are rejected for not meeting their deadline
+    min_throughput_samples: int = 5
+    # Requests waiting for a worker of an executor, beyond which they are rejected with 503 and Retry-After
+    max_queue_size: int = 64
+    # Per-annotator limit of the workers of an executor used at the same time, e.g. {"ScispacyBiomedAnnotator": 1}
+    annotator_concurrency: Dict[str, int] = {}
+    # Annotators whose find_entities items from concurrent requests are annotated in one batch
+    micro_batching: Dict[str, MicroBatchConfig] = {"ScispacyBiomedAnnotator": MicroBatchConfig()}
+    # Streaming endpoint: items annotated together, chunks in flight, and size of a single item
+    stream_chunk_items: int = 32
+    stream_max_pending_chunks: int = 4
+    stream_max_line_bytes: int = 8 * 1024**2
+
+
+class ServerConfig(BaseModel):
+    host: str = "0.0.0.0"
+    port: int = 5000
+    # Server processes started by the launcher, sharing the listening socket
+    workers: int = 1
+    # Delay before restarting a worker which crashed right after starting, doubled on every new crash
+    restart_delay_seconds: float = 1.0
+    # Time given to the workers to finish their requests on shutdown
+    shutdown_timeout_seconds: float = 30.0
+    # Size limit of the request bodies, once decompressed
+    client_max_size: int = 8 * 1024**2
+    # JSON serializer of the responses and the cached values: "orjson" or "json"
+    # (default: orjson if it is installed)
+    json_serializer: Optional[str] = None
+    # Add a Server-Timing header to the responses, with the duration of every stage
+    # (parse, cache, queue, inference, serialize, ...) and the items and chars annotated
+    server_timing: bool = False
+
+
+class ProfilingConfig(BaseModel):
+    # Fraction of the annotations profiled all the time, per annotator (see /admin/profile/annotators)
+    sample_rate: float = 0.0
+    # Per-annotator override of `sample_rate`, e.g. {"ScispacyBiomedAnnotator": 0.01}
+    annotator_sample_rates: Dict[str, float] = {}
+    # Time between two samples of the stacks
+    interval_seconds: float = 0.005
+    # Distinct stacks kept per annotator, the others are counted together
+    max_stacks: int = 5000
+    # Longest profile taken on demand
+    max_seconds: float = 60.0
+
+
+class MetricsConfig(BaseModel):
+    # Expose the metrics at /metrics, for Prometheus
+    enabled: bool = True
+    # Directory where the server processes share their metrics, for any of them to expose those
+    # of all (set by the launcher when it starts several processes)
+    multiprocess_dir: Optional[str] = None
+    # How often the server processes share their metrics
+    snapshot_seconds: float = 5.0
+
+
+class StatsdAggregationConfig(BaseModel):
+    # Accumulate the statsd metrics in memory, and send them every `flush_interval_seconds`,
+    # instead of sending packets for every request
+    enabled: bool = True
+    flush_interval_seconds: float = 10.0
+    # Size of the UDP packets sent (the default fits an Ethernet frame), unless `statsd.maxudpsize` is set
+    max_packet_bytes: int = 1432
+    # Distinct metric names sent, the metrics with new names beyond are dropped
+    max_metrics: int = 2000
+    # Samples of a timer sent per flush, a random subset of them beyond (sent with their sample rate)
+    max_timer_samples: int = 1000
 
 
 class AuthConfig(BaseModel):
@@ -19,6 +105,44 @@ class RedisCacheConfig(BaseModel):
     url: str
     ttl: int = 300
     prefix: str = "nlp_annotator_cache"
+    # Cache of the annotations of single items, keyed on their content and on the version
+    # of the annotator and of what it loads (see `AbstractAnnotator.content_version`)
+    item_cache: bool = True
+    item_ttl: int = 24 * 3600
+    # Values larger than this are stored compressed (zstd if installed, otherwise gzip), None to never compress
+    compress_min_bytes: Optional[int] = 1024
+
+
+class MemoryCacheConfig(BaseModel):
+    # In-process cache in front of Redis, bounded by the size of its entries
+    max_bytes: int = 64 * 1024**2
+    max_entry_bytes: int = 4 * 1024**2
+    ttl: int = 300
+    # Also cache the annotations of single items in memory (in Redis, see `RedisCacheConfig.item_cache`)
+    item_cache: bool = True
+
+
+class CompressionConfig(BaseModel):
+    # Responses larger than this are compressed (zstd or gzip, as accepted by the client), None to never compress
+    response_min_bytes: Optional[int] = 1024
+    gzip_level: int = 6
+    zstd_level: int = 3
+
+
+class AnnotatorsConfig(BaseModel):
+    # Annotators are loaded on their first request. These are loaded at startup instead.
+    # ScispacyBiomedAnnotator is left out on purpose: its models are large and
+    # are optional, add it where they are installed and the memory is budgeted for.
+    preload: List[str] = ["SimpleTextGeographyAnnotator", "TextTableGeographyAnnotator", "SimpleTextClassifier"]
+    # Loaded at startup and never unloaded
+    pinned: List[str] = []
+    # Memory for the loaded annotators (per process), beyond which the least recently used are unloaded
+    memory_budget_mb: Optional[int] = None
+
+
+class DictionaryConfig(BaseModel):
+    # Directory of the compiled dictionary indexes (default: resources/compiled)
+    compiled_dir: Optional[str] = None
 
 
 class WatsonHealthAnnotatorConfig(BaseModel):
@@ -27,9 +151,22 @@ class WatsonHealthAnnotatorConfig(BaseModel):
     flow_name: str = "test-deepsearch_v3.0_default_flow"
     timeout_seconds: int = 600
     max_attempts: int = 5
+    retry_wait_seconds: float = 5
+    # Chunks of a request sent at the same time, over a pool of persistent connections
+    max_concurrency: int = 4
+    connection_pool_size: int = 16
     concepts: Dict = {}
 
 
+class ScispacyBiomedAnnotatorConfig(BaseModel):
+    # Parameters of `nlp.pipe` for the batched entity path. `n_process` > 1 only applies where the
+    # annotator runs in threads (see `nlp.annotator_executors`): in the workers of the process
+    # pool, which can't start processes of their own, it is 1.
+    batch_size: int = 64
+    n_process: int = 1
+    # Pipeline components needed for the NER output, the others are disabled
+    keep_components: List[str] = ["tok2vec", "ner"]
+
 
 def _make_json_settings_source(path: pathlib.Path):
     def json_config_settings_source(settings: BaseSettings) -> Dict[str, Any]:
@@ -40,11 +177,20 @@ def _make_json_settings_source(path: pathlib.Path):
 
 
 class Config(BaseSettings):
+    server: ServerConfig = Field(default_factory=ServerConfig)
     auth: AuthConfig = Field(default_factory=AuthConfig)
     nlp: NlpConfig = Field(default_factory=NlpConfig)
+    annotators: AnnotatorsConfig = Field(default_factory=AnnotatorsConfig)
     statsd: dict = Field(default_factory=lambda: {"prefix": "nlp_annotator_api."})
+    statsd_aggregation: StatsdAggregationConfig = Field(default_factory=StatsdAggregationConfig)
     redis_cache: Optional[RedisCacheConfig] = None
+    memory_cache: Optional[MemoryCacheConfig] = Field(default_factory=MemoryCacheConfig)
+    compression: CompressionConfig = Field(default_factory=CompressionConfig)
+    profiling: ProfilingConfig = Field(default_factory=ProfilingConfig)
+    metrics: MetricsConfig = Field(default_factory=MetricsConfig)
+    dictionaries: DictionaryConfig = Field(default_factory=DictionaryConfig)
     watson_health_annotator: WatsonHealthAnnotatorConfig = Field(default_factory=WatsonHealthAnnotatorConfig)
+    scispacy_biomed_annotator: ScispacyBiomedAnnotatorConfig = Field(default_factory=ScispacyBiomedAnnotatorConfig)
 
     class Config:
         env_file_encoding = 'utf-8'
@@ -1,5 +1,9 @@
 import logging
+from nlp_annotator_api.server.middleware.memory_cache import tiered_cache_factory
+from nlp_annotator_api.server.middleware.micro_batcher import micro_batcher_factory
 from nlp_annotator_api.server.middleware.redis_cache import redis_cache_factory
+from nlp_annotator_api.server.middleware.scheduler import scheduler_factory
+from nlp_annotator_api.server.middleware.single_flight import single_flight_factory
 import os
 
 import aiohttp.web
@@ -7,30 +11,62 @@ from connexion import AioHttpApp
 
 from nlp_annotator_api.config.config import conf
 from nlp_annotator_api.config.logging import setup_logging
+from nlp_annotator_api.server.controllers.annotate_controller import annotators, initialize_worker, warm_up_annotators
+from nlp_annotator_api.server.controllers.metrics_controller import metrics_handler
+from nlp_annotator_api.server.controllers.stream_controller import STREAM_ROUTE, stream_handler
+from nlp_annotator_api.server.middleware.compression_middleware import CompressionMiddleware
+from nlp_annotator_api.server.middleware.metrics_middleware import MetricsMiddleware, metrics_factory
+from nlp_annotator_api.server.middleware.request_timings import TimingMiddleware
 from nlp_annotator_api.server.middleware.statsd_middleware import StatsdMiddleware
+from nlp_annotator_api.server.signals.process_pool import process_pool_factory
+from nlp_annotator_api.server.signals.profiling import profiling_factory
 from nlp_annotator_api.server.signals.statsd_client import statsd_client_factory
+from nlp_annotator_api.server.signals.thread_pool import thread_pool_factory
+from nlp_annotator_api.server.signals.warm_up import warm_up_factory
 
 setup_logging()
 
 access_log = logging.getLogger("nlp_annotator_api.access")
+ACCESS_LOG_FORMAT = '%a %t "%r" %s %b %Tf "%{Referer}i" "%{User-Agent}i"'
 
 _file_dir = os.path.dirname(__file__)
 
 app = AioHttpApp(
     __name__, specification_dir=os.path.join(_file_dir, "..", "resources", "schemas"),
     server_args=dict(
-        client_max_size=8 * 1024**2
-    )  
+        client_max_size=conf.server.client_max_size
+    )
 )
 
+# Registered before the API, so that it takes precedence over the route
+# connexion creates for it (connexion reads the whole body before the call).
+app.app.router.add_post("/api/v1/annotators/{annotator}/stream", stream_handler, name=STREAM_ROUTE)
+app.app.router.add_get("/metrics", metrics_handler)
+
 app.add_api("openapi.yaml", pass_context_arg_name="request")
 
 aiohttp_app: aiohttp.web.Application = app.app
 
-aiohttp_app.cleanup_ctx.append(statsd_client_factory(conf.statsd))
+aiohttp_app.cleanup_ctx.append(statsd_client_factory(conf.statsd, conf.statsd_aggregation))
 aiohttp_app.cleanup_ctx.append(redis_cache_factory(conf))
+aiohttp_app.cleanup_ctx.append(tiered_cache_factory(conf))
+aiohttp_app.cleanup_ctx.append(single_flight_factory())
+aiohttp_app.cleanup_ctx.append(warm_up_factory(warm_up_annotators))
+aiohttp_app.cleanup_ctx.append(process_pool_factory(
+    conf.nlp.num_workers, initializer=initialize_worker, start_method=conf.nlp.worker_start_method
+))
+aiohttp_app.cleanup_ctx.append(thread_pool_factory(conf.nlp.num_threads))
+aiohttp_app.cleanup_ctx.append(scheduler_factory(conf))
+aiohttp_app.cleanup_ctx.append(micro_batcher_factory(conf))
+aiohttp_app.cleanup_ctx.append(profiling_factory(conf.profiling))
+aiohttp_app.cleanup_ctx.append(metrics_factory(conf, annotators))
 
 aiohttp_app.middlewares.append(StatsdMiddleware())
+aiohttp_app.middlewares.append(MetricsMiddleware())
+aiohttp_app.middlewares.append(TimingMiddleware(conf.server.server_timing))
+aiohttp_app.middlewares.append(CompressionMiddleware(
+    conf.compression, conf.server.client_max_size, streaming_routes={STREAM_ROUTE}
+))
 
 if __name__ == "__main__":
-    app.run(access_log=access_log, access_log_format='%a %t "%r" %s %b %Tf "%{Referer}i" "%{User-Agent}i"')    
+    app.run(host=conf.server.host, port=conf.server.port, access_log=access_log, access_log_format=ACCESS_LOG_FORMAT)
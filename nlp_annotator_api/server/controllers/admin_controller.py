@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+import aiohttp.web
+import connexion
+
+from nlp_annotator_api.config.config import conf
+from nlp_annotator_api.utils.profiler import AnnotatorProfiles, SamplingProfiler, WorkerProfiling, format_collapsed
+
+_log = logging.getLogger(__name__)
+
+
+def _text_response(text: str) -> aiohttp.web.Response:
+    return aiohttp.web.Response(text=text, content_type="text/plain")
+
+
+async def get_profile(
+    request: aiohttp.web.Request,
+    seconds: float = 10,
+    interval_ms: float = 10,
+    workers: bool = True,
+    idle: bool = False,
+):
+    if seconds > conf.profiling.max_seconds:
+        return connexion.problem(400, 'Bad Request', f"Profiles are limited to {conf.profiling.max_seconds} seconds.")
+
+    lock: asyncio.Lock = request.config_dict["profile_lock"]
+
+    if lock.locked():
+        return connexion.problem(409, 'Conflict', "A profile is already being taken.")
+
+    async with lock:
+        _log.info("Profiling for %.1fs, every %.1fms (workers: %r)", seconds, interval_ms, workers)
+
+        interval = interval_ms / 1000
+        worker_profiling: Optional[WorkerProfiling] = request.config_dict.get("worker_profiling")
+
+        ## The workers sample themselves, this process is sampled from a thread.
+        worker_counts = None
+        if workers and worker_profiling is not None:
+            worker_counts = asyncio.get_running_loop().run_in_executor(
+                None, worker_profiling.profile, seconds, interval, conf.nlp.num_workers, idle
+            )
+
+        profiler = SamplingProfiler(interval, include_idle=idle, label=f"server-{os.getpid()}").start()
+
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            counts = profiler.stop()
+
+        if worker_counts is not None:
+            counts.update(await worker_counts)
+
+    return _text_response(format_collapsed(counts))
+
+
+async def get_annotator_profile(request: aiohttp.web.Request, annotator: str, reset: bool = False):
+    profiles: Optional[AnnotatorProfiles] = request.config_dict.get("annotator_profiles")
+
+    if profiles is None:
+        return connexion.problem(404, 'Not Found', "Always-on profiling is disabled (see profiling.sample_rate).")
+
+    counts = profiles.counts.get(annotator)
+
+    if not counts:
+        return connexion.problem(404, 'Not Found', f"Nothing was profiled for annotator {annotator!r} yet.")
+
+    if reset:
+        del profiles.counts[annotator]
+
+    return _text_response(format_collapsed(counts))
@@ -1,33 +1,45 @@
 import asyncio
 from datetime import datetime, timedelta, timezone
+import hashlib
 import json
 import logging
-from nlp_annotator_api.server.middleware.redis_cache import RedisCache
-from typing import Any, Optional
+import time
+from nlp_annotator_api.server.middleware.memory_cache import TieredCache
+from nlp_annotator_api.server.middleware.micro_batcher import MicroBatcher
+from nlp_annotator_api.server.middleware.request_timings import RequestTimings, get_request_timings
+from nlp_annotator_api.server.middleware.scheduler import DeadlineExceeded, DeadlineScheduler
+from nlp_annotator_api.server.middleware.single_flight import SingleFlight
+from nlp_annotator_api.server.signals.process_pool import RestartingProcessPool
+from typing import Any, List, Optional, Tuple, Union
+from concurrent.futures import Executor
 import aiohttp.web
 from attr import dataclass
 import connexion
 from connexion.exceptions import ProblemException
 from statsd import StatsClient
 
-from nlp_annotator_api.annotators.SimpleTextGeographyAnnotator import SimpleTextGeographyAnnotator
-from nlp_annotator_api.annotators.TextTableGeographyAnnotator import TextTableGeographyAnnotator
-from nlp_annotator_api.annotators.SimpleTextClassifier import SimpleTextClassifier
-from nlp_annotator_api.annotators.ScispacyBiomedAnnotator import ScispacyBiomedAnnotator
-from nlp_annotator_api.annotators.WatsonHealthAnnotator import WatsonHealthAnnotator
+from nlp_annotator_api.config.config import conf
+
+from nlp_annotator_api.annotators.AbstractAnnotator import AbstractAnnotator
+from nlp_annotator_api.annotators.AnnotatorRegistry import AnnotatorRegistry
+from nlp_annotator_api.utils.profiler import AnnotatorProfiles, profile_call
+from nlp_annotator_api.utils.serialization import get_serializer
 
 
 _log = logging.getLogger(__name__)
 
-# If you have several annotators, import them all here in the same way,
-# and put them in the following dictionary:
-annotators = {
-    'SimpleTextGeographyAnnotator': SimpleTextGeographyAnnotator(),
-    'TextTableGeographyAnnotator': TextTableGeographyAnnotator(),
-    'SimpleTextClassifier': SimpleTextClassifier(),
-    'ScispacyBiomedAnnotator': ScispacyBiomedAnnotator(),
-    'WatsonHealthAnnotator': WatsonHealthAnnotator()
-}
+# If you have several annotators, put them all in the following dictionary
+# in the same way ("module:ClassName"). They are instantiated when first needed.
+annotators = AnnotatorRegistry({
+    'SimpleTextGeographyAnnotator': 'nlp_annotator_api.annotators.SimpleTextGeographyAnnotator:SimpleTextGeographyAnnotator',
+    'TextTableGeographyAnnotator': 'nlp_annotator_api.annotators.TextTableGeographyAnnotator:TextTableGeographyAnnotator',
+    'SimpleTextClassifier': 'nlp_annotator_api.annotators.SimpleTextClassifier:SimpleTextClassifier',
+    'ScispacyBiomedAnnotator': 'nlp_annotator_api.annotators.ScispacyBiomedAnnotator:ScispacyBiomedAnnotator',
+    'WatsonHealthAnnotator': 'nlp_annotator_api.annotators.WatsonHealthAnnotator:WatsonHealthAnnotator',
+}, conf.annotators)
+
+# Responses are serialized once, and cached as such.
+serializer = get_serializer(conf.server.json_serializer)
 
 
 # Return the name of all annotators callable in this API
@@ -35,6 +47,117 @@ def get_annotator_definitions():
     return list(annotators.keys())
 
 
+def warm_up_annotators():
+    # Imports all the annotators, and loads (and warms up) the ones configured
+    # to be preloaded, the others are loaded on their first request.
+    annotators.resolve()
+    annotators.preload()
+
+
+def initialize_worker():
+    # Process pool initializer. Preloading the annotators here makes the worker
+    # ready to annotate before it takes its first request. (Workers forked after
+    # the warm-up at startup inherit the loaded annotators.)
+    AbstractAnnotator.in_process_pool = True
+    warm_up_annotators()
+    _log.info("Worker ready with annotators %r", annotators.loaded())
+
+
+def _get_executor(
+    annotator: str, request: aiohttp.web.Request
+) -> Tuple[str, Optional[Union[Executor, RestartingProcessPool]]]:
+    kind = conf.nlp.annotator_executors.get(annotator, conf.nlp.executor)
+
+    if kind == "process":
+        return kind, request.config_dict.get("process_pool")
+
+    if kind == "thread":
+        return kind, request.config_dict.get("thread_pool")
+
+    if kind != "inline":
+        _log.warning("Unknown executor %r for annotator %r, running inline", kind, annotator)
+
+    return "inline", None
+
+
+def _count_characters(body: dict) -> int:
+    # Rough size of the work in a request, used to estimate its duration.
+    body_part = next(iter(body.values()))
+    items = body_part.get(_items_fields.get(body_part.get('object_type', 'text'), '')) if isinstance(body_part, dict) else None
+
+    if not isinstance(items, list):
+        return 0
+
+    count = 0
+    for item in items:
+        if isinstance(item, str):
+            count += len(item)
+        elif isinstance(item, list):
+            ## Tables: rows of cells
+            count += sum(len(cell.get("text", "")) for row in item for cell in row if isinstance(cell, dict))
+        else:
+            count += len(str(item))
+
+    return count
+
+
+def _count_items(body: dict) -> int:
+    body_part = next(iter(body.values()))
+    items = body_part.get(_items_fields.get(body_part.get('object_type', 'text'), '')) if isinstance(body_part, dict) else None
+
+    return len(items) if isinstance(items, list) else 0
+
+
+async def _dispatch_annotator(
+    annotator: str,
+    body: dict,
+    request: aiohttp.web.Request,
+    deadline: Optional[float],
+    timings: Optional[List[RequestTimings]] = None,
+):
+    # `timings`: of the requests the body gathers (micro-batches), by default of `request`.
+    # They all waited for and were annotated in this run, which is profiled once.
+    kind, executor = _get_executor(annotator, request)
+    timings = timings or [get_request_timings(request)]
+
+    ## Always-on profiling of a fraction of the annotations
+    profiles: Optional[AnnotatorProfiles] = request.config_dict.get("annotator_profiles")
+    profile_interval = conf.profiling.interval_seconds if profiles is not None and profiles.sampled(annotator) else None
+
+    if executor is None:
+        results, _, seconds, stacks = _run_annotator_timed(annotator, body, deadline, profile_interval)
+    else:
+        loop = asyncio.get_running_loop()
+        scheduler: Optional[DeadlineScheduler] = request.config_dict.get("schedulers", {}).get(kind)
+
+        def compute():
+            if isinstance(executor, RestartingProcessPool):
+                return executor.run(_run_annotator_timed, annotator, body, deadline, profile_interval)
+
+            return loop.run_in_executor(executor, _run_annotator_timed, annotator, body, deadline, profile_interval)
+
+        queued = time.time()
+
+        if scheduler is None:
+            results, started, seconds, stacks = await compute()
+        else:
+            results, started, seconds, stacks = await scheduler.run(
+                annotator, _count_characters(body), deadline, compute
+            )
+
+        ## Waiting for the scheduler, then for a free worker
+        for request_timings in timings:
+            request_timings.add("queue", started - queued)
+
+    for request_timings in timings:
+        request_timings.add("inference", seconds)
+
+    if stacks is not None:
+        profiles.add(annotator, stacks)
+
+    return results
+
+
 @dataclass
 class _TimingParameters:
     deadline: Optional[datetime] = None
@@ -55,6 +178,9 @@ def _get_timing_parameters(request: aiohttp.web.Request):
     if x_cps_deadline:
         parameters.deadline = datetime.fromisoformat(x_cps_deadline)
 
+        if parameters.deadline.tzinfo is None:
+            parameters.deadline = parameters.deadline.replace(tzinfo=timezone.utc)
+
     if x_cps_transaction_id:
         parameters.transaction_id = x_cps_transaction_id
 
@@ -67,27 +193,37 @@ def _get_timing_parameters(request: aiohttp.web.Request):
     return parameters
 
 
-async def _get_cached_response(params: _TimingParameters, request: aiohttp.web.Request):
-    cache: Optional[RedisCache] = request.config_dict.get("redis_cache")
+def _get_response_cache_key(annotator: str, operation: str, params: _TimingParameters) -> str:
+    # A transaction may call several annotators, or operations of an annotator.
+    return f"response.{annotator}.{operation}.{params.transaction_id}"
+
+
+async def _get_cached_response(
+    annotator: str, operation: str, params: _TimingParameters, request: aiohttp.web.Request
+) -> Optional[bytes]:
+    # Output: the serialized response, sent as is
+    cache: Optional[TieredCache] = request.config_dict.get("cache")
 
     if not params.transaction_id or cache is None:
         return
 
     _log.info("Checking for id=%r in cache", params.transaction_id)
 
-    result_str = await cache.get(params.transaction_id)
+    result = await cache.get(_get_response_cache_key(annotator, operation, params))
 
-    if result_str is not None:
+    if result is not None:
         _log.info("Value for id=%r is cached", params.transaction_id)
-        return json.loads(result_str)
+        return result
 
     _log.info("Value for id=%r not in cache", params.transaction_id)
 
     return None
 
 
-async def _store_response(params: _TimingParameters, value: Any, request: aiohttp.web.Request):
-    cache: Optional[RedisCache] = request.config_dict.get("redis_cache")
+async def _store_response(
+    annotator: str, operation: str, params: _TimingParameters, value: bytes, request: aiohttp.web.Request
+):
+    cache: Optional[TieredCache] = request.config_dict.get("cache")
 
     if not params.transaction_id or cache is None:
         return
@@ -104,7 +240,191 @@ async def _store_response(params: _TimingParameters, value: Any, request: aiohtt
 
     _log.info("Storing result id=%r in cache", params.transaction_id)
 
-    await cache.set(params.transaction_id, json.dumps(value))
+    await cache.set(_get_response_cache_key(annotator, operation, params), value)
+
+
+def _json_response(body: bytes) -> aiohttp.web.Response:
+    # Already serialized, connexion passes it through.
+    return aiohttp.web.Response(body=body, content_type="application/json")
+
+
+# Operations whose results are cached per item: operation -> (names field, result field)
+_item_operations = {
+    'find_entities': ('entity_names', 'entities'),
+    'find_relationships': ('relationship_names', 'relationships'),
+    'find_properties': ('property_names', 'properties'),
+}
+
+_items_fields = {
+    'text': 'texts',
+    'image': 'images',
+    'table': 'tables',
+}
+
+
+def _get_item_cache_keys(annotator: str, operation: str, body_part: dict) -> Optional[List[str]]:
+    # The key of an item hashes everything its annotation depends on.
+    # Returns None if the input can't be cached per item, the annotator will
+    # then deal with it (and with its validation).
+    object_type = body_part.get('object_type', 'text')
+    items = body_part.get(_items_fields.get(object_type, ''))
+
+    if not isinstance(items, list):
+        return None
+
+    entities = body_part.get('entities')
+    if entities is not None and (not isinstance(entities, list) or len(entities) != len(items)):
+        return None
+
+    names_field, _ = _item_operations[operation]
+    names = body_part.get(names_field)
+    if isinstance(names, list):
+        names = sorted(names)
+
+    version = annotators.version(annotator)
+
+    keys = []
+    for index, item in enumerate(items):
+        payload = [
+            annotator, version, operation, object_type, names, item,
+            entities[index] if entities is not None else None,
+        ]
+        digest = hashlib.sha256(
+            json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+        keys.append(f"item.{digest}")
+
+    return keys
+
+
+def _select_items(body_part: dict, indexes: List[int]) -> dict:
+    object_type = body_part.get('object_type', 'text')
+    items_field = _items_fields[object_type]
+
+    selected = dict(body_part)
+    selected[items_field] = [body_part[items_field][index] for index in indexes]
+
+    if body_part.get('entities') is not None:
+        selected['entities'] = [body_part['entities'][index] for index in indexes]
+
+    return selected
+
+
+async def _dispatch_batched(annotator: str, body: dict, request: aiohttp.web.Request):
+    # find_entities items of concurrent requests with the same parameters
+    # are annotated together, if the annotator has micro-batching enabled.
+    batcher: Optional[MicroBatcher] = request.config_dict.get("micro_batcher")
+    body_part = body.get('find_entities')
+
+    if batcher is None or not batcher.enabled(annotator) or not isinstance(body_part, dict):
+        return await _dispatch_annotator(annotator, body, request, request.get("deadline"))
+
+    items_field = _items_fields.get(body_part.get('object_type', 'text'), '')
+    items = body_part.get(items_field)
+    names = body_part.get('entity_names')
+
+    if not isinstance(items, list) or not items or not isinstance(names, list):
+        return await _dispatch_annotator(annotator, body, request, request.get("deadline"))
+
+    parameters = {**body_part, 'entity_names': sorted(names)}
+    del parameters[items_field]
+    key = (annotator, json.dumps(parameters, sort_keys=True))
+
+    async def run(batch_items: list, deadline: Optional[float], timings: List[RequestTimings]):
+        results = await _dispatch_annotator(
+            annotator, {'find_entities': {**body_part, items_field: batch_items}}, request, deadline, timings
+        )
+        return (results or {}).get('entities')
+
+    entities = await batcher.submit(
+        annotator, key, items, request.get("deadline"), run, get_request_timings(request)
+    )
+
+    return {'entities': entities}
+
+
+async def _run_with_item_cache(annotator: str, body: dict, request: aiohttp.web.Request):
+    cache: Optional[TieredCache] = request.config_dict.get("cache")
+    operation = next(iter(body.keys()))
+
+    if cache is None or not cache.item_cache or operation not in _item_operations:
+        return await _dispatch_batched(annotator, body, request)
+
+    body_part = body[operation]
+    keys = _get_item_cache_keys(annotator, operation, body_part)
+
+    if not keys:
+        return await _dispatch_batched(annotator, body, request)
+
+    _, result_field = _item_operations[operation]
+
+    timings = get_request_timings(request)
+
+    with timings.stage("cache"):
+        cached = await cache.get_many(keys, items=True)
+    values = [serializer.loads(value) if value is not None else None for value in cached]
+    misses = [index for index, value in enumerate(cached) if value is None]
+
+    _log.info("Item cache: %r hits, %r misses", len(keys) - len(misses), len(misses))
+
+    if not misses:
+        return {result_field: values}
+
+    if len(misses) == len(keys):
+        results = await _dispatch_batched(annotator, body, request)
+    else:
+        results = await _dispatch_batched(annotator, {operation: _select_items(body_part, misses)}, request)
+
+    missed_values = (results or {}).get(result_field)
+
+    if not isinstance(missed_values, list) or len(missed_values) != len(misses):
+        # The annotator did not return one result per item, so they can't be cached individually.
+        _log.info("Results of %r are not aligned with the items, not caching them", annotator)
+
+        if len(misses) == len(keys):
+            return results
+
+        return await _dispatch_batched(annotator, body, request)
+
+    for index, value in zip(misses, missed_values):
+        values[index] = value
+
+    # aiohttp may cancel the coroutine here if the client disconnects.
+    # So, shield it from cancellation.
+    with timings.stage("cache_store"):
+        await asyncio.shield(cache.set_many(
+            {keys[index]: serializer.dumps(values[index]) for index in misses},
+            ttl=cache.item_ttl,
+            items=True,
+        ))
+
+    return {result_field: values}
+
+
+def _get_single_flight_keys(annotator: str, body: dict, params: _TimingParameters) -> List[str]:
+    # Only identical requests share a computation: a transaction may call several
+    # operations of an annotator, and a retry may differ from the first attempt.
+    operation = next(iter(body.keys()))
+    digest = hashlib.sha256(
+        json.dumps([annotator, body], sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+
+    keys = []
+
+    if params.transaction_id:
+        keys.append(f"transaction.{annotator}.{operation}.{params.transaction_id}.{digest}")
+
+    if conf.nlp.coalesce_by_content:
+        keys.append(f"content.{digest}")
+
+    return keys
+
+
+async def _annotate_serialized(annotator: str, body: dict, request: aiohttp.web.Request) -> bytes:
+    results = await _run_with_item_cache(annotator, body, request)
+
+    with get_request_timings(request).stage("serialize"):
+        return serializer.dumps(results)
 
 
 async def run_nlp_annotator(
@@ -112,34 +432,136 @@ async def run_nlp_annotator(
     body: dict, 
     request: aiohttp.web.Request, 
 ):
+    ## Reading, decoding and validating the body (by connexion), since the request came in
+    timings = get_request_timings(request)
+    timings.add("parse", timings.elapsed())
+
+    operation = next(iter(body.keys()))
+
+    if annotator in annotators:
+        timings.operation, timings.annotator = operation, annotator
+        timings.counts["items"] = _count_items(body)
+        timings.counts["chars"] = _count_characters(body)
+
     timing_params = _get_timing_parameters(request)
 
-    cached_response = await _get_cached_response(timing_params, request)
+    if timing_params.deadline is not None:
+        ## Read by the scheduler and the workers, which stop once it has passed.
+        request["deadline"] = timing_params.deadline.timestamp()
+
+    if annotator in annotators:
+        with timings.stage("cache"):
+            cached_response = await _get_cached_response(annotator, operation, timing_params, request)
 
-    if cached_response is not None:
-        return cached_response
+        if cached_response is not None:
+            return _json_response(cached_response)
 
     _log.info("Annotating... (id=%r)", timing_params.transaction_id)
 
     client: StatsClient = request.config_dict['statsd_client']
 
     with client.pipeline() as pip:
-        operation = next(iter(body.keys()))
-
         if not (annotator in annotators):
-            pip.incr(f"run_nlp_annotator.bad_annotator.{operation}.{annotator}.count")
+            # Not named after the annotator: any name can be requested.
+            pip.incr(f"run_nlp_annotator.bad_annotator.{operation}.count")
             return connexion.problem(404, 'Not Found', f"Annotator {annotator!r} not found.")
 
         pip.incr(f"run_nlp_annotator.{operation}.{annotator}.count")
 
         with pip.timer(f"run_nlp_annotator.{operation}.{annotator}.time"):
-            results = _run_annotator(annotators[annotator], body)
+            # Retries and duplicates arriving while the same request is
+            # being annotated share its computation.
+            single_flight: Optional[SingleFlight] = request.config_dict.get("single_flight")
+            keys = _get_single_flight_keys(annotator, body, timing_params)
+
+            if single_flight is None or not keys:
+                results = await _annotate_serialized(annotator, body, request)
+            else:
+                start = time.perf_counter()
+                results, shared = await single_flight.run(
+                    keys, lambda: _annotate_serialized(annotator, body, request), request.get("deadline")
+                )
+
+                if shared:
+                    ## The stages of the computation are measured in the request which started it
+                    timings.add("coalesced", time.perf_counter() - start)
+                    pip.incr(f"run_nlp_annotator.{operation}.{annotator}.coalesced.count")
 
         # aiohttp may cancel the coroutine here if the client disconnects.
         # So, shield it from cancellation.
-        await asyncio.shield(_store_response(timing_params, results, request))
+        with timings.stage("cache_store"):
+            await asyncio.shield(_store_response(annotator, operation, timing_params, results, request))
+
+        return _json_response(results)
+
+
+def _run_annotator_timed(
+    annotator: str, body: dict, deadline: Optional[float] = None, profile_interval: Optional[float] = None
+):
+    # Also returns when the annotation started (wall clock, comparable across
+    # processes, to measure the queue wait), how long it took, and its profile
+    # (collapsed stacks) if `profile_interval` is set.
+    started = time.time()
+    start = time.perf_counter()
+
+    if profile_interval is None:
+        results, stacks = _run_annotator_by_name(annotator, body, deadline), None
+    else:
+        results, stacks = profile_call(annotator, profile_interval, _run_annotator_by_name, annotator, body, deadline)
+
+    return results, started, time.perf_counter() - start, stacks
+
+
+def _run_annotator_by_name(annotator: str, body: dict, deadline: Optional[float] = None):
+    # Entry point for the executors: only the annotator name travels to the
+    # worker, which uses its own, already loaded, instance.
+    if deadline is None:
+        return _run_annotator(annotators[annotator], body)
+
+    return _run_annotator_until(annotators[annotator], body, deadline)
+
+
+def _run_annotator_until(annot, body: dict, deadline: float):
+    # Annotate the items in slices, and give up between two slices once the
+    # deadline has passed: nobody waits for the result anymore.
+    if time.time() > deadline:
+        raise DeadlineExceeded()
+
+    operation = next(iter(body.keys()))
+    body_part = body[operation]
+    slice_items = conf.nlp.deadline_slice_items
+
+    if operation not in _item_operations or slice_items <= 0:
+        return _run_annotator(annot, body)
+
+    items = body_part.get(_items_fields.get(body_part.get('object_type', 'text'), ''))
+    entities = body_part.get('entities')
+
+    if (
+        not isinstance(items, list)
+        or len(items) <= slice_items
+        or (entities is not None and (not isinstance(entities, list) or len(entities) != len(items)))
+    ):
+        return _run_annotator(annot, body)
+
+    _, result_field = _item_operations[operation]
+    values = []
+
+    for start in range(0, len(items), slice_items):
+        if time.time() > deadline:
+            raise DeadlineExceeded()
+
+        indexes = list(range(start, min(start + slice_items, len(items))))
+        results = _run_annotator(annot, {operation: _select_items(body_part, indexes)})
+        slice_values = results.get(result_field)
+
+        if not isinstance(slice_values, list) or len(slice_values) != len(indexes):
+            ## Not one result per item, the slices can't be put together.
+            return _run_annotator(annot, body)
+
+        values.extend(slice_values)
 
-        return results
+    return {result_field: values}
 
 
 def _run_annotator(annot, body):
@@ -1,6 +1,17 @@
 import logging
+
+import aiohttp.web
+import connexion
+
 _log = logging.getLogger(__name__)
 
 
-def health():
+def health(request: aiohttp.web.Request):
+    # Fails while the process pool is broken, e.g. if it could not be replaced
+    # after losing a worker: the server can't annotate, it should be restarted.
+    pool = request.config_dict.get("process_pool")
+
+    if pool is not None and pool.broken:
+        return connexion.problem(503, "Service Unavailable", "The process pool is broken.")
+
     return {"status": "OK"}
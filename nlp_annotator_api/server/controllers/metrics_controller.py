@@ -0,0 +1,32 @@
+import logging
+import pathlib
+from typing import Optional
+
+import aiohttp.web
+
+from nlp_annotator_api.config.config import conf
+from nlp_annotator_api.server.middleware.metrics_middleware import ServerMetrics
+from nlp_annotator_api.utils.metrics import CONTENT_TYPE, merge, read_snapshots, render
+
+_log = logging.getLogger(__name__)
+
+
+async def metrics_handler(request: aiohttp.web.Request):
+    # Served by a plain aiohttp route at /metrics, where Prometheus expects it
+    # (outside of the API, and without authentication).
+    metrics: Optional[ServerMetrics] = request.config_dict.get("metrics")
+
+    if metrics is None:
+        raise aiohttp.web.HTTPNotFound()
+
+    families = metrics.registry.collect()
+
+    if conf.metrics.multiprocess_dir:
+        ## This process's metrics are fresh, the others' are as of their last snapshot.
+        own_snapshot: pathlib.Path = request.config_dict["metrics_snapshot"]
+        processes = read_snapshots(pathlib.Path(conf.metrics.multiprocess_dir), exclude=own_snapshot)
+        processes[own_snapshot.stem] = families
+
+        families = merge(processes)
+
+    return aiohttp.web.Response(body=render(families).encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
@@ -0,0 +1,240 @@
+import asyncio
+import collections
+import logging
+from typing import AsyncIterator, List, Optional, Tuple
+
+import aiohttp.web
+from connexion.exceptions import OAuthProblem, ProblemException
+from statsd import StatsClient
+
+from nlp_annotator_api.config.config import conf
+from nlp_annotator_api.server.auth.check_apikey import check_apikey
+from nlp_annotator_api.server.controllers.annotate_controller import (
+    _get_timing_parameters,
+    _items_fields,
+    _run_with_item_cache,
+    annotators,
+    serializer,
+)
+from nlp_annotator_api.utils import compression
+
+_log = logging.getLogger(__name__)
+
+## Object types which can be streamed, one item per line
+_stream_object_types = ('text', 'table')
+
+## Name of the route, for the middlewares
+STREAM_ROUTE = "stream_nlp_annotator"
+
+
+def _problem_response(status: int, title: str, detail: str) -> aiohttp.web.Response:
+    ## This endpoint bypasses connexion (see `stream_handler`), which would
+    ## otherwise format the problems.
+    return aiohttp.web.json_response(
+        {"type": "about:blank", "title": title, "detail": detail, "status": status},
+        status=status,
+        content_type="application/problem+json",
+    )
+
+
+async def _iter_body(request: aiohttp.web.Request) -> AsyncIterator[bytes]:
+    ## The body as it is received. aiohttp decodes gzip, zstd is decoded here,
+    ## in slices, so that the line limit applies before much is decompressed.
+    coding = request.headers.get("Content-Encoding", "").strip().lower()
+
+    if coding != compression.ZSTD:
+        async for data in request.content.iter_any():
+            yield data
+        return
+
+    unpacker = compression.decompressor(coding)
+
+    async for data in request.content.iter_any():
+        for start in range(0, len(data), 16 * 1024):
+            try:
+                yield unpacker.decompress(data[start:start + 16 * 1024])
+            except compression.DecompressionError as exc:
+                raise ProblemException(400, "Bad Request", f"Invalid {coding} body: {exc}")
+
+
+async def _iter_lines(body: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[List[bytes]]:
+    ## Yields the complete lines received so far, as soon as they are received.
+    buffer = bytearray()
+
+    async for data in body:
+        buffer.extend(data)
+        end = buffer.rfind(b"\n")
+
+        if end >= 0:
+            lines = [line for line in bytes(buffer[:end]).split(b"\n") if line.strip()]
+            del buffer[:end + 1]
+
+            if lines:
+                yield lines
+
+        if len(buffer) > max_line_bytes:
+            raise ProblemException(413, "Payload Too Large", f"Lines are limited to {max_line_bytes} bytes.")
+
+    if buffer.strip():
+        yield [bytes(buffer)]
+
+
+async def _iter_chunks(body: AsyncIterator[bytes], chunk_items: int) -> AsyncIterator[List[bytes]]:
+    ## Groups the lines in chunks of at most `chunk_items`. A partial chunk is not
+    ## held back waiting for more lines, so that the first results come quickly.
+    async for lines in _iter_lines(body, conf.nlp.stream_max_line_bytes):
+        for start in range(0, len(lines), chunk_items):
+            yield lines[start:start + chunk_items]
+
+
+def _parse_items(lines: List[bytes]) -> Tuple[list, List[Optional[str]]]:
+    ## Output: the items, and the parsing error of each line (if any)
+    items, errors = [], []
+
+    for line in lines:
+        try:
+            items.append(serializer.loads(line))
+            errors.append(None)
+        except ValueError as exc:
+            items.append(None)
+            errors.append(f"Invalid JSON: {exc}")
+
+    return items, errors
+
+
+def _error_result(index: int, status: int, title: str, detail: str) -> dict:
+    return {"index": index, "error": {"status": status, "title": title, "detail": detail}}
+
+
+async def _annotate_chunk(
+    annotator: str,
+    object_type: str,
+    entity_names: Optional[List[str]],
+    start: int,
+    lines: List[bytes],
+    request: aiohttp.web.Request,
+) -> bytes:
+    items, errors = _parse_items(lines)
+    valid = [index for index, error in enumerate(errors) if error is None]
+
+    ## The valid lines are filled in below
+    results: List[Optional[dict]] = [
+        None if error is None else _error_result(start + index, 400, "Bad Request", error)
+        for index, error in enumerate(errors)
+    ]
+
+    if valid:
+        body = {
+            'find_entities': {
+                'object_type': object_type,
+                'entity_names': entity_names,
+                _items_fields[object_type]: [items[index] for index in valid],
+            }
+        }
+
+        try:
+            entities = (await _run_with_item_cache(annotator, body, request))['entities']
+
+            if len(entities) != len(valid):
+                _log.error("Annotator %r returned %r results for %r items", annotator, len(entities), len(valid))
+                raise ProblemException(
+                    500, "Internal Server Error", "The annotator did not return one result per item."
+                )
+
+            for index, value in zip(valid, entities):
+                results[index] = {"index": start + index, "entities": value}
+        except ProblemException as exc:
+            for index in valid:
+                results[index] = _error_result(start + index, exc.status, exc.title, exc.detail)
+
+    return b"".join(serializer.dumps(result) + b"\n" for result in results)
+
+
+async def _write_error(response: aiohttp.web.StreamResponse, status: int, title: str, detail: str):
+    ## Last line of a stream which failed as a whole, it has no index
+    await response.write(serializer.dumps({"error": {"status": status, "title": title, "detail": detail}}) + b"\n")
+
+
+async def stream_nlp_annotator(annotator: str, request: aiohttp.web.Request):
+    # Annotates NDJSON items (one text or table per line) read incrementally
+    # from the request body, and writes one NDJSON result per item, in order,
+    # as soon as its chunk is annotated:
+    #   {"index": 0, "entities": {"cities": [...]}}
+    #   {"index": 1, "error": {"status": 400, "title": "Bad Request", "detail": "..."}}
+    try:
+        check_apikey(request.headers.get("Authorization"), None)
+    except OAuthProblem as exc:
+        return _problem_response(401, "Unauthorized", exc.description)
+
+    if annotator not in annotators:
+        return _problem_response(404, "Not Found", f"Annotator {annotator!r} not found.")
+
+    object_type = request.query.get("object_type", "text")
+    if object_type not in _stream_object_types:
+        return _problem_response(400, "Bad Request", f"Object type {object_type!r} can't be streamed.")
+
+    ## None (all the entities of the annotator) when not given, as in the other operations
+    entity_names = [
+        name
+        for value in request.query.getall("entity_names", [])
+        for name in value.split(",")
+        if name
+    ] or None
+
+    timing_params = _get_timing_parameters(request)
+    if timing_params.deadline is not None:
+        request["deadline"] = timing_params.deadline.timestamp()
+
+    client: StatsClient = request.config_dict['statsd_client']
+    client.incr(f"stream_nlp_annotator.{annotator}.count")
+
+    response = aiohttp.web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+
+    ## Chunks being annotated, in order. Bounded, so that the body is read only
+    ## as fast as it is annotated and the memory use stays flat.
+    pending = collections.deque()
+    count = 0
+
+    async def write_done(block: bool):
+        while pending and (block or pending[0].done()):
+            await response.write(await pending.popleft())
+
+    try:
+        async for lines in _iter_chunks(_iter_body(request), conf.nlp.stream_chunk_items):
+            pending.append(asyncio.ensure_future(
+                _annotate_chunk(annotator, object_type, entity_names, count, lines, request)
+            ))
+            count += len(lines)
+
+            await write_done(block=False)
+            while len(pending) >= conf.nlp.stream_max_pending_chunks:
+                await response.write(await pending.popleft())
+
+        await write_done(block=True)
+    except ProblemException as exc:
+        ## The response has started, the error can only be reported in the stream.
+        await write_done(block=True)
+        await _write_error(response, exc.status, exc.title, exc.detail)
+    except ConnectionResetError:
+        ## The client went away, nothing can be reported
+        raise
+    except Exception:
+        ## Reported as well, so that the client does not take the truncated stream for a complete one.
+        _log.exception("Streaming annotation with %r failed after %r items", annotator, count)
+        await _write_error(response, 500, "Internal Server Error", "The annotation failed unexpectedly.")
+    finally:
+        for task in pending:
+            task.cancel()
+
+    client.incr(f"stream_nlp_annotator.{annotator}.items.count", count)
+
+    await response.write_eof()
+
+    return response
+
+
+async def stream_handler(request: aiohttp.web.Request):
+    # Served by a plain aiohttp route, since connexion reads the whole body
+    # into memory before calling the operation.
+    return await stream_nlp_annotator(request.match_info["annotator"], request)
@@ -0,0 +1,270 @@
+## Runs the API server in several processes sharing one listening socket:
+##
+##   python -m nlp_annotator_api.server.launcher --workers 4
+##
+## The annotators configured in `annotators.preload` are loaded once, before
+## the workers are forked, so that they share them. The launcher restarts the
+## workers which exit, and forwards SIGTERM/SIGINT to them for a graceful
+## shutdown. SIGHUP restarts all the workers.
+##
+## The workers share their metrics through a directory (`metrics.multiprocess_dir`,
+## a temporary one by default), so that /metrics exposes those of all of them.
+
+import argparse
+import gc
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import pathlib
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Set
+
+from nlp_annotator_api.config.config import conf
+
+## Named explicitly, since this module usually runs as __main__
+_log = logging.getLogger("nlp_annotator_api.server.launcher")
+
+## Workers exiting later than this after their start are restarted right away.
+_MIN_UPTIME_SECONDS = 10.0
+_MAX_RESTART_DELAY_SECONDS = 60.0
+
+
+def create_socket(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    ## Also lets a new launcher bind the port while the previous one shuts down.
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    sock.bind((host, port))
+    sock.listen(backlog)
+
+    return sock
+
+
+def serve(sock: socket.socket, worker_id: int):
+    ## Runs in the workers: the aiohttp server of `app.py`, on the shared socket.
+    from aiohttp import web
+
+    from nlp_annotator_api.server.app import ACCESS_LOG_FORMAT, access_log, aiohttp_app
+
+    ## Inherited from the launcher, aiohttp handles SIGTERM and SIGINT itself.
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    ## With its annotation processes, so that the launcher can clean them up if the worker dies.
+    os.setpgrp()
+
+    aiohttp_app["worker_id"] = worker_id
+
+    _log.info("Worker %r serving on %s:%s", worker_id, *sock.getsockname()[:2])
+
+    web.run_app(aiohttp_app, sock=sock, access_log=access_log, access_log_format=ACCESS_LOG_FORMAT, print=None)
+
+
+class Launcher:
+    """
+    Starts `num_workers` forked processes running `target(sock, worker_id)`,
+    and keeps them running until it is asked to stop.
+
+    A worker which exits is restarted with the same id. Workers which crash
+    right after starting are restarted with an increasing delay, so that a
+    broken configuration does not turn into a fork loop.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        num_workers: int,
+        target: Callable[[socket.socket, int], None] = serve,
+        restart_delay_seconds: float = 1.0,
+        shutdown_timeout_seconds: float = 30.0,
+    ) -> None:
+        self.sock = sock
+        self.num_workers = num_workers
+        self.target = target
+        self.restart_delay_seconds = restart_delay_seconds
+        self.shutdown_timeout_seconds = shutdown_timeout_seconds
+
+        self._context = multiprocessing.get_context("fork")
+        self._workers: Dict[int, multiprocessing.Process] = {}
+        self._started: Dict[int, float] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._restart_delay: Dict[int, float] = {}
+        ## Workers asked to exit by a reload, restarted without a delay
+        self._reloading: Set[int] = set()
+
+        self._stopping = False
+        self._reload = False
+
+    def _start(self, worker_id: int):
+        process = self._context.Process(
+            target=self.target, args=(self.sock, worker_id), name=f"nlp-api-worker-{worker_id}"
+        )
+        process.start()
+
+        self._workers[worker_id] = process
+        self._started[worker_id] = time.monotonic()
+
+        _log.debug("Started worker %r (pid %r)", worker_id, process.pid)
+
+    def _on_exit(self, worker_id: int):
+        process = self._workers.pop(worker_id)
+        uptime = time.monotonic() - self._started[worker_id]
+
+        self._kill_group(process)
+
+        if self._stopping:
+            return
+
+        if worker_id in self._reloading:
+            self._reloading.discard(worker_id)
+            self._restart_at[worker_id] = time.monotonic()
+            return
+
+        if uptime < _MIN_UPTIME_SECONDS:
+            delay = self._restart_delay.get(worker_id, self.restart_delay_seconds)
+            self._restart_delay[worker_id] = min(2 * delay, _MAX_RESTART_DELAY_SECONDS)
+        else:
+            delay = 0.0
+            self._restart_delay.pop(worker_id, None)
+
+        _log.warning(
+            "Worker %r (pid %r) exited with code %r after %.1fs, restarting it in %.1fs",
+            worker_id, process.pid, process.exitcode, uptime, delay,
+        )
+
+        self._restart_at[worker_id] = time.monotonic() + delay
+
+    @staticmethod
+    def _kill_group(process: multiprocessing.Process):
+        ## Processes the worker left behind, e.g. its process pool if it was killed
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _signal_workers(self, signum: int):
+        for process in self._workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def stop(self, *_):
+        self._stopping = True
+
+    def reload(self, *_):
+        self._reload = True
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.reload)
+
+        for worker_id in range(self.num_workers):
+            self._start(worker_id)
+
+        while not self._stopping:
+            if self._reload:
+                self._reload = False
+                _log.info("Restarting the workers")
+                self._reloading.update(self._workers)
+                self._signal_workers(signal.SIGTERM)
+
+            timeout = min([1.0, *(restart_at - time.monotonic() for restart_at in self._restart_at.values())])
+            sentinels = [process.sentinel for process in self._workers.values()]
+            multiprocessing.connection.wait(sentinels, timeout=max(0.0, timeout))
+
+            for worker_id, process in list(self._workers.items()):
+                if not process.is_alive():
+                    self._on_exit(worker_id)
+
+            now = time.monotonic()
+            for worker_id, restart_at in list(self._restart_at.items()):
+                if restart_at <= now and not self._stopping:
+                    del self._restart_at[worker_id]
+                    self._start(worker_id)
+
+        self._shutdown()
+
+        return 0
+
+    def _shutdown(self):
+        _log.info("Stopping %r workers", len(self._workers))
+
+        self._signal_workers(signal.SIGTERM)
+
+        deadline = time.monotonic() + self.shutdown_timeout_seconds
+        for process in self._workers.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+
+        for worker_id, process in self._workers.items():
+            if process.is_alive():
+                _log.warning("Worker %r did not stop in time, killing it", worker_id)
+                process.kill()
+                process.join()
+
+            self._kill_group(process)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m nlp_annotator_api.server.launcher",
+        description="Runs the API server in several processes sharing one listening socket.",
+    )
+
+    parser.add_argument("--workers", type=int, default=conf.server.workers, help="server processes")
+    parser.add_argument("--host", default=conf.server.host)
+    parser.add_argument("--port", type=int, default=conf.server.port)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    ## Imported (and the logging set up) before forking, so that the workers
+    ## share the application and the preloaded annotators.
+    from nlp_annotator_api.server.controllers.annotate_controller import warm_up_annotators
+    from nlp_annotator_api.server.app import app  # noqa: F401
+
+    warm_up_annotators()
+
+    ## Set before forking, the workers inherit it.
+    metrics_dir = None
+    if args.workers > 1 and conf.metrics.enabled:
+        if conf.metrics.multiprocess_dir:
+            for path in pathlib.Path(conf.metrics.multiprocess_dir).glob("*.json"):
+                path.unlink()
+        else:
+            metrics_dir = conf.metrics.multiprocess_dir = tempfile.mkdtemp(prefix="nlp-api-metrics-")
+
+    gc.collect()
+    gc.freeze()
+
+    sock = create_socket(args.host, args.port)
+    _log.info("Listening on %s:%s with %r workers", args.host, args.port, args.workers)
+
+    launcher = Launcher(
+        sock,
+        args.workers,
+        restart_delay_seconds=conf.server.restart_delay_seconds,
+        shutdown_timeout_seconds=conf.server.shutdown_timeout_seconds,
+    )
+
+    try:
+        return launcher.run()
+    finally:
+        sock.close()
+
+        if metrics_dir is not None:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import logging
+from typing import Collection
+
+from aiohttp import web
+
+from nlp_annotator_api.config.config import CompressionConfig
+from nlp_annotator_api.server.middleware.request_timings import get_request_timings
+from nlp_annotator_api.utils import compression
+
+_log = logging.getLogger(__name__)
+
+# Decoded by aiohttp itself
+_DECODED_CODINGS = ("", "identity", "gzip", "deflate", "br")
+
+
+def _problem_response(status: int, title: str, detail: str) -> web.Response:
+    return web.json_response(
+        {"type": "about:blank", "title": title, "detail": detail, "status": status},
+        status=status,
+        content_type="application/problem+json",
+    )
+
+
+def _decoded_request(request: web.Request) -> web.Request:
+    ## The request, with the headers of its body once decompressed. Its length is not known
+    ## until then. Cloned before reading the body, which aiohttp does not allow afterwards.
+    headers = request.headers.copy()
+    del headers["Content-Encoding"]
+    headers.popall("Content-Length", None)
+
+    return request.clone(headers=headers)
+
+
+@web.middleware
+class CompressionMiddleware:
+    """
+    Decompresses zstd request bodies (aiohttp decompresses gzip ones), and
+    compresses the responses with zstd or gzip, as accepted by the client.
+
+    The routes in `streaming_routes` read their body incrementally, they
+    decompress it themselves.
+    """
+
+    def __init__(self, config: CompressionConfig, max_body_bytes: int, streaming_routes: Collection[str] = ()) -> None:
+        self.config = config
+        self.max_body_bytes = max_body_bytes
+        self.streaming_routes = streaming_routes
+
+    async def __call__(self, request: web.Request, handler):
+        coding = request.headers.get("Content-Encoding", "").strip().lower()
+
+        if coding not in _DECODED_CODINGS:
+            if coding not in compression.available_codings():
+                return _problem_response(
+                    415, "Unsupported Media Type", f"Content-Encoding {coding!r} is not supported."
+                )
+
+            if request.match_info.route.name not in self.streaming_routes:
+                request = _decoded_request(request)
+
+                try:
+                    with get_request_timings(request).stage("decompress"):
+                        body = await compression.offload(
+                            compression.decompress, await request.read(), coding, max_size=self.max_body_bytes
+                        )
+                except compression.TooLarge as exc:
+                    return _problem_response(413, "Payload Too Large", str(exc))
+                except ValueError as exc:
+                    return _problem_response(400, "Bad Request", f"Invalid {coding} body: {exc}")
+
+                ## Once set, `_read_bytes` is what `read`, `text`, `json` and `post` return, as of
+                ## aiohttp 3.8 (pinned in requirements.txt): connexion reads the decompressed body.
+                request._read_bytes = body
+
+        response = await handler(request)
+
+        return await self._compress(request, response)
+
+    async def _compress(self, request: web.Request, response: web.StreamResponse) -> web.StreamResponse:
+        ## Streamed responses are already sent, only the complete ones are compressed.
+        if not isinstance(response, web.Response) or response.prepared:
+            return response
+
+        body = response.body
+        if (
+            not isinstance(body, bytes)
+            or self.config.response_min_bytes is None
+            or len(body) < self.config.response_min_bytes
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+
+        response.headers.add("Vary", "Accept-Encoding")
+
+        coding = compression.accepted_coding(
+            request.headers.get("Accept-Encoding", ""), compression.available_codings()
+        )
+        if coding is None:
+            return response
+
+        level = self.config.zstd_level if coding == compression.ZSTD else self.config.gzip_level
+
+        with get_request_timings(request).stage("compress"):
+            compressed = await compression.offload(compression.compress, body, coding, level)
+
+        response.body = compressed
+        response.headers["Content-Encoding"] = coding
+
+        return response
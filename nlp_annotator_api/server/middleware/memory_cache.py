@@ -0,0 +1,199 @@
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from statsd import StatsClient
+
+from nlp_annotator_api.config.config import Config, MemoryCacheConfig
+from nlp_annotator_api.server.middleware.redis_cache import RedisCache
+
+_log = logging.getLogger(__name__)
+
+
+class MemoryCache:
+    """
+    In-process LRU cache, bounded by the memory used by its keys and values.
+    Entries also expire after their TTL.
+    """
+
+    def __init__(self, config: MemoryCacheConfig) -> None:
+        self.config = config
+
+        # key -> (value, size, expiration time)
+        self._entries: "OrderedDict[str, Tuple[bytes, int, float]]" = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, size, expires_at = entry
+
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+
+        if key in self._entries:
+            self._remove(key)
+
+        if size > self.config.max_entry_bytes:
+            return
+
+        ttl = min(ttl or self.config.ttl, self.config.ttl)
+        self._entries[key] = (value, size, time.monotonic() + ttl)
+        self.size += size
+
+        while self.size > self.config.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+
+class TieredCache:
+    """
+    Cache with an in-process `MemoryCache` in front of the (optional) `RedisCache`.
+    Values found in Redis are kept in memory for the next lookups.
+
+    The annotations of single items (`items=True`) are only cached in the
+    tiers whose configuration has `item_cache` set.
+    """
+
+    def __init__(
+        self,
+        memory: Optional[MemoryCache],
+        redis: Optional[RedisCache],
+        statsd_client: Optional[StatsClient] = None,
+    ) -> None:
+        self.memory = memory
+        self.redis = redis
+        self._statsd = statsd_client
+
+        # Lookups per tier ("memory", "redis") since the start, for the metrics
+        self.hits: Dict[str, int] = {"memory": 0, "redis": 0}
+        self.misses: Dict[str, int] = {"memory": 0, "redis": 0}
+
+        self._item_memory = memory is not None and memory.config.item_cache
+        self._item_redis = redis is not None and redis.config.item_cache
+        self.item_cache = self._item_memory or self._item_redis
+
+        if redis is not None:
+            self.ttl = redis.config.ttl
+        else:
+            self.ttl = memory.config.ttl
+
+        self.item_ttl = redis.config.item_ttl if self._item_redis else self.ttl
+
+    def _report(self, hits: int, misses: int):
+        if self._statsd is None or self.memory is None:
+            return
+
+        evictions, self.memory.evictions = self.memory.evictions, 0
+
+        with self._statsd.pipeline() as pip:
+            if hits:
+                pip.incr("cache.memory.hit.count", hits)
+            if misses:
+                pip.incr("cache.memory.miss.count", misses)
+            if evictions:
+                pip.incr("cache.memory.eviction.count", evictions)
+            pip.gauge("cache.memory.bytes", self.memory.size)
+            pip.gauge("cache.memory.entries", len(self.memory))
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return (await self.get_many([key]))[0]
+
+    async def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        await self.set_many({key: value}, ttl=ttl or self.ttl)
+
+    def _tiers(self, items: bool) -> Tuple[Optional[MemoryCache], Optional[RedisCache]]:
+        if not items:
+            return self.memory, self.redis
+
+        return self.memory if self._item_memory else None, self.redis if self._item_redis else None
+
+    async def get_many(self, keys: List[str], items: bool = False) -> List[Optional[bytes]]:
+        values: List[Optional[bytes]] = [None for _ in keys]
+        memory, redis = self._tiers(items)
+
+        if memory is not None:
+            for index, key in enumerate(keys):
+                values[index] = memory.get(key)
+
+        misses = [index for index, value in enumerate(values) if value is None]
+
+        if memory is not None:
+            self._report(len(keys) - len(misses), len(misses))
+            self.hits["memory"] += len(keys) - len(misses)
+            self.misses["memory"] += len(misses)
+
+        if misses and redis is not None:
+            found = await redis.get_many([keys[index] for index in misses])
+
+            for index, value in zip(misses, found):
+                if value is None:
+                    self.misses["redis"] += 1
+                    continue
+
+                self.hits["redis"] += 1
+
+                values[index] = value
+                if memory is not None:
+                    memory.set(keys[index], value)
+
+        return values
+
+    async def set_many(self, values: Dict[str, bytes], ttl: Optional[int] = None, items: bool = False):
+        memory, redis = self._tiers(items)
+
+        if memory is not None:
+            for key, value in values.items():
+                memory.set(key, value, ttl=ttl)
+
+        if redis is not None:
+            await redis.set_many(values, ttl=ttl)
+
+
+def tiered_cache_factory(config: Config):
+    # Must run after the statsd client and the Redis cache are set up.
+    async def tiered_cache(app_instance):
+        redis: Optional[RedisCache] = app_instance.get("redis_cache")
+        memory = None
+
+        if config.memory_cache is not None and config.memory_cache.max_bytes > 0:
+            _log.info("Adding in-process cache of %r bytes", config.memory_cache.max_bytes)
+            memory = MemoryCache(config.memory_cache)
+
+        if memory is None and redis is None:
+            _log.info("No cache set")
+            app_instance["cache"] = None
+        else:
+            app_instance["cache"] = TieredCache(memory, redis, app_instance.get("statsd_client"))
+
+        yield
+
+    return tiered_cache
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import pathlib
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import web
+from aiohttp.web_exceptions import HTTPException
+
+from nlp_annotator_api.annotators.AnnotatorRegistry import AnnotatorRegistry
+from nlp_annotator_api.config.config import Config
+from nlp_annotator_api.server.middleware.memory_cache import TieredCache
+from nlp_annotator_api.server.middleware.scheduler import DeadlineScheduler
+from nlp_annotator_api.utils.metrics import Counter, Gauge, Metric, MetricsRegistry, read_snapshot, write_snapshot
+
+_log = logging.getLogger(__name__)
+
+
+class ServerMetrics:
+    """
+    The metrics updated while handling the requests. The others are read from
+    the schedulers, the cache and the annotators when collected.
+    """
+
+    def __init__(self, registry: MetricsRegistry) -> None:
+        self.registry = registry
+
+        self.requests = registry.counter(
+            "nlp_api_http_requests_total", "HTTP requests, by route and status", ("route", "method", "status")
+        )
+        self.request_duration = registry.histogram(
+            "nlp_api_http_request_duration_seconds", "Duration of the HTTP requests, by route", ("route", "method")
+        )
+        self.in_flight = registry.gauge("nlp_api_http_requests_in_flight", "HTTP requests being handled")
+        self.in_flight.set(0)
+
+        self.annotation_duration = registry.histogram(
+            "nlp_api_annotation_duration_seconds",
+            "Duration of the annotation requests, by operation and annotator",
+            ("operation", "annotator"),
+        )
+        self.stage_duration = registry.histogram(
+            "nlp_api_annotation_stage_duration_seconds",
+            "Duration of the stages of the annotation requests (parse, cache, queue, inference, serialize, ...)",
+            ("operation", "annotator", "stage"),
+        )
+        self.counts = {
+            name: registry.counter(
+                f"nlp_api_annotated_{name}_total", f"Annotated {name}, by operation and annotator", ("operation", "annotator")
+            )
+            for name in ("items", "chars")
+        }
+
+
+def _scheduler_metrics(schedulers: Dict[str, DeadlineScheduler]) -> List[Metric]:
+    queue_depth = Gauge("nlp_api_scheduler_queue_depth", "Annotations waiting for a worker, by executor", ("executor",))
+    running = Gauge(
+        "nlp_api_scheduler_running", "Annotations running, by executor and annotator", ("executor", "annotator")
+    )
+    workers = Gauge("nlp_api_executor_workers", "Workers of the executors", ("executor",))
+    utilization = Gauge("nlp_api_executor_utilization", "Fraction of the workers of the executors in use", ("executor",))
+
+    for executor, scheduler in schedulers.items():
+        queue_depth.set(scheduler.queue_depth, executor=executor)
+        workers.set(scheduler.capacity, executor=executor)
+        utilization.set(scheduler.running / scheduler.capacity, executor=executor)
+
+        for annotator, count in scheduler.running_by_annotator().items():
+            running.set(count, executor=executor, annotator=annotator)
+
+    return [queue_depth, running, workers, utilization]
+
+
+def _cache_metrics(cache: TieredCache) -> List[Metric]:
+    lookups = Counter("nlp_api_cache_lookups_total", "Cache lookups, by tier and result", ("tier", "result"))
+    hit_ratio = Gauge("nlp_api_cache_hit_ratio", "Fraction of the cache lookups found, by tier", ("tier",))
+    metrics: List[Metric] = [lookups, hit_ratio]
+
+    for tier, present in (("memory", cache.memory is not None), ("redis", cache.redis is not None)):
+        if not present:
+            continue
+
+        hits, misses = cache.hits[tier], cache.misses[tier]
+        lookups.inc(hits, tier=tier, result="hit")
+        lookups.inc(misses, tier=tier, result="miss")
+        hit_ratio.set(hits / (hits + misses) if hits + misses else 0.0, tier=tier)
+
+    if cache.memory is not None:
+        size = Gauge("nlp_api_cache_memory_bytes", "Size of the in-process cache")
+        size.set(cache.memory.size)
+        entries = Gauge("nlp_api_cache_memory_entries", "Entries of the in-process cache")
+        entries.set(len(cache.memory))
+        metrics += [size, entries]
+
+    return metrics
+
+
+def _annotator_metrics(annotators: AnnotatorRegistry) -> List[Metric]:
+    ## Annotators loaded in this process: preloaded (and then shared by forked workers), or run inline or in threads
+    loaded = Gauge("nlp_api_annotator_loaded", "1 if the annotator is loaded", ("annotator",))
+    load_seconds = Gauge("nlp_api_annotator_load_seconds", "Time taken to load the annotator", ("annotator",))
+    size = Gauge("nlp_api_annotator_memory_bytes", "Resident memory taken by loading the annotator", ("annotator",))
+
+    loaded_names = set(annotators.loaded())
+    for name in annotators:
+        loaded.set(int(name in loaded_names), annotator=name)
+
+    for name, seconds in annotators.load_seconds.items():
+        load_seconds.set(seconds, annotator=name)
+
+    for name, bytes_ in annotators.sizes.items():
+        size.set(bytes_, annotator=name)
+
+    return [loaded, load_seconds, size]
+
+
+def route_template(request: web.Request) -> str:
+    ## The route template, e.g. "/api/v1/annotators/{annotator}": paths can't be used as labels,
+    ## they are unbounded.
+    resource = request.match_info.route.resource
+
+    return resource.canonical if resource is not None else "unmatched"
+
+
+@web.middleware
+class MetricsMiddleware:
+    async def __call__(self, request: web.Request, handler):
+        metrics: Optional[ServerMetrics] = request.config_dict.get("metrics")
+
+        if metrics is None:
+            return await handler(request)
+
+        start = time.perf_counter()
+        status = 500
+        metrics.in_flight.inc()
+
+        try:
+            response = await handler(request)
+            status = response.status
+
+            return response
+        except HTTPException as http_err:
+            status = http_err.status_code
+            raise
+        finally:
+            metrics.in_flight.dec()
+
+            route, method = route_template(request), request.method
+            metrics.requests.inc(route=route, method=method, status=status)
+            metrics.request_duration.observe(time.perf_counter() - start, route=route, method=method)
+
+            timings = request.get("timings")
+
+            if timings is not None and timings.annotator is not None:
+                labels = dict(operation=timings.operation, annotator=timings.annotator)
+
+                metrics.annotation_duration.observe(timings.elapsed(), **labels)
+
+                for stage, seconds in timings.stages.items():
+                    metrics.stage_duration.observe(seconds, stage=stage, **labels)
+
+                for name, count in timings.counts.items():
+                    if name in metrics.counts:
+                        metrics.counts[name].inc(count, **labels)
+
+
+def _write_snapshot(registry: MetricsRegistry, path: pathlib.Path):
+    try:
+        write_snapshot(registry.collect(), path)
+    except OSError as exc:
+        _log.warning("Could not write the metrics to %s: %s", path, exc)
+
+
+async def _write_snapshots(registry: MetricsRegistry, path: pathlib.Path, interval: float):
+    while True:
+        _write_snapshot(registry, path)
+
+        await asyncio.sleep(interval)
+
+
+def metrics_factory(config: Config, annotators: AnnotatorRegistry):
+    # Must run after the schedulers and the cache are set up.
+    async def metrics(app_instance):
+        if not config.metrics.enabled:
+            app_instance["metrics"] = None
+            yield
+            return
+
+        registry = MetricsRegistry()
+        server_metrics = ServerMetrics(registry)
+
+        registry.add_collector(lambda: _scheduler_metrics(app_instance.get("schedulers") or {}))
+        registry.add_collector(
+            lambda: _cache_metrics(app_instance["cache"]) if app_instance.get("cache") is not None else []
+        )
+        registry.add_collector(lambda: _annotator_metrics(annotators))
+
+        app_instance["metrics"] = server_metrics
+
+        snapshots = None
+        if config.metrics.multiprocess_dir:
+            ## Read by the other server processes, to expose the metrics of all
+            path = pathlib.Path(config.metrics.multiprocess_dir) / f"worker-{app_instance.get('worker_id', 0)}.json"
+            app_instance["metrics_snapshot"] = path
+
+            ## A restarted worker takes the id, and so the snapshot, of the one it replaces: it carries on
+            ## from its counters. (The directory is emptied when the server starts.)
+            previous = read_snapshot(path)
+            if previous is not None:
+                registry.restore(previous)
+
+            snapshots = asyncio.ensure_future(_write_snapshots(registry, path, config.metrics.snapshot_seconds))
+
+        yield
+
+        if snapshots is not None:
+            snapshots.cancel()
+            ## Kept, with the last values, for the worker restarted in place of this one
+            _write_snapshot(registry, app_instance["metrics_snapshot"])
+
+    return metrics
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from nlp_annotator_api.config.config import Config, MicroBatchConfig
+from nlp_annotator_api.server.middleware.scheduler import DeadlineExceeded, DeadlineUnreachable, Overloaded
+from nlp_annotator_api.server.signals.process_pool import WorkersLost
+
+_log = logging.getLogger(__name__)
+
+# Annotates a list of items before an (optional) deadline, returns one result per item.
+# Also given the contexts of the requests in the batch (see `MicroBatcher.submit`).
+RunBatch = Callable[[list, Optional[float], list], Awaitable[list]]
+
+
+class _Part:
+    def __init__(self, items: list, deadline: Optional[float], context: Any) -> None:
+        self.items = items
+        self.deadline = deadline
+        self.context = context
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class _PendingBatch:
+    def __init__(self, run: RunBatch, parts: Optional[List[_Part]] = None) -> None:
+        self.run = run
+        self.parts: List[_Part] = parts or []
+        self.size = sum(len(part.items) for part in self.parts)
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher:
+    """
+    Gathers the items of concurrent requests with the same key for up to
+    `max_wait_ms`, or until `max_items` are pending, annotates them as one
+    batch and scatters the results back to every request.
+
+    A batch is run by the `run` of the request which started it, given the
+    `context` of every request in it, e.g. to record the batch's timings in
+    each of them.
+    """
+
+    def __init__(self, configs: Dict[str, MicroBatchConfig]) -> None:
+        self.configs = configs
+        self._pending: Dict[Hashable, _PendingBatch] = {}
+        self._tasks = set()
+
+    def enabled(self, annotator: str) -> bool:
+        return annotator in self.configs
+
+    async def submit(
+        self,
+        annotator: str,
+        key: Hashable,
+        items: list,
+        deadline: Optional[float],
+        run: RunBatch,
+        context: Any = None,
+    ) -> list:
+        config = self.configs[annotator]
+
+        if len(items) >= config.max_items:
+            # Already a full batch on its own
+            return await run(items, deadline, [context])
+
+        batch = self._pending.get(key)
+
+        if batch is None:
+            batch = self._pending[key] = _PendingBatch(run)
+            batch.timer = asyncio.get_running_loop().call_later(
+                config.max_wait_ms / 1000, self._flush, key, batch
+            )
+
+        part = _Part(items, deadline, context)
+        batch.parts.append(part)
+        batch.size += len(items)
+
+        if batch.size >= config.max_items:
+            self._flush(key, batch)
+
+        # Shielded, so that a caller going away does not cancel the others.
+        return await asyncio.shield(part.future)
+
+    def _flush(self, key: Hashable, batch: _PendingBatch):
+        if self._pending.get(key) is not batch:
+            return
+
+        del self._pending[key]
+        batch.timer.cancel()
+
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: _PendingBatch):
+        parts = batch.parts
+        deadlines = [part.deadline for part in parts if part.deadline is not None]
+        deadline = min(deadlines) if deadlines else None
+
+        try:
+            results = await batch.run(
+                [item for part in parts for item in part.items],
+                deadline,
+                [part.context for part in parts],
+            )
+        except Exception as exc:
+            if len(parts) == 1:
+                _set_exception(parts[0], exc)
+                return
+
+            if isinstance(exc, (DeadlineExceeded, DeadlineUnreachable)):
+                # The batch was bound to the earliest deadline: the requests with a later one are annotated again.
+                late = [part for part in parts if part.deadline is not None and part.deadline <= deadline]
+                others = [part for part in parts if part not in late]
+
+                for part in late or parts:
+                    _set_exception(part, exc)
+
+                if late and others:
+                    await self._run(_PendingBatch(batch.run, others))
+                return
+
+            if isinstance(exc, (Overloaded, WorkersLost)):
+                # Not due to any of the requests, retrying them one by one would only add to the load.
+                for part in parts:
+                    _set_exception(part, exc)
+                return
+
+            # Don't let one faulty request (e.g. invalid input) fail the others.
+            _log.info("Batch of %r requests failed, annotating them one by one", len(parts))
+            await asyncio.gather(*[self._run_part(batch.run, part) for part in parts])
+            return
+
+        if not isinstance(results, list) or len(results) != batch.size:
+            _log.info("Batch results are not aligned with the items, annotating the requests one by one")
+            await asyncio.gather(*[self._run_part(batch.run, part) for part in parts])
+            return
+
+        _log.debug("Annotated a batch of %r items from %r requests", batch.size, len(parts))
+
+        start = 0
+        for part in parts:
+            _set_result(part, results[start:start + len(part.items)])
+            start += len(part.items)
+
+    @staticmethod
+    async def _run_part(run: RunBatch, part: _Part):
+        try:
+            _set_result(part, await run(part.items, part.deadline, [part.context]))
+        except Exception as exc:
+            _set_exception(part, exc)
+
+
+def _set_result(part: _Part, result: list):
+    if not part.future.done():
+        part.future.set_result(result)
+
+
+def _set_exception(part: _Part, exc: Exception):
+    if not part.future.done():
+        part.future.set_exception(exc)
+
+
+def micro_batcher_factory(config: Config):
+    async def micro_batcher(app_instance):
+        app_instance["micro_batcher"] = MicroBatcher(config.nlp.micro_batching)
+
+        yield
+
+    return micro_batcher
@@ -1,16 +1,22 @@
 import logging
-from typing import Optional
+from typing import Dict, List, Optional
 from nlp_annotator_api.config.config import Config, RedisCacheConfig
+from nlp_annotator_api.utils import compression
 from redis import asyncio as aioredis
 
 _log = logging.getLogger(__name__)
 
+# First byte of the compressed values, which can't start a JSON document
+_MARKERS = {compression.GZIP: b"\x01", compression.ZSTD: b"\x02"}
+_CODINGS = {marker: coding for coding, marker in _MARKERS.items()}
+
 
 class RedisCache:
     _redis: aioredis.Redis
 
     def __init__(self, config: RedisCacheConfig) -> None:
         self.config = config
+        self._coding = compression.available_codings()[0]
 
     def _format_key(self, key: str) -> str:
         if not self.config.prefix:
@@ -18,13 +24,49 @@ class RedisCache:
 
         return f"{self.config.prefix}.{key}"
 
-    async def set(self, key: str, value: str):
-        await self._redis.set(self._format_key(key), value, ex=self.config.ttl)
+    async def _encode(self, value: bytes) -> bytes:
+        if self.config.compress_min_bytes is None or len(value) < self.config.compress_min_bytes:
+            return value
+
+        return _MARKERS[self._coding] + await compression.offload(compression.compress, value, self._coding)
+
+    async def _decode(self, value: Optional[bytes]) -> Optional[bytes]:
+        coding = _CODINGS.get(value[:1]) if value else None
+        if coding is None:
+            return value
 
-    async def get(self, key: str) -> Optional[str]:
+        try:
+            return await compression.offload(compression.decompress, value[1:], coding)
+        except ValueError as exc:
+            ## E.g. written by an instance with zstd, which this one lacks: a miss
+            _log.warning("Can't decompress cached value: %s", exc)
+            return None
+
+    async def set(self, key: str, value: bytes):
+        await self._redis.set(self._format_key(key), await self._encode(value), ex=self.config.ttl)
+
+    async def get(self, key: str) -> Optional[bytes]:
         value = await self._redis.get(self._format_key(key))
 
-        return value
+        return await self._decode(value)
+
+    async def set_many(self, values: Dict[str, bytes], ttl: Optional[int] = None):
+        if not values:
+            return
+
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key, value in values.items():
+                pipe.set(self._format_key(key), await self._encode(value), ex=ttl or self.config.ttl)
+
+            await pipe.execute()
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        if not keys:
+            return []
+
+        values = await self._redis.mget([self._format_key(key) for key in keys])
+
+        return [await self._decode(value) for value in values]
 
     async def __aenter__(self):
         self._redis = aioredis.from_url(self.config.url)
@@ -0,0 +1,93 @@
+import contextlib
+import time
+from typing import Dict, Iterator, Optional
+
+from aiohttp import web
+
+
+class RequestTimings:
+    """
+    Durations of the stages of a request (parsing, cache lookups, queue wait,
+    inference, serialization, ...) and counts of the work in it (items, chars).
+
+    Stages measured several times in a request (e.g. the inference of the
+    slices of a micro-batch) add up. They may overlap: the queue wait and the
+    inference are part of the annotation.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        ## Seconds per stage, in the order they were first measured
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        ## Set by the handler for the stages to be reported, e.g. "find_entities", "SimpleTextGeographyAnnotator"
+        self.operation: Optional[str] = None
+        self.annotator: Optional[str] = None
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + max(seconds, 0.0)
+
+    @contextlib.contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def server_timing(self, total: float) -> str:
+        ## Value of the Server-Timing header, durations in milliseconds
+        metrics = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in self.stages.items()]
+        metrics.append(f"total;dur={total * 1000:.2f}")
+        metrics.extend(f'{name};desc="{count}"' for name, count in self.counts.items())
+
+        return ", ".join(metrics)
+
+
+def get_request_timings(request: web.Request) -> RequestTimings:
+    ## Without the middleware (e.g. in tests) the timings are measured, then dropped
+    timings = request.get("timings")
+
+    return timings if timings is not None else RequestTimings()
+
+
+@web.middleware
+class TimingMiddleware:
+    """
+    Gives every request its `RequestTimings`, filled by the handlers. Emits
+    them to statsd as timers (histograms, with the statsd servers computing
+    the percentiles) and, if enabled, in the Server-Timing response header.
+    """
+
+    def __init__(self, server_timing: bool = False) -> None:
+        self.server_timing = server_timing
+
+    async def __call__(self, request: web.Request, handler):
+        timings = request["timings"] = RequestTimings()
+
+        response = await handler(request)
+
+        total = timings.elapsed()
+
+        if timings.annotator is not None:
+            client = request.config_dict['statsd_client']
+            prefix = f"run_nlp_annotator.{timings.operation}.{timings.annotator}"
+
+            with client.pipeline() as pip:
+                for stage, seconds in timings.stages.items():
+                    pip.timing(f"{prefix}.stage.{stage}.time", seconds * 1000)
+
+                pip.timing(f"{prefix}.stage.total.time", total * 1000)
+
+                for name, count in timings.counts.items():
+                    pip.timing(f"{prefix}.{name}", count)
+                    pip.incr(f"{prefix}.{name}.count", count)
+
+        ## Streamed responses have sent their headers already.
+        if self.server_timing and not response.prepared:
+            response.headers["Server-Timing"] = timings.server_timing(total)
+
+        return response
@@ -0,0 +1,288 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from connexion.exceptions import ProblemException
+
+from nlp_annotator_api.config.config import Config, NlpConfig
+
+_log = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(ProblemException):
+    def __init__(self, detail="The deadline of the request has passed."):
+        super().__init__(status=504, title="Gateway Timeout", detail=detail)
+
+
+class DeadlineUnreachable(ProblemException):
+    def __init__(self, detail="The deadline of the request cannot be met."):
+        super().__init__(status=503, title="Service Unavailable", detail=detail)
+
+
+class Overloaded(ProblemException):
+    def __init__(self, retry_after: int = 1):
+        super().__init__(
+            status=503,
+            title="Service Unavailable",
+            detail="Too many annotations are queued, retry later.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class Throughput:
+    """
+    Exponentially weighted estimate of the seconds needed per unit of work
+    (characters of the input) for one annotator.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.seconds_per_unit = 0.0
+        self.samples = 0
+
+    def update(self, units: int, elapsed: float):
+        units = max(units, 1)
+
+        if self.samples == 0:
+            self.seconds_per_unit = elapsed / units
+        else:
+            self.seconds_per_unit += self.alpha * (elapsed / units - self.seconds_per_unit)
+
+        self.samples += 1
+
+    def estimate(self, units: int) -> float:
+        return self.seconds_per_unit * max(units, 1)
+
+
+@dataclass(order=True)
+class _Job:
+    deadline: float
+    seq: int
+    annotator: str = field(compare=False)
+    estimate: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    cancelled: bool = field(default=False, compare=False)
+
+
+class DeadlineScheduler:
+    """
+    Schedules the work sent to an executor with `capacity` workers.
+
+    Queued work is started by earliest deadline first, within the concurrency
+    limit of its annotator. Work whose deadline can't be met given the measured
+    throughput of its annotator is rejected upfront, queued work fails when its
+    deadline passes, and running work is abandoned once its deadline passes. The
+    worker of abandoned work is only counted as free once the work has ended.
+
+    The queue is bounded: once it is full, new work is rejected right away with
+    a `Retry-After` estimated from the queue depth and the measured service time.
+    """
+
+    def __init__(self, capacity: int, config: NlpConfig):
+        self.capacity = max(1, capacity)
+        self.config = config
+
+        self.running = 0
+        self._running_by_annotator: Dict[str, int] = {}
+        # Sum of the estimated durations of the running work
+        self._running_estimate = 0.0
+        self._queue: List[_Job] = []
+        self._seq = itertools.count()
+        self._throughput: Dict[str, Throughput] = {}
+        # Exponentially weighted duration of a unit of work, whatever its size
+        self._service_time: Optional[float] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for job in self._queue if not job.cancelled)
+
+    def running_by_annotator(self) -> Dict[str, int]:
+        return {annotator: count for annotator, count in self._running_by_annotator.items() if count}
+
+    def throughput(self, annotator: str) -> Throughput:
+        return self._throughput.setdefault(annotator, Throughput())
+
+    def annotator_limit(self, annotator: str) -> int:
+        return min(self.config.annotator_concurrency.get(annotator, self.capacity), self.capacity)
+
+    def estimate(self, annotator: str, units: int) -> Optional[float]:
+        throughput = self.throughput(annotator)
+
+        if throughput.samples < self.config.min_throughput_samples:
+            return None
+
+        return throughput.estimate(units)
+
+    def expected_wait(self, deadline: float) -> float:
+        # Work queued with an earlier deadline runs before, spread over the workers.
+        ahead = sum(job.estimate for job in self._queue if not job.cancelled and job.deadline <= deadline)
+
+        if self.running >= self.capacity:
+            ahead += self._running_estimate
+
+        return ahead / self.capacity
+
+    def retry_after(self) -> int:
+        # Seconds until the work ahead, queued and running, is expected to be done.
+        service_time = self._service_time if self._service_time is not None else 1.0
+
+        return max(1, math.ceil((self.queue_depth + self.running) * service_time / self.capacity))
+
+    def _admit(self, annotator: str):
+        if self.queue_depth < self.config.max_queue_size:
+            return
+
+        retry_after = self.retry_after()
+        _log.info("Queue full, rejecting %r (retry after %rs)", annotator, retry_after)
+
+        raise Overloaded(retry_after)
+
+    async def run(
+        self,
+        annotator: str,
+        units: int,
+        deadline: Optional[float],
+        compute: Callable[[], Awaitable],
+    ):
+        estimate = self.estimate(annotator, units)
+        job_deadline = deadline if deadline is not None else math.inf
+
+        if deadline is not None and estimate is not None:
+            expected_end = time.time() + self.expected_wait(job_deadline) + estimate
+
+            if expected_end > deadline:
+                _log.info(
+                    "Rejecting %r: expected to end %.2fs after the deadline", annotator, expected_end - deadline
+                )
+                raise DeadlineUnreachable()
+
+        await self._acquire(annotator, job_deadline, estimate or 0.0)
+        self._running_estimate += estimate or 0.0
+
+        try:
+            if deadline is not None and time.time() > deadline:
+                raise DeadlineExceeded()
+
+            start = time.monotonic()
+            task = asyncio.ensure_future(compute())
+        except BaseException:
+            self._finish(annotator, estimate or 0.0)
+            raise
+
+        # The slot is released once the work is done, not once its caller gives up on it:
+        # an executor can't stop a running call, the worker stays busy until then.
+        task.add_done_callback(functools.partial(self._done, annotator, estimate or 0.0))
+
+        if deadline is None:
+            result = await asyncio.shield(task)
+        else:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(task), timeout=deadline - time.time())
+            except asyncio.TimeoutError:
+                _log.info("Abandoning %r, its deadline has passed (its worker stays busy until it ends)", annotator)
+                raise DeadlineExceeded()
+
+        elapsed = time.monotonic() - start
+        self.throughput(annotator).update(units, elapsed)
+
+        if self._service_time is None:
+            self._service_time = elapsed
+        else:
+            self._service_time += 0.2 * (elapsed - self._service_time)
+
+        return result
+
+    def _done(self, annotator: str, estimate: float, task: asyncio.Future):
+        if not task.cancelled():
+            # Retrieved here, the caller may be gone
+            task.exception()
+
+        self._finish(annotator, estimate)
+
+    def _finish(self, annotator: str, estimate: float):
+        self._running_estimate -= estimate
+        self._release(annotator)
+
+    def _can_start(self, annotator: str) -> bool:
+        return (
+            self.running < self.capacity
+            and self._running_by_annotator.get(annotator, 0) < self.annotator_limit(annotator)
+        )
+
+    def _start(self, annotator: str):
+        self.running += 1
+        self._running_by_annotator[annotator] = self._running_by_annotator.get(annotator, 0) + 1
+
+    async def _acquire(self, annotator: str, deadline: float, estimate: float):
+        # Queued work is started as soon as it can be, so if this annotator
+        # has a free slot, nothing queued is allowed to go before.
+        if self._can_start(annotator):
+            self._start(annotator)
+            return
+
+        self._admit(annotator)
+
+        job = _Job(deadline, next(self._seq), annotator, estimate, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, job)
+
+        try:
+            if math.isinf(deadline):
+                await job.future
+            else:
+                # Fails at its deadline, even if no slot is released until then
+                await asyncio.wait_for(asyncio.shield(job.future), timeout=deadline - time.time())
+        except (asyncio.CancelledError, asyncio.TimeoutError) as exc:
+            if job.future.done() and not job.future.cancelled() and job.future.exception() is None:
+                # The slot was granted just before the cancellation.
+                self._release(annotator)
+            job.cancelled = True
+
+            if isinstance(exc, asyncio.TimeoutError):
+                _log.info("Dropping queued work for %r, its deadline has passed", annotator)
+                raise DeadlineExceeded()
+            raise
+
+    def _release(self, annotator: str):
+        self.running -= 1
+        self._running_by_annotator[annotator] -= 1
+
+        blocked = []
+
+        while self._queue and self.running < self.capacity:
+            job = heapq.heappop(self._queue)
+
+            if job.cancelled:
+                continue
+
+            if job.deadline < time.time():
+                _log.info("Dropping queued work for %r, its deadline has passed", job.annotator)
+                job.future.set_exception(DeadlineExceeded())
+                continue
+
+            if not self._can_start(job.annotator):
+                blocked.append(job)
+                continue
+
+            self._start(job.annotator)
+            job.future.set_result(None)
+
+        for job in blocked:
+            heapq.heappush(self._queue, job)
+
+
+def scheduler_factory(config: Config):
+    async def scheduler(app_instance):
+        app_instance["schedulers"] = {
+            "process": DeadlineScheduler(config.nlp.num_workers, config.nlp),
+            "thread": DeadlineScheduler(config.nlp.num_threads, config.nlp),
+        }
+
+        yield
+
+    return scheduler
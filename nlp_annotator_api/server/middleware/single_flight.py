@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from nlp_annotator_api.server.middleware.scheduler import DeadlineExceeded, DeadlineUnreachable
+
+_log = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self, future: asyncio.Future, deadline: Optional[float]) -> None:
+        self.future = future
+        # Deadline of the caller which started the computation, which the computation is bound to
+        self.deadline = deadline
+
+
+def _compatible(flight_deadline: Optional[float], deadline: Optional[float]) -> bool:
+    ## Whether a computation bound to `flight_deadline` gives up no earlier than a caller with `deadline`
+    return flight_deadline is None or (deadline is not None and deadline <= flight_deadline)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent computations: while a computation registered under
+    some key is in flight, callers presenting any of its keys await its
+    result instead of starting their own.
+
+    A computation is bound to the deadline of the caller which started it.
+    The callers joining it still fail at their own deadline, and compute on
+    their own if it failed on its deadline while theirs is later.
+    """
+
+    def __init__(self) -> None:
+        self._in_flight: Dict[str, _Flight] = {}
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    async def run(
+        self, keys: List[str], compute: Callable[[], Awaitable], deadline: Optional[float] = None
+    ) -> Tuple[object, bool]:
+        ## Output: the result, and whether it was shared with an in-flight computation
+        while True:
+            key, flight = next(((key, self._in_flight[key]) for key in keys if key in self._in_flight), (None, None))
+
+            if flight is None:
+                break
+
+            _log.info("Joining in-flight computation for key=%r", key)
+
+            try:
+                return await _wait(flight.future, deadline), True
+            except (DeadlineExceeded, DeadlineUnreachable):
+                if _compatible(flight.deadline, deadline) or (deadline is not None and time.time() >= deadline):
+                    raise
+
+                # Done, and forgotten: computed again, unless another caller did already
+                _log.info("In-flight computation for key=%r missed its deadline, computing again", key)
+
+        future = asyncio.ensure_future(compute())
+        flight = _Flight(future, deadline)
+
+        for key in keys:
+            self._in_flight[key] = flight
+
+        def _forget(_):
+            for key in keys:
+                if self._in_flight.get(key) is flight:
+                    del self._in_flight[key]
+
+        future.add_done_callback(_forget)
+
+        return await _wait(future, deadline), False
+
+
+async def _wait(future: asyncio.Future, deadline: Optional[float]):
+    # Shielded, so that a caller going away does not cancel the others.
+    if deadline is None:
+        return await asyncio.shield(future)
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), timeout=deadline - time.time())
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
+
+
+def single_flight_factory():
+    async def single_flight(app_instance):
+        app_instance["single_flight"] = SingleFlight()
+
+        yield
+
+    return single_flight
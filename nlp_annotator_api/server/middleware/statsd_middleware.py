@@ -1,29 +1,45 @@
+import re
+
 from aiohttp import web
 from aiohttp.web_exceptions import HTTPError
 
+from nlp_annotator_api.server.middleware.metrics_middleware import route_template
+
+_invalid_characters = re.compile(r"[^A-Za-z0-9_-]+")
+
+
+def _route_name(request: web.Request) -> str:
+    # The route, not the path: a metric per annotator requested (or per URL
+    # tried by a scanner) would make the number of metrics unbounded.
+    # E.g. "/api/v1/annotators/{annotator}" -> "api.v1.annotators.annotator"
+    return ".".join(
+        _invalid_characters.sub("_", part).strip("_") or "_" for part in route_template(request).strip("/").split("/")
+    )
+
 
 @web.middleware
 class StatsdMiddleware:
     async def __call__(self, request: web.Request, handler):
         client = request.config_dict['statsd_client']
+        route = _route_name(request)
 
         with client.pipeline() as pip, \
                 pip.timer(f"request.time"),\
-                pip.timer(f"request.{request.path}.time"):
+                pip.timer(f"request.{route}.time"):
             try:
-                pip.incr(f"request.{request.path}.count")
+                pip.incr(f"request.{route}.count")
 
                 response = await handler(request)
 
-                pip.incr(f"request.status.{request.path}.{response.status}.count")
+                pip.incr(f"request.status.{route}.{response.status}.count")
                 pip.incr(f"request.status.{response.status}.count")
 
                 return response
             except HTTPError as http_err:
-                pip.incr(f"request.status.{request.path}.{http_err.status_code}.count")
+                pip.incr(f"request.status.{route}.{http_err.status_code}.count")
                 pip.incr(f"request.status.{http_err.status_code}.count")
                 raise http_err
             except Exception as e:
-                pip.incr(f"request.failed.{request.path}.{type(e).__name__}.count")
+                pip.incr(f"request.failed.{route}.{type(e).__name__}.count")
                 pip.incr(f"request.failed.{type(e).__name__}.count")
                 raise e
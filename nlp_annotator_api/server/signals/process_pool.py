@@ -1,17 +1,135 @@
+import asyncio
+import functools
+import gc
 import logging
-from concurrent.futures.process import ProcessPoolExecutor
+import multiprocessing
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool, ProcessPoolExecutor
+from typing import Callable, Optional
+
+from connexion.exceptions import ProblemException
+
+from nlp_annotator_api.utils.profiler import WorkerProfiling
 
 logger = logging.getLogger(__name__)
 
 
-def process_pool_factory(num_workers: int):
+def create_process_pool(
+    num_workers: int,
+    initializer: Optional[Callable[[], None]] = None,
+    start_method: Optional[str] = None,
+) -> ProcessPoolExecutor:
+    mp_context = multiprocessing.get_context(start_method) if start_method else None
+
+    if start_method == "fork":
+        # The workers share the memory of this process copy-on-write, e.g. the
+        # preloaded models. Freezing the objects allocated so far keeps the
+        # collector from touching them, and so from copying their pages.
+        gc.collect()
+        gc.freeze()
+        logger.debug("Froze %r objects before forking the workers", gc.get_freeze_count())
+
+    pool = ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context, initializer=initializer)
+
+    # Start the workers right away rather than on the first request,
+    # before this process allocates anything else.
+    wait([pool.submit(gc.get_freeze_count) for _ in range(num_workers)])
+
+    return pool
+
+
+class WorkersLost(ProblemException):
+    def __init__(self, retry_after: int = 1):
+        super().__init__(
+            status=503,
+            title="Service Unavailable",
+            detail="The annotation workers were lost, retry later.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class RestartingProcessPool:
+    """
+    Process pool which replaces its executor when it breaks: once one of its
+    workers died (e.g. killed for its memory use), a ProcessPoolExecutor fails
+    every call, for good.
+
+    A call which failed on a broken pool is retried once in the new one. If
+    it fails again (e.g. it is what kills the workers) it fails with
+    `WorkersLost`. `broken` is set while the pool is being replaced, or if it
+    could not be.
+    """
+
+    def __init__(self, create: Callable[[], ProcessPoolExecutor]) -> None:
+        self._create = create
+        self.executor = create()
+        self.broken = False
+        self.restarts = 0
+        self._lock = asyncio.Lock()
+
+    async def run(self, func: Callable, *args):
+        ## `func(*args)` in a worker
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(2):
+            executor = self.executor
+            try:
+                return await loop.run_in_executor(executor, func, *args)
+            except BrokenProcessPool:
+                logger.warning("Process pool broken, a worker died (attempt %r)", attempt + 1)
+                await self._replace(executor)
+
+        raise WorkersLost()
+
+    async def _replace(self, broken: ProcessPoolExecutor):
+        async with self._lock:
+            if self.executor is not broken:
+                ## Replaced already, after a concurrent failure
+                return
+
+            self.broken = True
+            broken.shutdown(wait=False)
+
+            ## Starting the workers takes a while, the event loop goes on meanwhile.
+            self.executor = await asyncio.get_running_loop().run_in_executor(None, self._create)
+
+            self.broken = False
+            self.restarts += 1
+            logger.info("Process pool replaced (%r restarts)", self.restarts)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+def process_pool_factory(
+    num_workers: int,
+    initializer: Optional[Callable[[], None]] = None,
+    start_method: Optional[str] = None,
+):
+    # Must run after the warm-up, so that forked workers inherit the preloaded annotators.
+    # The workers can be profiled on demand, through `app_instance['worker_profiling']`.
     async def process_pool(app_instance):
+        if num_workers <= 0:
+            logger.debug("Process pool disabled")
+
+            app_instance['process_pool'] = None
+            app_instance['worker_profiling'] = None
+            yield
+            return
+
+        logger.debug("Setting up process pool with %r workers (%s)", num_workers, start_method or "default start method")
 
-        logger.debug("Setting up process pool with %r workers", num_workers)
+        profiling = WorkerProfiling(multiprocessing.get_context(start_method) if start_method else None)
 
-        pool = ProcessPoolExecutor(max_workers=num_workers)
+        pool = RestartingProcessPool(functools.partial(
+            create_process_pool,
+            num_workers,
+            initializer=functools.partial(profiling.initializer, initializer),
+            start_method=start_method,
+        ))
 
         app_instance['process_pool'] = pool
+        app_instance['worker_profiling'] = profiling
 
         yield
 
@@ -0,0 +1,25 @@
+import asyncio
+import logging
+
+from nlp_annotator_api.config.config import ProfilingConfig
+from nlp_annotator_api.utils.profiler import AnnotatorProfiles
+
+logger = logging.getLogger(__name__)
+
+
+def profiling_factory(config: ProfilingConfig):
+    async def profiling(app_instance):
+        # Only one profile is taken on demand at a time.
+        app_instance["profile_lock"] = asyncio.Lock()
+
+        profiles = AnnotatorProfiles(config)
+
+        if profiles.enabled():
+            logger.debug("Profiling %r of the annotations (overrides: %r)", config.sample_rate, config.annotator_sample_rates)
+            app_instance["annotator_profiles"] = profiles
+        else:
+            app_instance["annotator_profiles"] = None
+
+        yield
+
+    return profiling
@@ -1,18 +1,49 @@
+import asyncio
 import logging
 
 import statsd
 
+from nlp_annotator_api.config.config import StatsdAggregationConfig
+from nlp_annotator_api.utils.statsd_aggregator import AggregatingStatsClient
+
 logger = logging.getLogger(__name__)
 
 
-def statsd_client_factory(statsd_kwargs):
+def statsd_client_factory(statsd_kwargs, aggregation: StatsdAggregationConfig):
     async def statsd_client(app_instance):
         logger.debug("Adding statsd client")
 
-        client = statsd.StatsClient(**statsd_kwargs)
+        kwargs = dict(statsd_kwargs)
+
+        # Set by the launcher, to keep the metrics of its workers apart
+        worker_id = app_instance.get('worker_id')
+        if worker_id is not None:
+            kwargs['prefix'] = f"{kwargs.get('prefix') or ''}worker.{worker_id}."
+
+        if not aggregation.enabled:
+            app_instance['statsd_client'] = statsd.StatsClient(**kwargs)
+
+            yield
+            return
+
+        client = AggregatingStatsClient(
+            host=kwargs.get('host', 'localhost'),
+            port=kwargs.get('port', 8125),
+            prefix=kwargs.get('prefix'),
+            max_packet_bytes=kwargs.get('maxudpsize', aggregation.max_packet_bytes),
+            ipv6=kwargs.get('ipv6', False),
+            max_metrics=aggregation.max_metrics,
+            max_timer_samples=aggregation.max_timer_samples,
+        )
 
         app_instance['statsd_client'] = client
+        flusher = asyncio.ensure_future(client.run(aggregation.flush_interval_seconds))
 
         yield
 
+        # Flushes what is left
+        flusher.cancel()
+        await asyncio.gather(flusher, return_exceptions=True)
+        client.close()
+
     return statsd_client
@@ -0,0 +1,28 @@
+import logging
+from concurrent.futures.thread import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def thread_pool_factory(num_threads: int):
+    async def thread_pool(app_instance):
+        if num_threads <= 0:
+            logger.debug("Thread pool disabled")
+
+            app_instance['thread_pool'] = None
+            yield
+            return
+
+        logger.debug("Setting up thread pool with %r threads", num_threads)
+
+        pool = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="annotator")
+
+        app_instance['thread_pool'] = pool
+
+        yield
+
+        logger.debug("Shutting down thread pool")
+
+        pool.shutdown()
+
+    return thread_pool
@@ -0,0 +1,19 @@
+import logging
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up_factory(warm_up: Callable[[], None]):
+    # Must run before the pools: the process pool workers forked afterwards inherit the warm annotators.
+    async def warm_up_annotators(app_instance):
+        start = time.monotonic()
+
+        warm_up()
+
+        logger.debug("Annotators warmed up in %.2fs", time.monotonic() - start)
+
+        yield
+
+    return warm_up_annotators
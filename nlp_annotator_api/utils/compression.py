@@ -0,0 +1,122 @@
+import asyncio
+import functools
+import zlib
+from typing import Callable, List, Optional, TypeVar
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+## Content codings, in order of preference for the responses
+GZIP = "gzip"
+ZSTD = "zstd"
+
+# Larger inputs are (de)compressed in a thread by `offload`, not to block the event loop
+EXECUTOR_MIN_BYTES = 256 * 1024
+
+T = TypeVar("T")
+
+
+class DecompressionError(ValueError):
+    pass
+
+
+class TooLarge(DecompressionError):
+    pass
+
+
+def available_codings() -> List[str]:
+    return [ZSTD, GZIP] if zstandard is not None else [GZIP]
+
+
+def compress(data: bytes, coding: str, level: Optional[int] = None) -> bytes:
+    if coding == GZIP:
+        compressor = zlib.compressobj(level if level is not None else 6, wbits=31)
+        return compressor.compress(data) + compressor.flush()
+
+    if coding == ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor(level=level if level is not None else 3).compress(data)
+
+    raise ValueError(f"Unsupported content coding {coding!r}")
+
+
+class _GzipDecompressor:
+    def __init__(self) -> None:
+        ## Also accepts zlib streams
+        self._decompressor = zlib.decompressobj(wbits=47)
+
+    def decompress(self, data: bytes) -> bytes:
+        try:
+            return self._decompressor.decompress(data)
+        except zlib.error as exc:
+            raise DecompressionError(str(exc)) from exc
+
+
+class _ZstdDecompressor:
+    def __init__(self) -> None:
+        self._decompressor = zstandard.ZstdDecompressor().decompressobj(read_across_frames=True)
+
+    def decompress(self, data: bytes) -> bytes:
+        try:
+            return self._decompressor.decompress(data)
+        except zstandard.ZstdError as exc:
+            raise DecompressionError(str(exc)) from exc
+
+
+def decompressor(coding: str):
+    ## Incremental decompressor: `decompress(data)` returns the data decompressed so far
+    if coding == GZIP:
+        return _GzipDecompressor()
+
+    if coding == ZSTD and zstandard is not None:
+        return _ZstdDecompressor()
+
+    raise ValueError(f"Unsupported content coding {coding!r}")
+
+
+def decompress(data: bytes, coding: str, max_size: Optional[int] = None) -> bytes:
+    ## Raises `TooLarge` when the data decompresses to more than `max_size` bytes.
+    ## Fed in slices, so that a small input expanding a lot is stopped early.
+    unpacker = decompressor(coding)
+    chunks, size = [], 0
+
+    view = memoryview(data)
+    for start in range(0, len(view), 16 * 1024):
+        chunk = unpacker.decompress(view[start:start + 16 * 1024])
+        size += len(chunk)
+
+        if max_size is not None and size > max_size:
+            raise TooLarge(f"Decompressed data exceeds {max_size} bytes")
+
+        chunks.append(chunk)
+
+    return b"".join(chunks)
+
+
+async def offload(func: Callable[..., T], data: bytes, *args, **kwargs) -> T:
+    ## `func(data, ...)`, e.g. `compress` or `decompress`, in the default executor if `data` is large
+    if len(data) < EXECUTOR_MIN_BYTES:
+        return func(data, *args, **kwargs)
+
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, data, *args, **kwargs))
+
+
+def accepted_coding(accept_encoding: str, codings: List[str]) -> Optional[str]:
+    ## The first of `codings` accepted by the Accept-Encoding header, None if none is
+    accepted = set()
+
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+
+        if params.startswith("q=") and params[2:] in ("0", "0.0", "0.00", "0.000"):
+            continue
+
+        accepted.add(coding.strip())
+
+    for coding in codings:
+        if coding in accepted or "*" in accepted:
+            return coding
+
+    return None
@@ -0,0 +1,254 @@
+import bisect
+import json
+import math
+import os
+import pathlib
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+## Latency buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+## A metric family, as exposed: {"name", "type", "help", "samples": [[sample name, labels, value], ...]}
+Family = dict
+
+## Types of the metrics whose values only grow
+_CUMULATIVE_TYPES = ("counter", "histogram")
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+
+        ## Label values -> value
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} has the labels {self.label_names}, got {tuple(labels)}")
+
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.label_names, key))
+
+    def samples(self) -> List[list]:
+        return [[self.name, self._labels(key), value] for key, value in self._values.items()]
+
+    def collect(self) -> Family:
+        return {"name": self.name, "type": self.type, "help": self.help, "samples": self.samples()}
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+
+        if state is None:
+            ## Observations per bucket (not cumulative, the last one is +Inf), then the sum
+            state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def samples(self) -> List[list]:
+        samples = []
+
+        for key, state in self._values.items():
+            labels = self._labels(key)
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                samples.append([f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative])
+
+            samples.append([f"{self.name}_sum", labels, state[-1]])
+            samples.append([f"{self.name}_count", labels, cumulative])
+
+        return samples
+
+
+class MetricsRegistry:
+    """
+    In-process metrics, read by Prometheus at /metrics.
+
+    Updating them costs a dict lookup: nothing is sent per request. Values
+    which already exist elsewhere (queue depths, cache statistics, ...) are
+    read when the metrics are collected, by the collectors.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Metric]]] = []
+        self._restored: List[Family] = []
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name!r} is already registered")
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]) -> None:
+        ## `collector()` returns metrics built when collecting, not registered
+        self._collectors.append(collector)
+
+    def restore(self, families: List[Family]) -> None:
+        ## Carry on from the counters and histograms of `families`, e.g. the last snapshot of the process
+        ## this one replaces: their sums over the processes would drop otherwise, as for a reset.
+        self._restored = [family for family in families if family["type"] in _CUMULATIVE_TYPES]
+
+    def collect(self) -> List[Family]:
+        metrics = list(self._metrics.values())
+
+        for collector in self._collectors:
+            metrics.extend(collector())
+
+        families = [metric.collect() for metric in metrics]
+
+        if not self._restored:
+            return families
+
+        cumulative = [family for family in families if family["type"] in _CUMULATIVE_TYPES]
+        summed = {family["name"]: family for family in merge({"restored": self._restored, "current": cumulative})}
+        names = {family["name"] for family in families}
+
+        return [summed.get(family["name"], family) for family in families] + [
+            family for name, family in summed.items() if name not in names
+        ]
+
+
+def merge(families_by_process: Dict[str, List[Family]]) -> List[Family]:
+    ## Metrics of several processes: counters and histograms are summed, gauges are
+    ## kept apart with a "worker" label (summing e.g. ratios would make no sense).
+    merged: Dict[str, Family] = {}
+    values: Dict[str, Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]] = {}
+
+    for process, families in families_by_process.items():
+        for family in families:
+            name = family["name"]
+
+            if name not in merged:
+                merged[name] = {key: value for key, value in family.items() if key != "samples"}
+                values[name] = {}
+
+            for sample_name, labels, value in family["samples"]:
+                if family["type"] == "gauge":
+                    labels = {**labels, "worker": process}
+
+                key = (sample_name, tuple(sorted(labels.items())))
+                values[name][key] = values[name].get(key, 0) + value
+
+    for name, family in merged.items():
+        family["samples"] = [
+            [sample_name, dict(labels), value] for (sample_name, labels), value in values[name].items()
+        ]
+
+    return list(merged.values())
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+## Content type of `render`
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render(families: List[Family]) -> str:
+    ## Prometheus text exposition format
+    lines = []
+
+    for family in families:
+        lines.append(f"# HELP {family['name']} {_escape(family['help'])}")
+        lines.append(f"# TYPE {family['name']} {family['type']}")
+
+        for sample_name, labels, value in family["samples"]:
+            if labels:
+                label_text = ",".join(f'{name}="{_escape(str(label))}"' for name, label in labels.items())
+                lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{sample_name} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_snapshot(families: List[Family], path: pathlib.Path) -> None:
+    ## Atomically: the other processes may read it at any time
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(json.dumps(families), encoding="utf-8")
+    os.replace(temporary, path)
+
+
+def read_snapshot(path: pathlib.Path) -> Optional[List[Family]]:
+    ## Snapshot written by `write_snapshot`, None if there is none
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def read_snapshots(directory: pathlib.Path, exclude: Optional[pathlib.Path] = None) -> Dict[str, List[Family]]:
+    ## Snapshots written by `write_snapshot`, by file name without extension
+    snapshots = {}
+
+    for path in sorted(directory.glob("*.json")):
+        if exclude is not None and path == exclude:
+            continue
+
+        families = read_snapshot(path)
+        if families is not None:
+            snapshots[path.stem] = families
+
+    return snapshots
@@ -0,0 +1,243 @@
+import collections
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Callable, Collection, Counter, Dict, Optional
+
+from nlp_annotator_api.config.config import ProfilingConfig
+
+_log = logging.getLogger(__name__)
+
+## Innermost frames of threads waiting for work: the event loop, idle pool threads and workers, ...
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+    ("queues.py", "get"),
+    ("connection.py", "_recv"),
+    ("connection.py", "wait"),
+}
+
+## How often the workers check whether they are asked for a profile
+_AGENT_POLL_SECONDS = 0.1
+
+
+def _frame_name(code) -> str:
+    ## "function (package/module.py)", the line numbers would split the functions in flame graphs
+    path = code.co_filename.replace(os.sep, "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])})"
+
+
+def collapse_stack(frame) -> str:
+    ## Outermost frame first, as expected by flamegraph.pl and speedscope
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+
+    return ";".join(reversed(names))
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES
+
+
+def format_collapsed(counts: Counter[str]) -> str:
+    ## The "collapsed stacks" format: one "frame;frame;frame count" line per stack
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of the threads of this process every `interval`
+    seconds, from a thread of its own. The code profiled isn't instrumented, so
+    it runs at full speed, only slowed by the sampling (sharing the GIL).
+
+    The samples are counted by stack, prefixed with `label` and (unless
+    `thread_names` is False) the name of the thread.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.01,
+        thread_ids: Optional[Collection[int]] = None,
+        include_idle: bool = False,
+        label: Optional[str] = None,
+        thread_names: bool = True,
+    ) -> None:
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.include_idle = include_idle
+        self.label = label if label is not None else f"process-{os.getpid()}"
+        self.thread_names = thread_names
+
+        self.counts: Counter[str] = collections.Counter()
+        self.samples = 0
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sample(self) -> None:
+        own_id = threading.get_ident()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                continue
+
+            if not self.include_idle and _is_idle(frame):
+                continue
+
+            stack = collapse_stack(frame)
+            if self.thread_names:
+                stack = f"{thread_names.get(thread_id, thread_id)};{stack}"
+
+            self.counts[f"{self.label};{stack}"] += 1
+
+        self.samples += 1
+
+    def run(self, until: Optional[float] = None) -> Counter[str]:
+        ## Samples in this thread, until `stop()` is called or the `until` time (time.time()) has passed.
+        while not self._stop.wait(self.interval):
+            if until is not None and time.time() >= until:
+                break
+
+            self.sample()
+
+        return self.counts
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self) -> Counter[str]:
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        return self.counts
+
+
+class WorkerProfiling:
+    """
+    Profiles the workers of a process pool on demand.
+
+    Every worker runs an agent thread, started by the pool initializer, which
+    waits for a new profiling session, profiles its process until the session
+    ends, and sends its stacks back through a queue.
+    """
+
+    def __init__(self, mp_context=None) -> None:
+        mp_context = mp_context or multiprocessing.get_context()
+
+        self._session = mp_context.Value("i", 0)
+        self._until = mp_context.Value("d", 0.0)
+        self._interval = mp_context.Value("d", 0.01)
+        self._include_idle = mp_context.Value("b", 0)
+        self._results = mp_context.Queue()
+
+    def initializer(self, initializer: Optional[Callable[[], None]] = None) -> None:
+        ## Process pool initializer (with functools.partial), runs `initializer` too
+        threading.Thread(target=self._agent, name="profiling-agent", daemon=True).start()
+
+        if initializer is not None:
+            initializer()
+
+    def _agent(self) -> None:
+        session = self._session.value
+
+        while True:
+            time.sleep(_AGENT_POLL_SECONDS)
+
+            if self._session.value == session:
+                continue
+
+            with self._session.get_lock():
+                session = self._session.value
+                until, interval = self._until.value, self._interval.value
+                include_idle = bool(self._include_idle.value)
+
+            profiler = SamplingProfiler(interval, include_idle=include_idle, label=f"worker-{os.getpid()}")
+            counts = profiler.run(until)
+
+            self._results.put((session, dict(counts)))
+
+    def profile(self, seconds: float, interval: float, num_workers: int, include_idle: bool = False) -> Counter[str]:
+        ## Blocking: profiles the workers for `seconds`, and returns the stacks of those which answered in time
+        with self._session.get_lock():
+            self._until.value = time.time() + seconds
+            self._interval.value = interval
+            self._include_idle.value = int(include_idle)
+            self._session.value += 1
+            session = self._session.value
+
+        counts: Counter[str] = collections.Counter()
+        deadline = time.time() + seconds + _AGENT_POLL_SECONDS + 2.0
+        answers = 0
+
+        while answers < num_workers:
+            try:
+                result_session, result = self._results.get(timeout=max(deadline - time.time(), 0.01))
+            except queue.Empty:
+                _log.warning("Only %r of %r workers sent their profile", answers, num_workers)
+                break
+
+            ## Late answers of a previous session
+            if result_session != session:
+                continue
+
+            counts.update(result)
+            answers += 1
+
+        return counts
+
+
+class AnnotatorProfiles:
+    """
+    Always-on profiling of a fraction of the annotations, with the stacks
+    counted per annotator.
+    """
+
+    def __init__(self, config: ProfilingConfig) -> None:
+        self.config = config
+        self.counts: Dict[str, Counter[str]] = collections.defaultdict(collections.Counter)
+
+    def enabled(self) -> bool:
+        return self.config.sample_rate > 0 or any(rate > 0 for rate in self.config.annotator_sample_rates.values())
+
+    def sampled(self, annotator: str) -> bool:
+        rate = self.config.annotator_sample_rates.get(annotator, self.config.sample_rate)
+
+        return rate > 0 and random.random() < rate
+
+    def add(self, annotator: str, counts: Dict[str, int]) -> None:
+        annotator_counts = self.counts[annotator]
+
+        for stack, count in counts.items():
+            if stack not in annotator_counts and len(annotator_counts) >= self.config.max_stacks:
+                stack = "(other stacks)"
+
+            annotator_counts[stack] += count
+
+
+def profile_call(label: str, interval: float, function: Callable, *args):
+    ## Runs `function(*args)` in this thread, sampling it. Output: (result, collapsed stacks)
+    profiler = SamplingProfiler(
+        interval, thread_ids={threading.get_ident()}, include_idle=True, label=label, thread_names=False
+    ).start()
+
+    try:
+        result = function(*args)
+    finally:
+        counts = profiler.stop()
+
+    return result, dict(counts)
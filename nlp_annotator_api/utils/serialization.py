@@ -0,0 +1,64 @@
+import json
+import logging
+from typing import Any, Dict, Optional, Type, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+_log = logging.getLogger(__name__)
+
+
+class JsonSerializer:
+    """
+    Serializes the responses and the cached values, to UTF-8 encoded JSON.
+    This one is based on the standard library, see `OrjsonSerializer` for a faster one.
+    """
+
+    name = "json"
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+
+class OrjsonSerializer(JsonSerializer):
+    ## Several times faster than the standard library for the lists of small dicts annotators return.
+
+    name = "orjson"
+
+    _options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY if orjson is not None else 0
+
+    def dumps(self, value: Any) -> bytes:
+        try:
+            return orjson.dumps(value, option=self._options)
+        except TypeError:
+            ## E.g. integers over 64 bits, which the standard library supports.
+            return super().dumps(value)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+
+
+SERIALIZERS: Dict[str, Type[JsonSerializer]] = {
+    JsonSerializer.name: JsonSerializer,
+    OrjsonSerializer.name: OrjsonSerializer,
+}
+
+
+def get_serializer(name: Optional[str] = None) -> JsonSerializer:
+    ## `name`: one of `SERIALIZERS`, by default the fastest one installed
+    if name is None:
+        name = OrjsonSerializer.name if orjson is not None else JsonSerializer.name
+
+    if name not in SERIALIZERS:
+        raise ValueError(f"Unknown JSON serializer {name!r}, expected one of {sorted(SERIALIZERS)!r}")
+
+    if name == OrjsonSerializer.name and orjson is None:
+        _log.warning("orjson is not installed, using the standard library for JSON")
+        name = JsonSerializer.name
+
+    return SERIALIZERS[name]()
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import random
+import socket
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, List, Optional, Set
+
+from statsd.client.base import StatsClientBase
+
+_log = logging.getLogger(__name__)
+
+## Counted, whatever the cap on the names
+DROPPED_METRIC = "statsd.dropped.count"
+
+
+class AggregatingStatsClient(StatsClientBase):
+    """
+    statsd client accumulating the metrics in memory, sent every flush by a
+    background task (see `run`) rather than one UDP packet per call:
+
+    - counters are summed, and gauges keep their last value, one line per flush;
+    - timers keep their samples (the statsd server computes the percentiles),
+      up to `max_timer_samples` per flush, beyond which a random subset is kept
+      and sent with its sample rate;
+    - lines are packed in packets of up to `max_packet_bytes`.
+
+    At most `max_metrics` distinct names are sent, the metrics with new names
+    beyond it are dropped (and counted in `statsd.dropped.count`).
+
+    Pipelines are the client itself, everything is batched anyway.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 8125,
+        prefix: Optional[str] = None,
+        max_packet_bytes: int = 1432,
+        ipv6: bool = False,
+        max_metrics: int = 2000,
+        max_timer_samples: int = 1000,
+    ) -> None:
+        family = socket.AF_INET6 if ipv6 else socket.AF_INET
+        family, _, _, _, self._addr = socket.getaddrinfo(host, port, family, socket.SOCK_DGRAM)[0]
+        self._sock = socket.socket(family, socket.SOCK_DGRAM)
+
+        ## Without the trailing dot the configured prefixes usually have, added again by `_name`
+        self._prefix = prefix.rstrip(".") if prefix else None
+        self.max_packet_bytes = max_packet_bytes
+        self.max_metrics = max_metrics
+        self.max_timer_samples = max_timer_samples
+
+        self._names: Set[str] = set()
+        self._dropped = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._gauge_deltas: Dict[str, float] = defaultdict(float)
+        self._sets: Dict[str, Set[str]] = defaultdict(set)
+        ## name -> samples kept, and samples seen
+        self._timers: Dict[str, List[float]] = defaultdict(list)
+        self._timer_counts: Dict[str, int] = defaultdict(int)
+
+    def _accept(self, stat: str) -> bool:
+        if stat in self._names:
+            return True
+
+        if len(self._names) >= self.max_metrics:
+            if not self._dropped:
+                _log.warning("More than %r statsd metrics, dropping the new ones (e.g. %r)", self.max_metrics, stat)
+            self._dropped += 1
+            return False
+
+        self._names.add(stat)
+        return True
+
+    ## The statsd client API: `rate` is ignored, nothing needs to be sampled out once aggregated.
+
+    def incr(self, stat: str, count: float = 1, rate: float = 1) -> None:
+        if self._accept(stat):
+            self._counters[stat] += count
+
+    def decr(self, stat: str, count: float = 1, rate: float = 1) -> None:
+        self.incr(stat, -count, rate)
+
+    def gauge(self, stat: str, value: float, rate: float = 1, delta: bool = False) -> None:
+        if not self._accept(stat):
+            return
+
+        if delta:
+            self._gauge_deltas[stat] += value
+        else:
+            self._gauges[stat] = value
+            self._gauge_deltas.pop(stat, None)
+
+    def set(self, stat: str, value, rate: float = 1) -> None:
+        if self._accept(stat):
+            self._sets[stat].add(str(value))
+
+    def timing(self, stat: str, delta, rate: float = 1) -> None:
+        if not self._accept(stat):
+            return
+
+        if isinstance(delta, timedelta):
+            delta = delta.total_seconds() * 1000.0
+
+        samples = self._timers[stat]
+        self._timer_counts[stat] += 1
+        seen = self._timer_counts[stat]
+
+        ## Reservoir sampling: every sample seen has the same chance to be kept
+        if len(samples) < self.max_timer_samples:
+            samples.append(delta)
+        else:
+            index = random.randrange(seen)
+            if index < self.max_timer_samples:
+                samples[index] = delta
+
+    def pipeline(self) -> "AggregatingStatsClient":
+        return self
+
+    def __enter__(self) -> "AggregatingStatsClient":
+        return self
+
+    def __exit__(self, typ, value, tb) -> None:
+        pass
+
+    def send(self) -> None:
+        pass
+
+    def _name(self, stat: str) -> str:
+        return f"{self._prefix}.{stat}" if self._prefix else stat
+
+    def lines(self) -> List[str]:
+        ## The metrics accumulated since the last call, in the statsd format, and starts over.
+        counters, gauges, gauge_deltas = self._counters, self._gauges, self._gauge_deltas
+        sets, timers, timer_counts = self._sets, self._timers, self._timer_counts
+        dropped, self._dropped = self._dropped, 0
+        self._reset()
+
+        lines = [f"{self._name(stat)}:{_format(count)}|c" for stat, count in counters.items() if count]
+
+        if dropped:
+            lines.append(f"{self._name(DROPPED_METRIC)}:{dropped}|c")
+
+        for stat, value in gauges.items():
+            if value < 0:
+                ## A negative value would be read as a decrement
+                lines.append(f"{self._name(stat)}:0|g")
+            lines.append(f"{self._name(stat)}:{_format(value)}|g")
+
+        lines.extend(
+            f"{self._name(stat)}:{'+' if value >= 0 else ''}{_format(value)}|g"
+            for stat, value in gauge_deltas.items()
+        )
+
+        for stat, values in sets.items():
+            lines.extend(f"{self._name(stat)}:{value}|s" for value in values)
+
+        for stat, samples in timers.items():
+            rate = len(samples) / timer_counts[stat]
+            suffix = "|ms" if rate >= 1 else f"|ms|@{rate:.6f}"
+            lines.extend(f"{self._name(stat)}:{sample:.6f}{suffix}" for sample in samples)
+
+        return lines
+
+    def packets(self, lines: List[str]) -> List[bytes]:
+        packets, packet, size = [], [], 0
+
+        for line in lines:
+            line_size = len(line.encode("utf-8"))
+
+            if packet and size + 1 + line_size > self.max_packet_bytes:
+                packets.append("\n".join(packet).encode("utf-8"))
+                packet, size = [], 0
+
+            packet.append(line)
+            size += line_size + (1 if len(packet) > 1 else 0)
+
+        if packet:
+            packets.append("\n".join(packet).encode("utf-8"))
+
+        return packets
+
+    def flush(self) -> None:
+        for packet in self.packets(self.lines()):
+            try:
+                self._sock.sendto(packet, self._addr)
+            except (OSError, RuntimeError):
+                ## Metrics are best effort
+                pass
+
+    async def run(self, interval: float) -> None:
+        ## Flushes every `interval` seconds, until cancelled (then flushes one last time)
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self.flush()
+        finally:
+            self.flush()
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
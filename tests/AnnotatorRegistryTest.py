@@ -0,0 +1,73 @@
+from nlp_annotator_api.annotators.AbstractAnnotator import AbstractAnnotator
+from nlp_annotator_api.annotators.AnnotatorRegistry import AnnotatorRegistry
+from nlp_annotator_api.config.config import AnnotatorsConfig
+
+instances = []
+
+
+class FakeAnnotator(AbstractAnnotator):
+    def __init__(self):
+        self.warm = False
+        instances.append(self)
+
+    def warm_up(self):
+        self.warm = True
+
+
+class OneMegabyteRegistry(AnnotatorRegistry):
+    ## Pretends every annotator takes 1 MB
+    def _load(self, name):
+        self.sizes[name] = 1024**2
+        return FakeAnnotator()
+
+
+_class_paths = {name: f"{__name__}:FakeAnnotator" for name in ("a", "b", "c")}
+
+
+def test_loads_on_first_use():
+    registry = AnnotatorRegistry(_class_paths, AnnotatorsConfig(preload=[]))
+    instances.clear()
+
+    assert "a" in registry and list(registry) == ["a", "b", "c"]
+    assert registry.loaded() == [] and instances == []
+
+    assert registry["a"] is registry["a"]
+    assert registry.loaded() == ["a"]
+    assert instances[0].warm
+
+
+def test_evicts_least_recently_used_within_budget():
+    registry = OneMegabyteRegistry(_class_paths, AnnotatorsConfig(preload=[], pinned=["a"], memory_budget_mb=2))
+
+    registry.preload()
+    registry["b"]
+    registry["a"]
+    registry["c"]
+
+    assert registry.loaded() == ["a", "c"]
+
+
+def test_resolve_drops_the_annotators_which_cannot_be_imported():
+    registry = AnnotatorRegistry(dict(_class_paths, missing="no_such_module:Annotator"), AnnotatorsConfig(preload=[]))
+
+    registry.resolve()
+
+    assert list(registry) == ["a", "b", "c"]
+    assert registry.annotator_class("a") is FakeAnnotator
+    assert registry.loaded() == []
+
+
+class VersionedAnnotator(FakeAnnotator):
+    content = "v1"
+
+    @classmethod
+    def content_version(cls):
+        return cls.content
+
+
+def test_versions_include_the_content_version():
+    registry = AnnotatorRegistry({"a": f"{__name__}:VersionedAnnotator"}, AnnotatorsConfig(preload=[]))
+    registry.resolve()
+
+    assert registry.version("a") == f"{FakeAnnotator.annotator_metadata().version}+v1"
+    assert registry.loaded() == []
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from aiohttp import web
+
+from nlp_annotator_api.annotators.WatsonHealthAnnotator import WatsonHealthAnnotator
+from nlp_annotator_api.config.config import conf
+
+object_type = "text"
+
+
+class StubApi:
+    """
+    Local stand-in for the Watson Health API, answering with one
+    'umls.DiseaseOrSyndrome' concept covering every text.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.failures = 0
+        self.delay = 0.0
+
+    async def analyze(self, request: web.Request):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        try:
+            await asyncio.sleep(self.delay)
+
+            if self.failures > 0:
+                self.failures -= 1
+                return web.json_response({"error": "unavailable"}, status=503)
+
+            body = await request.json()
+
+            return web.json_response({
+                "unstructured": [
+                    {
+                        "data": {
+                            "concepts": [
+                                {
+                                    "type": "umls.DiseaseOrSyndrome",
+                                    "coveredText": item["text"],
+                                    "preferredName": item["text"].lower(),
+                                    "begin": 0,
+                                    "end": len(item["text"]),
+                                }
+                            ]
+                        }
+                    }
+                    for item in body["unstructured"]
+                ]
+            })
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.fixture
+def stub_api(monkeypatch):
+    api = StubApi()
+    app = web.Application()
+    app.router.add_post("/v1/analyze/{flow_name}", api.analyze)
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    settings = conf.watson_health_annotator
+    monkeypatch.setattr(settings, "api_url", f"http://127.0.0.1:{port}")
+    monkeypatch.setattr(settings, "concepts", {"umls.DiseaseOrSyndrome": ""})
+    monkeypatch.setattr(settings, "retry_wait_seconds", 0.01)
+    monkeypatch.setattr(settings, "max_concurrency", 4)
+
+    yield api
+
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+@pytest.fixture
+def annotator():
+    return WatsonHealthAnnotator()
+
+
+def test_annotates_and_keeps_empty_texts_aligned(stub_api, annotator):
+    texts = ['Fever', '', 'Cancer']
+
+    entities = annotator.annotate_batched_entities(object_type, texts, None)
+
+    assert entities[1] == {}
+    assert entities[0]['umls-disease-or-syndrome'][0]['match'] == 'fever'
+    assert entities[2]['umls-disease-or-syndrome'][0]['original'] == 'Cancer'
+
+
+def test_sends_chunks_concurrently(stub_api, annotator):
+    stub_api.delay = 0.2
+    # Each text fills one chunk on its own
+    texts = ['x' * 30000 for _ in range(4)]
+
+    tic = time.monotonic()
+    entities = annotator.annotate_batched_entities(object_type, texts, None)
+    elapsed = time.monotonic() - tic
+
+    assert len(entities) == len(texts)
+    assert stub_api.calls == 4
+    assert stub_api.max_in_flight > 1
+    assert elapsed < 4 * stub_api.delay
+
+
+def test_retries_failed_calls(stub_api, annotator):
+    stub_api.failures = 2
+
+    entities = annotator.annotate_batched_entities(object_type, ['Fever'], None)
+
+    assert stub_api.calls == 3
+    assert entities[0]['umls-disease-or-syndrome'][0]['match'] == 'fever'
+
+
+def test_gives_up_after_max_attempts(stub_api, annotator, monkeypatch):
+    monkeypatch.setattr(conf.watson_health_annotator, "max_attempts", 2)
+    stub_api.failures = 5
+
+    entities = annotator.annotate_batched_entities(object_type, ['Fever', 'Cancer'], None)
+
+    assert stub_api.calls == 2
+    assert entities == [{}, {}]
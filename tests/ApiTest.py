@@ -0,0 +1,212 @@
+import asyncio
+import json
+import os
+import signal
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from nlp_annotator_api.server.app import aiohttp_app
+from nlp_annotator_api.server.controllers import stream_controller
+from nlp_annotator_api.utils import compression
+
+requires_zstd = pytest.mark.skipif(compression.zstandard is None, reason="zstandard is not installed")
+
+_headers = {"Authorization": "test 123"}
+_url = "/api/v1/annotators/SimpleTextGeographyAnnotator"
+
+## The application can only ever run in one event loop
+_loop = asyncio.new_event_loop()
+
+
+def _with_client(main):
+    ## Runs `main(client)` against the application, started (pools included) for the test
+    async def run():
+        async with TestClient(TestServer(aiohttp_app, loop=_loop), loop=_loop) as client:
+            await main(client)
+
+    _loop.run_until_complete(run())
+
+
+def test_operations_of_a_transaction_are_not_coalesced():
+    async def main(client):
+        texts = ["Paris is the capital of France."]
+        find_entities = {"find_entities": {"object_type": "text", "entity_names": None, "texts": texts}}
+
+        entities = (await (await client.post(_url, json=find_entities, headers=_headers)).json())["entities"]
+        find_relationships = {
+            "find_relationships": {"object_type": "text", "relationship_names": None, "entities": entities, "texts": texts}
+        }
+
+        ## Concurrent, in the same transaction
+        headers = {**_headers, "X-CPS-Transaction-Id": "transaction-1"}
+        ## Other texts, still being annotated when the relationships are requested
+        other_texts = [f"Bern is the capital of Switzerland ({index})." for index in range(100)]
+        find_other_entities = {"find_entities": {**find_entities["find_entities"], "texts": other_texts}}
+
+        responses = await asyncio.gather(
+            client.post(_url, json=find_other_entities, headers=headers),
+            client.post(_url, json=find_relationships, headers=headers),
+        )
+
+        assert [response.status for response in responses] == [200, 200]
+        assert [list(await response.json()) for response in responses] == [["entities"], ["relationships"]]
+
+    _with_client(main)
+
+
+def test_requests_succeed_after_losing_a_worker():
+    async def main(client):
+        pool = client.server.app["process_pool"]
+        assert pool is not None
+
+        body = {"find_entities": {"object_type": "text", "entity_names": None, "texts": ["Rome is old."]}}
+
+        os.kill(next(iter(pool.executor._processes)), signal.SIGKILL)
+
+        response = await client.post(_url, json=body, headers=_headers)
+        assert response.status == 200
+        assert "entities" in await response.json()
+        assert pool.restarts == 1
+
+        assert (await client.get("/api/v1/health")).status == 200
+
+    _with_client(main)
+
+
+def test_health_fails_while_the_pool_is_broken():
+    async def main(client):
+        pool = client.server.app["process_pool"]
+        pool.broken = True
+
+        try:
+            assert (await client.get("/api/v1/health")).status == 503
+        finally:
+            pool.broken = False
+
+    _with_client(main)
+
+
+def _stream_lines(text: str) -> list:
+    return [json.loads(line) for line in text.splitlines()]
+
+
+def _matches(entities: dict) -> set:
+    return {match["match"] for values in entities.values() for match in values}
+
+
+def test_stream_requires_authorization():
+    async def main(client):
+        response = await client.post(_url + "/stream", data=b'"Paris"\n')
+        assert response.status == 401
+
+    _with_client(main)
+
+
+def test_stream_results_are_in_order():
+    cities = ["Paris", "Rome", "Bern", "Madrid", "Berlin", "Vienna"] * 50
+
+    async def main(client):
+        body = "".join(json.dumps(f"{city} is a city ({index}).") + "\n" for index, city in enumerate(cities))
+
+        response = await client.post(_url + "/stream", data=body.encode(), headers=_headers)
+        assert response.status == 200
+
+        results = _stream_lines(await response.text())
+        assert [result["index"] for result in results] == list(range(len(cities)))
+        assert [_matches(result["entities"]) for result in results] == [{city} for city in cities]
+
+    _with_client(main)
+
+
+def test_stream_reports_invalid_lines():
+    async def main(client):
+        body = b'"Paris is big."\n{"not closed"\n"Rome is old."\n'
+
+        response = await client.post(_url + "/stream", data=body, headers=_headers)
+        results = _stream_lines(await response.text())
+
+        assert [result["index"] for result in results] == [0, 1, 2]
+        assert _matches(results[0]["entities"]) == {"Paris"}
+        assert results[1]["error"]["status"] == 400
+        assert "entities" not in results[1]
+        assert _matches(results[2]["entities"]) == {"Rome"}
+        assert all("error" not in results[index] for index in (0, 2))
+
+    _with_client(main)
+
+
+def test_stream_lines_split_across_body_chunks():
+    async def main(client):
+        body = '"Paris is big."\n"Rome is old."\n"Bern is \u00e0 l\u2019ouest."'.encode()
+
+        async def send():
+            ## Cut in the middle of the lines, and of a multi-byte character
+            for start in range(0, len(body), 7):
+                yield body[start:start + 7]
+                await asyncio.sleep(0)
+
+        response = await client.post(_url + "/stream", data=send(), headers=_headers)
+        results = _stream_lines(await response.text())
+
+        assert [_matches(result["entities"]) for result in results] == [{"Paris"}, {"Rome"}, {"Bern"}]
+
+    _with_client(main)
+
+
+@pytest.mark.parametrize("coding", [compression.GZIP, pytest.param(compression.ZSTD, marks=requires_zstd)])
+def test_stream_compressed_body(coding):
+    async def main(client):
+        body = compression.compress(b'"Paris is big."\n"Rome is old."\n', coding)
+
+        response = await client.post(
+            _url + "/stream", data=body, headers={**_headers, "Content-Encoding": coding}
+        )
+        results = _stream_lines(await response.text())
+
+        assert [_matches(result["entities"]) for result in results] == [{"Paris"}, {"Rome"}]
+
+    _with_client(main)
+
+
+def test_stream_reports_missing_results(monkeypatch):
+    ## An annotator returning fewer results than items fails each of them
+    async def run_with_item_cache(annotator, body, request):
+        return {"entities": [{}]}
+
+    monkeypatch.setattr(stream_controller, "_run_with_item_cache", run_with_item_cache)
+
+    async def main(client):
+        body = b'"Paris is big."\n"Rome is old."\nnot json\n'
+
+        response = await client.post(_url + "/stream", data=body, headers=_headers)
+        results = _stream_lines(await response.text())
+
+        assert [result["error"]["status"] for result in results] == [500, 500, 400]
+
+    _with_client(main)
+
+
+def test_dropped_relationships_are_returned_as_the_annotator_does():
+    ## The annotator drops the empty results (none of the relationships is known), which
+    ## can't be matched to their items, so they go through the item cache untouched.
+    async def main(client):
+        texts = ["Paris is the capital of France.", "Nothing here."]
+        find_entities = {"find_entities": {"object_type": "text", "entity_names": None, "texts": texts}}
+        entities = (await (await client.post(_url, json=find_entities, headers=_headers)).json())["entities"]
+
+        for relationship_names in (["unknown"], ["unknown"], ["cities-to-countries"]):
+            body = {
+                "find_relationships": {
+                    "object_type": "text", "relationship_names": relationship_names, "entities": entities, "texts": texts,
+                }
+            }
+            response = await client.post(_url, json=body, headers=_headers)
+            relationships = (await response.json())["relationships"]
+
+            if relationship_names == ["unknown"]:
+                assert relationships == []
+            else:
+                assert [len(value["cities-to-countries"]["data"]) for value in relationships] == [1, 0]
+
+    _with_client(main)
@@ -0,0 +1,48 @@
+import json
+
+from nlp_annotator_api.batch import main
+
+
+def _run(tmp_path, *args, entity_names=("cities",)):
+    return main([
+        "--annotator", "SimpleTextGeographyAnnotator",
+        *(["--entity-names", *entity_names] if entity_names is not None else []),
+        "--workers", "0", "--chunk-size", "2", "--output", str(tmp_path / "out.jsonl"),
+        str(tmp_path / "in.jsonl"), *args,
+    ])
+
+
+def test_annotates_and_resumes(tmp_path):
+    texts = ["Bern is in Switzerland", {"_id": "doc1", "text": "Paris"}, "Nothing", "{broken"]
+    (tmp_path / "in.jsonl").write_text("\n".join(
+        text if text == "{broken" else json.dumps(text) for text in texts
+    ) + "\n")
+
+    assert _run(tmp_path) == 0
+    output = (tmp_path / "out.jsonl").read_text()
+    results = [json.loads(line) for line in output.splitlines()]
+
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert results[0]["entities"][0]["cities"][0]["match"] == "Bern"
+    assert results[1]["id"] == "doc1"
+    assert "error" in results[3]
+
+    # Interrupted after the first chunk, with a partially written line
+    first_chunk = "".join(output.splitlines(True)[:2])
+    (tmp_path / "out.jsonl").write_text(first_chunk + '{"index": 2, "part')
+    checkpoint = json.loads((tmp_path / "out.jsonl.checkpoint").read_text())
+    checkpoint.update(documents=2, output_bytes=len(first_chunk.encode("utf-8")))
+    (tmp_path / "out.jsonl.checkpoint").write_text(json.dumps(checkpoint))
+
+    assert _run(tmp_path) == 0
+    assert (tmp_path / "out.jsonl").read_text() == output
+
+
+def test_all_entities_by_default(tmp_path):
+    (tmp_path / "in.jsonl").write_text(json.dumps("New Delhi is the capital of India.") + "\n")
+
+    assert _run(tmp_path, entity_names=None) == 0
+    result = json.loads((tmp_path / "out.jsonl").read_text())
+
+    assert set(result["entities"][0]) == {"cities", "countries", "provincies"}
+    assert result["entities"][0]["countries"][0]["match"] == "India"
@@ -0,0 +1,22 @@
+from benchmarks.corpus import synthetic_tables, synthetic_texts
+from benchmarks.run import compare, measure
+
+
+def test_corpora_are_reproducible():
+    assert synthetic_texts(5, seed=1) == synthetic_texts(5, seed=1)
+    assert synthetic_texts(5, seed=1) != synthetic_texts(5, seed=2)
+    assert len(synthetic_tables(2, rows=3, cols=4)[1]) == 3
+
+
+def test_measure_and_compare():
+    result = measure("dictionary.annotate_entities_text", {"texts": 10}, seed=0, repeat=2)
+
+    assert result["units"]["items"] == 10
+    assert result["throughput"]["items_per_s"] > 0
+
+    current = {"benchmarks": {"a": result, "b": {"skipped": "no model"}}}
+    faster = {"benchmarks": {"a": {"seconds": {"median": result["seconds"]["median"] * 10}}}}
+    slower = {"benchmarks": {"a": {"seconds": {"median": result["seconds"]["median"] / 10}}}}
+
+    assert [row["regression"] for row in compare(current, faster, 0.1)] == [False]
+    assert [row["regression"] for row in compare(current, slower, 0.1)] == [True]
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from nlp_annotator_api.config.config import CompressionConfig
+from nlp_annotator_api.server.middleware.compression_middleware import CompressionMiddleware
+from nlp_annotator_api.utils import compression
+
+requires_zstd = pytest.mark.skipif(compression.zstandard is None, reason="zstandard is not installed")
+
+
+@pytest.mark.parametrize("coding", [compression.GZIP, pytest.param(compression.ZSTD, marks=requires_zstd)])
+def test_round_trip(coding):
+    data = b'{"entities": [{"cities": []}]}' * 1000
+
+    compressed = compression.compress(data, coding)
+
+    assert len(compressed) < len(data)
+    assert compression.decompress(compressed, coding) == data
+
+    with pytest.raises(compression.TooLarge):
+        compression.decompress(compressed, coding, max_size=len(data) - 1)
+
+
+def test_accepted_coding():
+    codings = [compression.ZSTD, compression.GZIP]
+
+    assert compression.accepted_coding("gzip, deflate, br", codings) == compression.GZIP
+    assert compression.accepted_coding("gzip;q=0.5, zstd", codings) == compression.ZSTD
+    assert compression.accepted_coding("zstd;q=0, gzip", codings) == compression.GZIP
+    assert compression.accepted_coding("identity", codings) is None
+    assert compression.accepted_coding("", codings) is None
+
+
+@pytest.mark.parametrize("coding", [compression.GZIP, pytest.param(compression.ZSTD, marks=requires_zstd)])
+def test_offload(coding):
+    data = b"x" * compression.EXECUTOR_MIN_BYTES
+
+    async def main():
+        compressed = await compression.offload(compression.compress, data, coding)
+        return await compression.offload(compression.decompress, compressed, coding, max_size=len(data))
+
+    assert asyncio.run(main()) == data
+
+
+@requires_zstd
+def test_middleware_decompresses_zstd_bodies():
+    async def echo(request):
+        return web.json_response({
+            "body": await request.text(),
+            "encoding": request.headers.get("Content-Encoding"),
+            "length": request.headers.get("Content-Length"),
+        })
+
+    async def main():
+        app = web.Application(middlewares=[CompressionMiddleware(CompressionConfig(), max_body_bytes=1024)])
+        app.router.add_post("/", echo)
+
+        async with TestClient(TestServer(app)) as client:
+            data = b'{"texts": ["Paris"]}'
+            response = await client.post(
+                "/", data=compression.compress(data, compression.ZSTD), headers={"Content-Encoding": "zstd"}
+            )
+            assert await response.json() == {"body": data.decode(), "encoding": None, "length": None}
+
+            response = await client.post(
+                "/", data=compression.compress(b"x" * 2048, compression.ZSTD), headers={"Content-Encoding": "zstd"}
+            )
+            assert response.status == 413
+
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+import json
+import os
+
+import pytest
+from nlp_annotator_api.annotators.entities.common.DictionaryMatcher import create_matcher
+from nlp_annotator_api.annotators.entities.common.utils import resources_dir
+
+data_dir = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.fixture
+def texts():
+    with open(os.path.join(data_dir, 'geography.txt'), 'r') as text_reader:
+        return text_reader.read().splitlines()
+
+
+def test_finds_delimited_terms_only():
+    matcher = create_matcher('aho_corasick', ['Bern', 'New Delhi', 'Delhi'])
+
+    text = 'Bern, Berne and (New Delhi).'
+
+    assert list(matcher.find(text)) == [(0, 4), (17, 26)]
+
+
+def test_non_overlapping_like_one_regex():
+    # In one expression, the regex matcher keeps the first alternative matching at the leftmost position
+    terms = ['New', 'New York', 'York', 'York City', 'Delhi', 'New Delhi']
+    regex = create_matcher('regex', sorted(terms, key=len, reverse=True))
+    aho_corasick = create_matcher('aho_corasick', terms)
+
+    for text in ['New York City', 'New Delhi, New York and York.', '(York City)']:
+        assert list(aho_corasick.find(text)) == list(regex.find(text))
+
+
+def test_keeps_terms_longer_than_regex_limit():
+    term = 'South Georgia and the South Sandwich Islands'
+    matcher = create_matcher('aho_corasick', [term + ' of the Long Name'])
+
+    text = f'"{term} of the Long Name" is long.'
+
+    assert list(matcher.find(text)) == [(1, 1 + len(term) + 17)]
+
+
+@pytest.mark.parametrize('filename', ['cities.json', 'countries.json', 'provincies.json'])
+def test_aho_corasick_matches_regex(texts, filename):
+    with open(os.path.join(resources_dir, filename), 'r') as dictionary_reader:
+        dictionary = json.load(dictionary_reader)
+
+    regex = create_matcher('regex', dictionary)
+    aho_corasick = create_matcher('aho_corasick', dictionary)
+
+    for text in texts:
+        assert set(aho_corasick.find(text)) == set(regex.find(text))
+
+
+def test_unknown_matcher():
+    with pytest.raises(ValueError):
+        create_matcher('unknown', [])
+
+
+def test_compiled_index_matches_in_memory_index(texts, tmp_path):
+    from nlp_annotator_api.annotators.SimpleTextGeographyAnnotator import SimpleTextGeographyAnnotator
+    from nlp_annotator_api.annotators.entities.common.CompiledAutomaton import CompiledAutomaton
+
+    index = SimpleTextGeographyAnnotator()._ent_index
+    path = index.compile(str(tmp_path / 'index.ac'))
+
+    compiled = CompiledAutomaton.load(path, index.digest())
+    in_memory = index._build()
+
+    for text in texts:
+        assert list(compiled.iter_matches(text)) == list(in_memory.iter_matches(text))
+
+    # Compiled from other dictionaries
+    assert CompiledAutomaton.load(path, b'\0' * 32) is None
+
+
+def test_index_honours_the_matcher_of_the_annotators(texts):
+    from nlp_annotator_api.annotators.entities.CitiesAnnotator import CitiesAnnotator
+    from nlp_annotator_api.annotators.entities.CountriesAnnotator import CountriesAnnotator
+    from nlp_annotator_api.annotators.entities.common.DictionaryEntityIndex import DictionaryEntityIndex
+
+    cities, countries = CitiesAnnotator(), CountriesAnnotator()
+    cities.config.matcher = 'regex'
+    index = DictionaryEntityIndex([cities, countries])
+
+    for text in texts:
+        # In the order requested, as the annotators on their own
+        assert index.annotate_entities_text(text, ['countries', 'cities']) == (
+            countries.annotate_entities_text(text) + cities.annotate_entities_text(text)
+        )
+
+
+def test_digest_is_read_from_the_compiled_index_while_the_dictionaries_are_unchanged(tmp_path, monkeypatch):
+    from nlp_annotator_api.annotators.SimpleTextGeographyAnnotator import SimpleTextGeographyAnnotator
+    from nlp_annotator_api.config.config import conf
+
+    monkeypatch.setattr(conf.dictionaries, 'compiled_dir', str(tmp_path))
+    index = SimpleTextGeographyAnnotator()._ent_index
+    digest = index._hash()
+    index.compile()
+
+    hashed = []
+    monkeypatch.setattr(index, '_hash', lambda: hashed.append(True) or digest)
+
+    assert index.digest() == digest and hashed == []
+
+    # The dictionaries changed (or were copied) since: hashed again
+    monkeypatch.setattr(index, 'stamp', lambda: b'\0' * 32)
+    assert index.digest() == digest and hashed == [True]
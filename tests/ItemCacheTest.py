@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from nlp_annotator_api.config.config import MemoryCacheConfig
+from nlp_annotator_api.server.controllers import annotate_controller
+from nlp_annotator_api.server.controllers.annotate_controller import _get_item_cache_keys, _run_with_item_cache
+from nlp_annotator_api.server.middleware.memory_cache import MemoryCache, TieredCache
+
+_annotator = "SimpleTextGeographyAnnotator"
+
+
+class FakeRequest(dict):
+    # Minimal stand-in for the request, with the cache of the application
+    def __init__(self, cache):
+        super().__init__()
+        self.config_dict = {"cache": cache}
+
+
+def _find_entities(texts, entity_names=None, object_type="text"):
+    field = "tables" if object_type == "table" else "texts"
+    return {"find_entities": {"object_type": object_type, "entity_names": entity_names, field: texts}}
+
+
+@pytest.fixture
+def request_():
+    return FakeRequest(TieredCache(MemoryCache(MemoryCacheConfig()), None))
+
+
+@pytest.fixture
+def dispatched(monkeypatch):
+    # Items sent to the annotator, which returns one result per item
+    dispatched = []
+
+    async def dispatch(annotator, body, request):
+        texts = body["find_entities"]["texts"]
+        dispatched.append(texts)
+        return {"entities": [{"upper": text.upper()} for text in texts]}
+
+    monkeypatch.setattr(annotate_controller, "_dispatch_batched", dispatch)
+
+    return dispatched
+
+
+def test_merges_hits_and_misses_in_order(request_, dispatched):
+    asyncio.run(_run_with_item_cache(_annotator, _find_entities(["b", "d"]), request_))
+
+    results = asyncio.run(_run_with_item_cache(_annotator, _find_entities(["a", "b", "c", "d", "e"]), request_))
+
+    assert results == {"entities": [{"upper": text} for text in "ABCDE"]}
+    assert dispatched == [["b", "d"], ["a", "c", "e"]]
+
+    assert asyncio.run(_run_with_item_cache(_annotator, _find_entities(["e", "a"]), request_)) == {
+        "entities": [{"upper": "E"}, {"upper": "A"}]
+    }
+    assert len(dispatched) == 2
+
+
+def test_keys_depend_on_the_parameters(monkeypatch):
+    def keys(object_type="text", entity_names=None):
+        body = _find_entities(["a"], entity_names, object_type)
+        return _get_item_cache_keys(_annotator, "find_entities", body["find_entities"])
+
+    assert keys() == keys()
+    assert keys(object_type="table") != keys()
+    assert keys(entity_names=["cities"]) != keys()
+    assert keys(entity_names=["cities"]) != keys(entity_names=["countries"])
+    assert keys(entity_names=["cities", "countries"]) == keys(entity_names=["countries", "cities"])
+
+    before = keys()
+    monkeypatch.setattr(annotate_controller.annotators, "version", lambda annotator: "other")
+    assert keys() != before
+
+
+def test_entity_names_are_cached_apart(request_, dispatched):
+    asyncio.run(_run_with_item_cache(_annotator, _find_entities(["a"], ["cities"]), request_))
+    asyncio.run(_run_with_item_cache(_annotator, _find_entities(["a"], ["countries"]), request_))
+    asyncio.run(_run_with_item_cache(_annotator, _find_entities(["a"], ["cities"]), request_))
+
+    assert dispatched == [["a"], ["a"]]
+
+
+def test_unaligned_results_are_not_cached(request_, monkeypatch):
+    # As SimpleTextGeographyAnnotator.annotate_batched_relationships, the empty results are dropped
+    dispatched = []
+
+    async def dispatch(annotator, body, request):
+        texts = body["find_entities"]["texts"]
+        dispatched.append(texts)
+        return {"entities": [{"upper": text.upper()} for text in texts if text != "-"]}
+
+    monkeypatch.setattr(annotate_controller, "_dispatch_batched", dispatch)
+
+    asyncio.run(_run_with_item_cache(_annotator, _find_entities(["a"]), request_))
+
+    ## A partial miss falls back to the whole request, so that the annotator sees all its items
+    results = asyncio.run(_run_with_item_cache(_annotator, _find_entities(["a", "-"]), request_))
+    assert results == {"entities": [{"upper": "A"}]}
+    assert dispatched == [["a"], ["-"], ["a", "-"]]
+
+    ## A complete miss returns the results as they are
+    results = asyncio.run(_run_with_item_cache(_annotator, _find_entities(["-", "b"]), request_))
+    assert results == {"entities": [{"upper": "B"}]}
+    assert dispatched[-1] == ["-", "b"]
+
+    asyncio.run(_run_with_item_cache(_annotator, _find_entities(["-", "b"]), request_))
+    assert dispatched[-1] == ["-", "b"]
+    assert len(dispatched) == 5
@@ -0,0 +1,33 @@
+import os
+import signal
+import threading
+
+from nlp_annotator_api.server.launcher import Launcher, create_socket
+
+
+def test_restarts_crashed_workers(tmp_path):
+    starts = tmp_path / "starts"
+
+    def crash(sock, worker_id):
+        with open(starts, "a") as f:
+            f.write(f"{worker_id}\n")
+        os._exit(1)
+
+    sock = create_socket("127.0.0.1", 0)
+    launcher = Launcher(sock, 2, target=crash, restart_delay_seconds=0.05, shutdown_timeout_seconds=1)
+
+    handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)}
+    timer = threading.Timer(1.5, launcher.stop)
+    try:
+        timer.start()
+        assert launcher.run() == 0
+    finally:
+        timer.cancel()
+        sock.close()
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+    worker_ids = starts.read_text().split()
+    ## Restarted with their ids, after increasing delays
+    assert 3 <= worker_ids.count("0") <= 7
+    assert 3 <= worker_ids.count("1") <= 7
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from nlp_annotator_api.config.config import MemoryCacheConfig
+from nlp_annotator_api.server.middleware.memory_cache import MemoryCache, TieredCache
+
+
+class DictRedisCache:
+    # Minimal stand-in for `RedisCache` storing the values in a dict
+    def __init__(self):
+        self.values = {}
+        self.config = type("Config", (), {"ttl": 300, "item_cache": True, "item_ttl": 600})()
+
+    async def get_many(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    async def set_many(self, values, ttl=None):
+        self.values.update(values)
+
+
+@pytest.fixture
+def memory():
+    return MemoryCache(MemoryCacheConfig(max_bytes=2000, max_entry_bytes=500, ttl=60))
+
+
+def test_evicts_least_recently_used(memory):
+    for index in range(20):
+        memory.set(f"key{index}", "x" * 100)
+        # key0 is kept hot
+        assert memory.get("key0") is not None
+
+    assert memory.size <= memory.config.max_bytes
+    assert memory.evictions > 0
+    assert memory.get("key1") is None
+    assert memory.get("key19") is not None
+
+
+def test_skips_large_entries(memory):
+    memory.set("large", "x" * 1000)
+
+    assert memory.get("large") is None
+    assert memory.size == 0
+
+
+def test_expires_entries(memory):
+    memory.set("key", "value", ttl=-1)
+
+    assert memory.get("key") is None
+    assert len(memory) == 0
+
+
+def test_tiered_cache_keeps_redis_values_in_memory(memory):
+    redis = DictRedisCache()
+    redis.values["key"] = "value"
+    cache = TieredCache(memory, redis)
+
+    assert asyncio.run(cache.get_many(["key", "other"])) == ["value", None]
+    assert memory.get("key") == "value"
+
+    asyncio.run(cache.set("other", "new"))
+
+    assert redis.values["other"] == "new"
+    assert memory.get("other") == "new"
+
+
+def test_tiered_cache_caches_items_in_their_tiers_only():
+    memory = MemoryCache(MemoryCacheConfig(item_cache=False))
+    redis = DictRedisCache()
+    cache = TieredCache(memory, redis)
+
+    assert cache.item_cache
+    assert cache.item_ttl == 600
+
+    asyncio.run(cache.set_many({"item": "value"}, ttl=cache.item_ttl, items=True))
+
+    assert memory.get("item") is None
+    assert asyncio.run(cache.get_many(["item"], items=True)) == ["value"]
+    assert memory.get("item") is None
+
+    redis.config.item_cache = False
+    assert not TieredCache(memory, redis).item_cache
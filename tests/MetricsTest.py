@@ -0,0 +1,66 @@
+from nlp_annotator_api.utils.metrics import MetricsRegistry, merge, render
+
+
+def test_render():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ("route",))
+    in_flight = registry.gauge("in_flight", "In flight")
+    duration = registry.histogram("duration_seconds", "Duration", ("route",), buckets=(0.1, 1.0))
+
+    requests.inc(route='/a"b')
+    requests.inc(2, route='/a"b')
+    in_flight.set(3)
+    for value in (0.05, 0.1, 0.5, 5.0):
+        duration.observe(value, route="/a")
+
+    lines = render(registry.collect()).splitlines()
+
+    assert lines[:3] == ["# HELP requests_total Requests", "# TYPE requests_total counter", 'requests_total{route="/a\\"b"} 3']
+    assert "in_flight 3" in lines
+    assert lines[-5:] == [
+        'duration_seconds_bucket{route="/a",le="0.1"} 2',
+        'duration_seconds_bucket{route="/a",le="1"} 3',
+        'duration_seconds_bucket{route="/a",le="+Inf"} 4',
+        'duration_seconds_sum{route="/a"} 5.65',
+        'duration_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_merge():
+    def families(requests, in_flight):
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests").inc(requests)
+        registry.gauge("in_flight", "In flight").set(in_flight)
+        return registry.collect()
+
+    merged = {family["name"]: family["samples"] for family in merge({"w0": families(2, 1), "w1": families(3, 0)})}
+
+    assert merged["requests_total"] == [["requests_total", {}, 5]]
+    assert merged["in_flight"] == [["in_flight", {"worker": "w0"}, 1], ["in_flight", {"worker": "w1"}, 0]]
+
+
+def test_restore():
+    previous = MetricsRegistry()
+    previous.counter("requests_total", "Requests").inc(5)
+    previous.counter("errors_total", "Errors").inc(1)
+    previous.histogram("duration_seconds", "Durations", buckets=(1.0,)).observe(0.5)
+    previous.gauge("in_flight", "In flight").set(3)
+
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests").inc(2)
+    registry.histogram("duration_seconds", "Durations", buckets=(1.0,)).observe(2.0)
+    registry.gauge("in_flight", "In flight").set(1)
+    registry.restore(previous.collect())
+
+    collected = {family["name"]: family["samples"] for family in registry.collect()}
+
+    # Counters and histograms carry on, gauges don't
+    assert collected["requests_total"] == [["requests_total", {}, 7]]
+    assert collected["errors_total"] == [["errors_total", {}, 1]]
+    assert collected["duration_seconds"] == [
+        ["duration_seconds_bucket", {"le": "1"}, 1],
+        ["duration_seconds_bucket", {"le": "+Inf"}, 2],
+        ["duration_seconds_sum", {}, 2.5],
+        ["duration_seconds_count", {}, 2],
+    ]
+    assert collected["in_flight"] == [["in_flight", {}, 1]]
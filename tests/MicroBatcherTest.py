@@ -0,0 +1,93 @@
+import asyncio
+
+from nlp_annotator_api.config.config import MicroBatchConfig
+from nlp_annotator_api.server.middleware.micro_batcher import MicroBatcher
+from nlp_annotator_api.server.middleware.scheduler import DeadlineExceeded, Overloaded
+
+
+def test_gathers_concurrent_requests():
+    async def main():
+        batcher = MicroBatcher({"a": MicroBatchConfig(max_wait_ms=20, max_items=100)})
+        batches = []
+
+        async def run(items, deadline, contexts):
+            batches.append((list(items), contexts))
+            return [item.upper() for item in items]
+
+        results = await asyncio.gather(
+            batcher.submit("a", "key", ["x", "y"], None, run, 1),
+            batcher.submit("a", "key", ["z"], None, run, 2),
+            batcher.submit("a", "other", ["w"], None, run, 3),
+        )
+
+        assert results == [["X", "Y"], ["Z"], ["W"]]
+        assert sorted(batches) == [(["w"], [3]), (["x", "y", "z"], [1, 2])]
+
+    asyncio.run(main())
+
+
+def test_isolates_failing_requests():
+    async def main():
+        batcher = MicroBatcher({"a": MicroBatchConfig(max_wait_ms=20, max_items=100)})
+
+        async def run(items, deadline, contexts):
+            if "bad" in items:
+                raise ValueError("bad item")
+            return [item.upper() for item in items]
+
+        results = await asyncio.gather(
+            batcher.submit("a", "key", ["x"], None, run),
+            batcher.submit("a", "key", ["bad"], None, run),
+            return_exceptions=True,
+        )
+
+        assert results[0] == ["X"]
+        assert isinstance(results[1], ValueError)
+
+    asyncio.run(main())
+
+
+def test_scheduler_errors_are_not_retried_one_by_one():
+    async def main():
+        batcher = MicroBatcher({"a": MicroBatchConfig(max_wait_ms=20, max_items=100)})
+        deadlines = []
+
+        async def run(items, deadline, contexts):
+            deadlines.append(deadline)
+            raise Overloaded() if deadline is None else DeadlineExceeded()
+
+        results = await asyncio.gather(
+            batcher.submit("a", "key", ["x"], None, run),
+            batcher.submit("a", "key", ["y"], None, run),
+            return_exceptions=True,
+        )
+
+        assert [type(result) for result in results] == [Overloaded, Overloaded]
+        assert deadlines == [None]
+
+    asyncio.run(main())
+
+
+def test_deadline_errors_fail_the_earliest_requests_only():
+    async def main():
+        batcher = MicroBatcher({"a": MicroBatchConfig(max_wait_ms=20, max_items=100)})
+        batches = []
+
+        async def run(items, deadline, contexts):
+            batches.append((list(items), deadline))
+            if deadline == 1.0:
+                raise DeadlineExceeded()
+            return [item.upper() for item in items]
+
+        results = await asyncio.gather(
+            batcher.submit("a", "key", ["x"], 1.0, run),
+            batcher.submit("a", "key", ["y"], 2.0, run),
+            batcher.submit("a", "key", ["z"], None, run),
+            return_exceptions=True,
+        )
+
+        assert isinstance(results[0], DeadlineExceeded)
+        assert results[1:] == [["Y"], ["Z"]]
+        assert batches == [(["x", "y", "z"], 1.0), (["y", "z"], 2.0)]
+
+    asyncio.run(main())
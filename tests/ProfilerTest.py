@@ -0,0 +1,42 @@
+import threading
+import time
+
+from nlp_annotator_api.config.config import ProfilingConfig
+from nlp_annotator_api.utils.profiler import AnnotatorProfiles, SamplingProfiler, format_collapsed, profile_call
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+    return "done"
+
+
+def test_sampling_profiler():
+    thread = threading.Thread(target=_busy, args=(0.3,), name="busy")
+    profiler = SamplingProfiler(0.005, label="test").start()
+    thread.start()
+    thread.join()
+    counts = profiler.stop()
+
+    busy = [stack for stack in counts if stack.startswith("test;busy;")]
+    assert busy and all(stack.endswith("_busy (tests/ProfilerTest.py)") for stack in busy)
+
+    lines = format_collapsed(counts).splitlines()
+    assert len(lines) == len(counts)
+    assert lines[0].rsplit(" ", 1)[1] == str(counts.most_common(1)[0][1])
+
+
+def test_annotator_profiles():
+    result, stacks = profile_call("SomeAnnotator", 0.005, _busy, 0.1)
+
+    assert result == "done"
+    assert stacks and all(stack.startswith("SomeAnnotator;") for stack in stacks)
+
+    profiles = AnnotatorProfiles(ProfilingConfig(annotator_sample_rates={"SomeAnnotator": 1.0}, max_stacks=1))
+
+    assert profiles.enabled()
+    assert profiles.sampled("SomeAnnotator") and not profiles.sampled("OtherAnnotator")
+
+    profiles.add("SomeAnnotator", {"a;b": 2, "a;c": 3})
+    assert profiles.counts["SomeAnnotator"] == {"a;b": 2, "(other stacks)": 3}
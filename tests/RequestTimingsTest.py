@@ -0,0 +1,19 @@
+from nlp_annotator_api.server.middleware.request_timings import RequestTimings
+
+
+def test_stages_add_up():
+    timings = RequestTimings()
+
+    timings.add("inference", 0.002)
+    with timings.stage("serialize"):
+        pass
+    timings.add("inference", 0.001)
+    timings.counts["items"] = 3
+
+    assert list(timings.stages) == ["inference", "serialize"]
+    assert abs(timings.stages["inference"] - 0.003) < 1e-9
+
+    header = timings.server_timing(0.01)
+
+    assert header.startswith("inference;dur=3.00, serialize;dur=")
+    assert header.endswith('total;dur=10.00, items;desc="3"')
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import pytest
+from nlp_annotator_api.config.config import NlpConfig
+from nlp_annotator_api.server.middleware.scheduler import (
+    DeadlineExceeded, DeadlineScheduler, DeadlineUnreachable, Overloaded
+)
+
+
+def _work(order, name, seconds=0.05):
+    async def compute():
+        order.append(name)
+        await asyncio.sleep(seconds)
+        return name
+
+    return compute
+
+
+def test_runs_earliest_deadline_first():
+    async def main():
+        scheduler = DeadlineScheduler(1, NlpConfig())
+        order = []
+        now = time.time()
+
+        tasks = [asyncio.ensure_future(scheduler.run("a", 10, None, _work(order, "busy")))]
+        await asyncio.sleep(0)
+        for name, offset in [("late", 30), ("none", None), ("early", 10)]:
+            deadline = now + offset if offset is not None else None
+            tasks.append(asyncio.ensure_future(scheduler.run("a", 10, deadline, _work(order, name))))
+            await asyncio.sleep(0)
+
+        await asyncio.gather(*tasks)
+
+        return order
+
+    assert asyncio.run(main()) == ["busy", "early", "late", "none"]
+
+
+def test_rejects_unreachable_deadline():
+    async def main():
+        scheduler = DeadlineScheduler(1, NlpConfig(min_throughput_samples=1))
+        await scheduler.run("a", 10, None, _work([], "warmup", 0.1))
+
+        with pytest.raises(DeadlineUnreachable):
+            await scheduler.run("a", 1000, time.time() + 1, _work([], "slow"))
+
+        # Without a deadline, or with enough time, the work runs
+        assert await scheduler.run("a", 10, time.time() + 10, _work([], "fast", 0)) == "fast"
+
+    asyncio.run(main())
+
+
+def test_stops_at_deadline():
+    async def main():
+        scheduler = DeadlineScheduler(1, NlpConfig())
+        order = []
+
+        busy = asyncio.ensure_future(scheduler.run("a", 10, None, _work(order, "busy", 0.2)))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(scheduler.run("a", 10, time.time() + 0.05, _work(order, "queued")))
+
+        # Fails at its deadline, while the worker is still busy
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await queued
+        assert time.monotonic() - start < 0.15
+
+        await busy
+
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.run("a", 10, time.time() + 0.1, _work(order, "running", 0.3))
+
+        # The abandoned work keeps its worker until it ends, the next work waits for it
+        assert scheduler.running == 1
+        assert await scheduler.run("a", 10, None, _work(order, "next", 0)) == "next"
+
+        assert order == ["busy", "running", "next"]
+        assert scheduler.running == 0
+
+    asyncio.run(main())
+
+
+def test_rejects_when_queue_is_full():
+    async def main():
+        scheduler = DeadlineScheduler(1, NlpConfig(max_queue_size=2))
+        order = []
+
+        tasks = [asyncio.ensure_future(scheduler.run("a", 10, None, _work(order, str(i)))) for i in range(3)]
+        await asyncio.sleep(0)
+
+        with pytest.raises(Overloaded) as exc_info:
+            await scheduler.run("a", 10, None, _work(order, "rejected"))
+
+        assert int(exc_info.value.headers["Retry-After"]) >= 1
+
+        await asyncio.gather(*tasks)
+        assert order == ["0", "1", "2"]
+
+    asyncio.run(main())
+
+
+def test_limits_concurrency_per_annotator():
+    async def main():
+        scheduler = DeadlineScheduler(2, NlpConfig(annotator_concurrency={"a": 1}))
+        order = []
+
+        tasks = [
+            asyncio.ensure_future(scheduler.run("a", 10, None, _work(order, "a1"))),
+            asyncio.ensure_future(scheduler.run("a", 10, None, _work(order, "a2"))),
+            asyncio.ensure_future(scheduler.run("b", 10, None, _work(order, "b1"))),
+        ]
+        await asyncio.sleep(0.01)
+
+        # The second request for "a" waits, while "b" uses the free worker
+        assert order == ["a1", "b1"]
+
+        await asyncio.gather(*tasks)
+        assert order == ["a1", "b1", "a2"]
+
+    asyncio.run(main())
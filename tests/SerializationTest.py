@@ -0,0 +1,22 @@
+import json
+
+import pytest
+
+from nlp_annotator_api.utils.serialization import SERIALIZERS, get_serializer
+
+
+@pytest.mark.parametrize("name", sorted(SERIALIZERS))
+def test_serializers_agree(name):
+    serializer = get_serializer(name)
+    value = {"entities": [{"cities": [{"type": "cities", "match": "Zürich", "range": [0, 6]}]}, {}]}
+
+    data = serializer.dumps(value)
+
+    assert isinstance(data, bytes)
+    assert json.loads(data) == value
+    assert serializer.loads(data) == value
+
+
+def test_unknown_serializer():
+    with pytest.raises(ValueError):
+        get_serializer("yaml")
@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import pytest
+from nlp_annotator_api.server.middleware.scheduler import DeadlineExceeded
+from nlp_annotator_api.server.middleware.single_flight import SingleFlight
+
+
+def _compute(calls, result, seconds=0.05, error=None):
+    async def compute():
+        calls.append(result)
+        await asyncio.sleep(seconds)
+        if error is not None:
+            raise error
+        return result
+
+    return compute
+
+
+def test_shares_concurrent_computations():
+    async def main():
+        single_flight = SingleFlight()
+        calls = []
+
+        results = await asyncio.gather(
+            single_flight.run(["a"], _compute(calls, "first")),
+            single_flight.run(["b", "a"], _compute(calls, "second")),
+        )
+
+        assert results == [("first", False), ("first", True)]
+        assert calls == ["first"]
+        assert len(single_flight) == 0
+
+        # Once done, the keys are computed again
+        assert await single_flight.run(["a"], _compute(calls, "third")) == ("third", False)
+
+    asyncio.run(main())
+
+
+def test_shares_errors():
+    async def main():
+        single_flight = SingleFlight()
+        calls = []
+
+        results = await asyncio.gather(
+            single_flight.run(["a"], _compute(calls, "first", error=ValueError("bad"))),
+            single_flight.run(["a"], _compute(calls, "second")),
+            return_exceptions=True,
+        )
+
+        assert [type(result) for result in results] == [ValueError, ValueError]
+        assert calls == ["first"]
+        assert len(single_flight) == 0
+
+    asyncio.run(main())
+
+
+def test_caller_cancellation_does_not_cancel_the_others():
+    async def main():
+        single_flight = SingleFlight()
+        calls = []
+
+        leader = asyncio.ensure_future(single_flight.run(["a"], _compute(calls, "first")))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(single_flight.run(["a"], _compute(calls, "second")))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+
+        assert await follower == ("first", True)
+        assert calls == ["first"]
+
+    asyncio.run(main())
+
+
+def test_followers_fail_at_their_deadline():
+    async def main():
+        single_flight = SingleFlight()
+        calls = []
+
+        leader = asyncio.ensure_future(single_flight.run(["a"], _compute(calls, "first", 0.3)))
+        await asyncio.sleep(0)
+
+        with pytest.raises(DeadlineExceeded):
+            await single_flight.run(["a"], _compute(calls, "second"), time.time() + 0.05)
+
+        assert await leader == ("first", False)
+
+    asyncio.run(main())
+
+
+def test_retries_when_the_shared_computation_missed_its_deadline():
+    async def main():
+        single_flight = SingleFlight()
+        calls = []
+        now = time.time()
+
+        results = await asyncio.gather(
+            single_flight.run(["a"], _compute(calls, "first", error=DeadlineExceeded()), now + 10),
+            # Later deadline: computes again
+            single_flight.run(["a"], _compute(calls, "second"), now + 20),
+            single_flight.run(["a"], _compute(calls, "third"), None),
+            # Earlier deadline: the error applies
+            single_flight.run(["a"], _compute(calls, "fourth"), now + 5),
+            return_exceptions=True,
+        )
+
+        assert isinstance(results[0], DeadlineExceeded)
+        # One of them computes again, the other joins it
+        assert sorted(shared for _, shared in results[1:3]) == [False, True]
+        assert results[1][0] == results[2][0]
+        assert isinstance(results[3], DeadlineExceeded)
+        assert len(calls) == 2
+
+    asyncio.run(main())
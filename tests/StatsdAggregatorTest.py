@@ -0,0 +1,39 @@
+from nlp_annotator_api.utils.statsd_aggregator import AggregatingStatsClient
+
+
+def test_aggregation():
+    client = AggregatingStatsClient(prefix="api.", max_metrics=3, max_timer_samples=10)
+
+    with client.pipeline() as pip:
+        pip.incr("requests")
+        pip.incr("requests", 2)
+        pip.gauge("queue", 4)
+        pip.gauge("queue", 5)
+
+        for value in range(100):
+            pip.timing("time", value)
+
+        pip.incr("too.many")
+
+    lines = client.lines()
+
+    assert lines[:3] == ["api.requests:3|c", "api.statsd.dropped.count:1|c", "api.queue:5|g"]
+    assert len(lines) == 13
+    assert all(line.endswith("|ms|@0.100000") for line in lines[3:])
+
+    ## Started over
+    assert client.lines() == []
+
+    client.close()
+
+
+def test_packets():
+    client = AggregatingStatsClient(max_packet_bytes=50)
+
+    lines = [f"metric.{index}:1|c" for index in range(10)]
+    packets = client.packets(lines)
+
+    assert all(len(packet) <= 50 for packet in packets)
+    assert b"\n".join(packets).decode().split("\n") == lines
+
+    client.close()